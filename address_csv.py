@@ -0,0 +1,139 @@
+#*****************************************************************************
+#
+#  Project:  Mailing Address CSV Writer
+#  Purpose:  Writes the owner address CSVs for mailing_list.py and
+#            public_notice.py, consolidating owners with several parcels
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# The CSVs are '|' delimited with a "sep=|" first line so Excel opens them
+# correctly. Without consolidation there is one row per parcel, so an owner
+# with 30 parcels in the notice area gets 30 identical letters.
+#
+# With consolidation, rows are grouped on their owner and address fields
+# after normalizing them (upper case, no punctuation, single spaces), using
+# the normalized values as a dictionary key so each row is one hash lookup.
+# The first row of each group is kept, with every parcel number in the group
+# listed in its parcel number column. Groups are written in the order their
+# first parcel was read, straight to the output file. A row with a missing
+# owner or address field is never grouped: two parcels that are both missing
+# an owner aren't necessarily owned by the same person.
+
+import csv
+import re
+
+DELIMITER = '|'
+
+# Separator between the parcel numbers of a consolidated row
+PARCEL_SEPARATOR = ", "
+
+# re.UNICODE so Python 2 keeps accented letters in owner names
+_punctuation = re.compile(r"[^\w\s]", re.UNICODE)
+_whitespace = re.compile(r"\s+", re.UNICODE)
+
+
+def _Text(value):
+    # Leave strings (including unicode on Python 2) alone
+    return value if hasattr(value, "upper") else str(value)
+
+
+def Normalize(value):
+    '''
+    Returns an owner name or address normalized for comparison: upper case,
+    punctuation removed, and runs of whitespace collapsed to one space.
+    '''
+    if value is None:
+        return ""
+    value = _punctuation.sub(" ", _Text(value).upper())
+    return _whitespace.sub(" ", value).strip()
+
+
+def ConsolidateRows(rows, key_index):
+    '''
+    Groups rows that are the same except for the parcel number.
+
+    rows: Iterable of row tuples
+    key_index: Position of the parcel number in each row
+
+    Returns: List of rows, one per owner/address, with the group's parcel
+             numbers joined by PARCEL_SEPARATOR at key_index
+    '''
+    groups = {}
+    order = []
+    for row in rows:
+        key = tuple(Normalize(v) for i, v in enumerate(row) if i != key_index)
+        if "" in key:
+            # Missing data; keep the row on its own
+            key = (None, len(order))
+        if key in groups:
+            parcels = groups[key][1]
+            if row[key_index] not in parcels:
+                parcels.append(row[key_index])
+        else:
+            groups[key] = (row, [row[key_index]])
+            order.append(key)
+
+    consolidated = []
+    for key in order:
+        row, parcels = groups[key]
+        row = list(row)
+        row[key_index] = PARCEL_SEPARATOR.join(_Text(p) for p in parcels)
+        consolidated.append(row)
+    return consolidated
+
+
+def WriteAddresses(out_file, assessor, parcels, key_field, address_fields,
+                   consolidate=True):
+    '''
+    Writes the address CSV for the parcels to an open file (or StringIO).
+
+    out_file: Open file-like object to write to
+    assessor: assessor_cache.AssessorSnapshot holding the address fields
+    parcels: Parcel numbers to write, in order
+    key_field: Parcel number field of the assessor table
+    address_fields: Fields to write. If consolidating and key_field isn't
+                    one of them, it's added as the first column.
+    consolidate: Whether to combine rows with the same owner and address
+
+    Returns: Number of data rows written
+    '''
+    fields = list(address_fields)
+    if consolidate and key_field not in fields:
+        fields.insert(0, key_field)
+
+    out_file.write("sep={}\n".format(DELIMITER))
+    writer = csv.writer(out_file, delimiter=DELIMITER, lineterminator='\n')
+    writer.writerow(fields)
+
+    rows = assessor.Rows(parcels, fields)
+    if consolidate:
+        rows = ConsolidateRows(rows, fields.index(key_field))
+
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
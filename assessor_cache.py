@@ -0,0 +1,203 @@
+#*****************************************************************************
+#
+#  Project:  Assessor Snapshot Cache
+#  Purpose:  Keyed in-memory copy of the assessor table's address fields so
+#            mailing list lookups are dictionary hits instead of queries
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# The whole assessor table (just the key field and the address fields, and
+# only the rows passing a table view's definition query) is read with one
+# cursor and stored column by column: one list per field plus
+# a dictionary from parcel number to row positions. Looking up the owner
+# info for a list of parcels is then a dictionary lookup per parcel.
+#
+# Snapshots are cached at module level, which persists between requests in a
+# geoprocessing service, and are rebuilt when the table's data version (row
+# count plus latest edit date; see data_version.py) changes, checked at most
+# every check_interval seconds. Without editor tracking on the table, an
+# owner or address edit doesn't change the version, so the snapshot is also
+# rebuilt once it is data_version.UNTRACKED_MAX_AGE seconds old; mailing
+# lists are never more out of date than that.
+#
+# If a cache_folder is given, the snapshot is also pickled there so a freshly
+# started service process can load it from disk (after checking the version)
+# instead of reading the whole table.
+
+import arcpy
+import hashlib
+import os
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import data_version
+import parcel_index
+
+# Seconds between checks of the assessor table for changes
+DEFAULT_CHECK_INTERVAL = 30
+
+# {(table source, key field, where clause): [snapshot, last_check_time]}
+_snapshots = {}
+
+
+class AssessorSnapshot(object):
+    '''
+    Columnar copy of a table keyed by one field. Use GetSnapshot() instead of
+    creating these directly so the snapshot is cached.
+    '''
+
+    def __init__(self, table, key_field, fields, version, where_clause=None):
+        '''
+        table: Table to copy (catalog path)
+        key_field: Field to key the rows by (ie, parcel_number)
+        fields: Other fields to copy
+        version: data_version token of the table
+        where_clause: Optional query limiting the rows copied
+        '''
+        self.key_field = key_field
+        self.fields = [key_field] + [f for f in fields if f != key_field]
+        self.version = version
+        self.where_clause = where_clause
+        self.built = time.time()
+
+        self.columns = dict((f, []) for f in self.fields)
+        self.positions = {}
+        with arcpy.da.SearchCursor(table, self.fields, where_clause) as sc:
+            for i, row in enumerate(sc):
+                for field, value in zip(self.fields, row):
+                    self.columns[field].append(value)
+                self.positions.setdefault(row[0], []).append(i)
+
+    def HasFields(self, fields):
+        return all(f in self.columns for f in fields)
+
+    def Rows(self, keys, fields):
+        '''
+        Yields a tuple of the requested fields for every row matching one of
+        the keys, in the order of the keys. Keys with no rows are skipped.
+        '''
+        columns = [self.columns[f] for f in fields]
+        for key in keys:
+            for i in self.positions.get(key, []):
+                yield tuple(c[i] for c in columns)
+
+    def Missing(self, keys):
+        '''
+        Returns the keys that have no rows in the snapshot.
+        '''
+        return [k for k in keys if k not in self.positions]
+
+
+def _CachePath(cache_folder, source, key_field, where_clause):
+    name = "{}_{}".format(os.path.basename(source), key_field)
+    if where_clause:
+        name += "_" + hashlib.md5(where_clause.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_folder, name.replace(os.sep, "_") + ".pickle")
+
+
+def _LoadFromDisk(path, source, version, fields, where_clause):
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except Exception:
+        return None
+    if snapshot.version != version or not snapshot.HasFields(fields):
+        return None
+    if getattr(snapshot, "where_clause", None) != where_clause:
+        return None
+    if data_version.Expired(source, getattr(snapshot, "built", 0)):
+        return None
+    return snapshot
+
+
+def _SaveToDisk(path, snapshot):
+    try:
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump(snapshot, f, 2)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(path + ".tmp", path)
+    except Exception as e:
+        arcpy.AddWarning("Could not save assessor snapshot: {}".format(e))
+
+
+def GetSnapshot(table, key_field, fields, check_interval=DEFAULT_CHECK_INTERVAL,
+                cache_folder=None, where_clause=None):
+    '''
+    Returns a cached AssessorSnapshot of the table with at least the given
+    fields, building it if needed or if the table has changed.
+
+    table: Assessor table or table view. The rows passing the view's
+           definition query are copied, regardless of any selection.
+    key_field: Field to key the rows by
+    fields: Fields that will be requested from the snapshot
+    check_interval: Seconds between checks of the table for changes
+    cache_folder: Optional folder for an on-disk copy of the snapshot
+    where_clause: Query to use in place of the view's definition query (ie,
+                  for a worker that only has the table path)
+    '''
+    source = arcpy.Describe(table).catalogPath
+    where_clause = where_clause or parcel_index.LayerWhereClause(table)
+    key = (source, key_field, where_clause)
+    now = time.time()
+
+    version = None
+    if key in _snapshots:
+        snapshot, last_check = _snapshots[key]
+        if snapshot.HasFields(fields):
+            if now - last_check < check_interval:
+                return snapshot
+            version = data_version.GetDataVersion(source)
+            if (version == snapshot.version and
+                    not data_version.Expired(source, snapshot.built)):
+                _snapshots[key][1] = now
+                return snapshot
+        # Keep any fields the existing snapshot was already serving
+        fields = list(fields) + [f for f in snapshot.fields if f not in fields]
+
+    if version is None:
+        version = data_version.GetDataVersion(source)
+
+    snapshot = None
+    if cache_folder:
+        path = _CachePath(cache_folder, source, key_field, where_clause)
+        snapshot = _LoadFromDisk(path, source, version, fields, where_clause)
+
+    if snapshot is None:
+        snapshot = AssessorSnapshot(source, key_field, fields, version,
+                                    where_clause)
+        if cache_folder:
+            _SaveToDisk(path, snapshot)
+
+    _snapshots[key] = [snapshot, now]
+    return snapshot
@@ -0,0 +1,140 @@
+#*****************************************************************************
+#
+#  Project:  Batch Address to Precinct Analysis Tool
+#  Purpose:  Determine voting precincts for a whole table of addresses
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# !!!!!!
+#
+# NOTE!
+#
+# Like precinct_finder.py, this tool has not been tested extensively and
+# should not be relied on for official voting info.
+#
+# !!!!!!
+
+# ==============================================================================
+# Batch version of precinct_finder.py:
+#   1. Geocodes every address in the input table with composite_geocoder,
+#      in chunks spread across worker processes. Each chunk tries the
+#      locators in order, only passing its unmatched addresses on to the next
+#      locator.
+#   2. Projects all the matched points to Web Mercator and to the precinct
+#      layer's projection as whole coordinate arrays (projection_cache).
+#   3. Looks up each point's precinct in the precinct grid (precinct_grid).
+#   4. Writes a CSV with the input OBJECTID, address, match status, locator,
+#      Web Mercator x/y, and precinct for every input row.
+#
+# Run this as a stand-alone script or a script tool that runs out-of-process;
+# see worker_pool.py for why the tool code lives under __main__.
+# ==============================================================================
+
+import arcpy
+import csv
+import os
+import sys
+import traceback
+
+import composite_geocoder
+import precinct_grid
+import projection_cache
+
+
+if __name__ == '__main__':
+    address_table = arcpy.GetParameterAsText(0)  # Table View
+    address_field = arcpy.GetParameterAsText(1)  # Field, from address_table
+    locators = arcpy.GetParameterAsText(2).split(";")  # Multivalue Address Locator, in order of preference
+    precinct_layer = arcpy.GetParameterAsText(3)  # Feature Layer
+    precinct_field = arcpy.GetParameterAsText(4)  # Field, from precinct_layer
+    chunk_size = arcpy.GetParameter(5)  # Optional; Long
+    workers = arcpy.GetParameter(6)  # Optional; Long
+    # Parameter 7 is the output csv- file, derived output
+
+    try:
+        if not chunk_size:
+            chunk_size = composite_geocoder.DEFAULT_CHUNK_SIZE
+
+        arcpy.AddMessage("Reading addresses...")
+        with arcpy.da.SearchCursor(address_table, ["OID@", address_field]) as sc:
+            rows = [(r[0], r[1] or "") for r in sc]
+
+        arcpy.AddMessage("Geocoding {} addresses with {} locator(s)...".format(
+            len(rows), len(locators)))
+        matches = composite_geocoder.GeocodeChunks(rows, locators, chunk_size,
+                                                   workers)
+        arcpy.AddMessage("Matched {} of {} addresses.".format(len(matches),
+                                                              len(rows)))
+
+        arcpy.AddMessage("Finding precincts...")
+        grid = precinct_grid.GetGrid(precinct_layer, precinct_field)
+
+        # Each locator may use a different projection, so project each group
+        # of matches as a whole
+        groups = {}
+        for row_id, match in matches.items():
+            groups.setdefault(match[4], []).append(row_id)
+
+        # {row id: (web x, web y, precinct)}
+        located = {}
+        for sr_string, ids in groups.items():
+            xs = [matches[i][0] for i in ids]
+            ys = [matches[i][1] for i in ids]
+            web_xs, web_ys = projection_cache.ProjectXYArrays(
+                xs, ys, sr_string, projection_cache.WEB_MERCATOR)
+            grid_xs, grid_ys = projection_cache.ProjectXYArrays(
+                xs, ys, sr_string, grid.spatial_reference)
+            for i, row_id in enumerate(ids):
+                located[row_id] = (web_xs[i], web_ys[i],
+                                   grid.Lookup(grid_xs[i], grid_ys[i]))
+
+        arcpy.AddMessage("Creating CSV...")
+        csv_file = os.path.join(arcpy.env.scratchFolder, "Precincts.csv")
+        with open(csv_file, 'w') as csvfile:
+            csvfile.write("sep=|\n")
+            writer = csv.writer(csvfile, delimiter='|', lineterminator='\n')
+            writer.writerow(["OBJECTID", "address", "status", "locator", "x",
+                             "y", "precinct"])
+            for row_id, address in rows:
+                if row_id in located:
+                    status = matches[row_id][2]
+                    locator = locators[matches[row_id][3]]
+                    x, y, precinct = located[row_id]
+                    writer.writerow([row_id, address, status, locator, x, y,
+                                     "" if precinct is None else precinct])
+                else:
+                    writer.writerow([row_id, address, "U", "", "", "", ""])
+
+        arcpy.SetParameter(7, csv_file)
+
+    except arcpy.ExecuteError:
+        arcpy.AddError(arcpy.GetMessages(2))
+
+    except:
+        tb = sys.exc_info()[2]
+        tbinfo = traceback.format_tb(tb)[0]
+        pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+        arcpy.AddError(pymsg)
@@ -0,0 +1,226 @@
+#*****************************************************************************
+#
+#  Project:  Batch Land Use Projects Script Tool
+#  Purpose:  Creates several land use projects at once from a CSV, along with
+#            each project's mailing list and maps
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# The batch version of public_notice.py for the start of a planning
+# commission cycle. The CSV has a header row and one project per row:
+#
+#   tids            Parcel IDs, separated by spaces or ';' (required)
+#   type            Project type (required)
+#   name            Project name (required)
+#   meeting_date    Next meeting date (required)
+#   status          Project status (required)
+#   buffer          Notice distance in feet (required)
+#   address, summary, staff_report, lua    Optional
+#
+# All the rows are checked before anything is written, and every parcel is
+# validated in one query and read with one cursor. The polygons are inserted
+# in a single edit operation, so either all of the projects are added or none
+# are. The mailing lists share one parcel index and assessor snapshot, and
+# the maps are exported by a pool of worker processes (see
+# map_export_worker.py). Everything comes back in one zip with a folder per
+# project.
+
+import arcpy
+import csv
+import os
+import re
+import sys
+import traceback
+import zipfile
+
+import lu_projects
+import map_export_worker
+import notice_products
+import parcel_lookup
+import publish_projects
+import worker_pool
+
+REQUIRED_COLUMNS = ["tids", "type", "name", "meeting_date", "status", "buffer"]
+OPTIONAL_COLUMNS = ["address", "summary", "staff_report", "lua"]
+
+parcel_tid_field = "tax_id"
+table_tid_field = "parcel_number"
+
+
+def ReadProjects(batch_file):
+    '''
+    Reads and checks the project rows of the batch CSV.
+
+    Returns: List of dictionaries, one per project, with every column and
+             "tids" as a list
+    '''
+    projects = []
+    with open(batch_file, 'r') as f:
+        reader = csv.reader(f)
+        header = [h.strip().lower() for h in next(reader)]
+        missing = [c for c in REQUIRED_COLUMNS if c not in header]
+        if missing:
+            raise ValueError("Batch file is missing column(s): " + ", ".join(missing))
+
+        for line, row in enumerate(reader, 2):
+            if not any(v.strip() for v in row):
+                continue
+            project = dict((c, "") for c in OPTIONAL_COLUMNS)
+            project.update((k, v.strip()) for k, v in zip(header, row))
+            project["tids"] = [t for t in re.split(r"[;\s]+", project["tids"]) if t]
+
+            for column in REQUIRED_COLUMNS:
+                if not project[column]:
+                    raise ValueError("Line {}: {} is required.".format(line, column))
+            if re.search(lu_projects.NAME_PATTERN, project["name"]):
+                raise ValueError("Line {}: Project names cannot contain the following characters: <>:\"/\\|?*".format(line))
+            if int(project["buffer"]) > notice_products.BUFFER_MAX:
+                raise ValueError("Line {}: Buffer cannot be greater than {} feet".format(line, notice_products.BUFFER_MAX))
+            projects.append(project)
+
+    # Each project gets a folder named after it, and Windows folder names
+    # ignore case
+    names = [p["name"].lower() for p in projects]
+    duplicates = sorted(set(p["name"] for p in projects
+                            if names.count(p["name"].lower()) > 1))
+    if duplicates:
+        raise ValueError("Project names must be unique: " + ", ".join(duplicates))
+    if not projects:
+        raise ValueError("No projects in batch file.")
+    return projects
+
+
+if __name__ == '__main__':
+    batch_file = arcpy.GetParameterAsText(0) # File, CSV of projects
+    parcel_layer = arcpy.GetParameterAsText(1) # Layer of the mxd
+    projects_layer = arcpy.GetParameterAsText(2) # Layer of the mxd
+    mxd_file = arcpy.GetParameterAsText(3)
+    solo_table = arcpy.GetParameterAsText(4) # Table in mxd
+    default_lua = arcpy.GetParameterAsText(5) # Land use authority for rows that don't give one
+    # Parameter 6 is the zip of every project's products- File, derived output
+    # Parameter 7 is messages- String, derived output
+    imagery_cache_folder = arcpy.GetParameterAsText(8) # Optional; Folder for cached imagery tiles
+    imagery_url = arcpy.GetParameterAsText(9) # Optional; Image service REST URL for the cache
+    consolidate_raw = arcpy.GetParameterAsText(10) # Optional; Boolean, default True- one CSV row per owner/address
+    export_profile = arcpy.GetParameterAsText(11) # Optional; String: full (600 dpi jpg, default), web, print, or thumbnail
+    public_file = arcpy.GetParameterAsText(12) # Optional; File, GeoJSON of active projects for the public map (see publish_projects.py)
+
+    # Omitted optional parameters can come through as "#"
+    imagery_cache_folder, imagery_url, export_profile, public_file = [
+        "" if value == "#" else value for value in
+        (imagery_cache_folder, imagery_url, export_profile, public_file)]
+
+    messages = []
+
+    try:
+        projects = ReadProjects(batch_file)
+        consolidate = consolidate_raw.lower() != "false"
+        map_export_worker.GetProfile(export_profile)
+
+        # Cursors on a layer only see its selected rows
+        arcpy.SelectLayerByAttribute_management(parcel_layer, "CLEAR_SELECTION")
+
+        # ========= Validate all the parcels in one query ===========
+        all_tids = sorted(set(t for p in projects for t in p["tids"]))
+        parcel_lookup.CheckParcelIDs(all_tids, parcel_layer, parcel_tid_field)
+
+        # ========= Add all the project polygons in one edit operation ===========
+        arcpy.AddMessage("Creating {} LU Project Polygons...".format(len(projects)))
+        messages.append("Creating {} LU Project Polygons...".format(len(projects)))
+        geometries = lu_projects.ParcelGeometries(parcel_layer, parcel_tid_field,
+                                                  [p["tids"] for p in projects])
+        rows = []
+        for project, geometry in zip(projects, geometries):
+            rows.append(lu_projects.ProjectRow(
+                geometry, project["type"], project["name"], project["address"],
+                project["summary"], project["meeting_date"],
+                project["staff_report"], project["status"], project["tids"],
+                project["lua"] or default_lua))
+        lu_projects.InsertProjects(projects_layer, rows)
+
+        # The projects are saved, so a failure here is only a warning
+        if public_file:
+            try:
+                publish_projects.Publish(projects_layer, public_file)
+            except Exception as e:
+                arcpy.AddWarning("Could not publish projects: {}".format(e))
+                messages.append("Projects added, but the public project map could not be updated: {}".format(e))
+
+        # ========= Mailing lists ===========
+        # The parcel index and assessor snapshot are loaded once and shared
+        arcpy.AddMessage("Creating mailing lists...")
+        messages.append("Creating mailing lists...")
+        folders = []
+        for project in projects:
+            folder = os.path.join(arcpy.env.scratchFolder, project["name"])
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            folders.append(folder)
+            notice_products.CreateMailingList(
+                parcel_layer, parcel_tid_field, project["tids"],
+                project["buffer"], solo_table, table_tid_field, folder,
+                consolidate=consolidate)
+
+        # ========= Maps ===========
+        # Every project's vicinity and aerial maps go to one pool of export
+        # workers
+        arcpy.AddMessage("Creating maps...")
+        messages.append("Creating maps...")
+        jobs = []
+        for project, geometry, folder in zip(projects, geometries, folders):
+            jobs.extend(notice_products.MapJobs(
+                mxd_file, project["tids"], parcel_tid_field, project["name"],
+                geometry.extent, folder, imagery_cache_folder, imagery_url,
+                export_profile))
+        map_export_worker.ExportMaps(jobs, arcpy.env.scratchFolder,
+                                     worker_pool.DefaultWorkers())
+
+        # ========= Zip everything up ===========
+        zip_path = os.path.join(arcpy.env.scratchFolder, "Projects.zip")
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as z:
+            for project, folder in zip(projects, folders):
+                for name in os.listdir(folder):
+                    if os.path.splitext(name)[1] in (".csv", ".jpg", ".png", ".pdf"):
+                        z.write(os.path.join(folder, name),
+                                os.path.join(project["name"], name))
+        arcpy.SetParameter(6, zip_path)
+        messages.append("Created {} projects.".format(len(projects)))
+
+    except Exception as ex:
+        tb = sys.exc_info()[2]
+        tbinfo = traceback.format_tb(tb)[0]
+        pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+        msgs = "\nArcPy ERRORS:\n" + arcpy.GetMessages(2) + "\n"
+
+        # Log the errors as warnings on the server (adding as errors would cause the task to fail)
+        arcpy.AddWarning(pymsg)
+        arcpy.AddWarning(msgs)
+
+        messages.append(" --- ERROR: ")
+        messages.append(str(ex))
+
+    finally:
+        arcpy.SetParameterAsText(7, "\n".join(messages))
@@ -0,0 +1,259 @@
+#*****************************************************************************
+#
+#  Project:  Benchmark arcpy Stand-in
+#  Purpose:  Just enough of the arcpy layer/cursor/geometry API, backed by
+#            in-memory tables, to run the mailing list code without ArcGIS
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Only what parcel_lookup, data_version, parcel_index, assessor_cache, and
+# address_csv use is here. Tables are registered by name with AddTable() and
+# every path or layer name resolves to the table itself (there are no
+# selections or definition queries).
+#
+# Polygons are unions of axis-aligned rectangles, which is what the synthetic
+# parcel fabric is made of, so distanceTo(), union(), and buffer() are exact
+# (buffer() keeps square corners). Query costs won't match a real geodatabase;
+# the point is to time the Python side of the tools, which is where most of
+# their work now happens.
+
+import re
+
+_tables = {}
+
+_in_clause = re.compile(r"^\s*(\w+)\s+IN\s*\((.*)\)\s*$", re.IGNORECASE)
+_not_null = re.compile(r"^\s*(\w+)\s+IS\s+NOT\s+NULL\s*$", re.IGNORECASE)
+_order_by = re.compile(r"ORDER\s+BY\s+(\w+)(\s+DESC)?", re.IGNORECASE)
+_quoted = re.compile(r"'((?:[^']|'')*)'")
+
+
+class ExecuteError(Exception):
+    pass
+
+
+class _Env(object):
+    scratchGDB = "in_memory"
+    scratchFolder = "."
+    overwriteOutput = True
+
+
+env = _Env()
+
+
+class Table(object):
+    '''
+    In-memory table: field names, rows as lists, and an optional spatial
+    reference. The first field is the ObjectID.
+    '''
+
+    def __init__(self, name, fields, rows, spatial_reference=None):
+        self.name = name
+        self.fields = ["OBJECTID"] + list(fields)
+        self.rows = [[i + 1] + list(r) for i, r in enumerate(rows)]
+        self.spatialReference = spatial_reference
+
+    def Index(self, field):
+        if field == "SHAPE@":
+            field = "SHAPE"
+        for i, name in enumerate(self.fields):
+            if name.lower() == field.lower():
+                return i
+        raise ExecuteError("Field {} does not exist in {}".format(field, self.name))
+
+
+def AddTable(table):
+    _tables[table.name] = table
+    return table
+
+
+def _GetTable(name):
+    if isinstance(name, Table):
+        return name
+    if name not in _tables:
+        raise ExecuteError("Dataset {} does not exist".format(name))
+    return _tables[name]
+
+
+# ======== Messages ========
+_messages = []
+
+
+def AddMessage(message):
+    _messages.append(message)
+
+
+def AddWarning(message):
+    _messages.append(message)
+
+
+def AddError(message):
+    _messages.append(message)
+
+
+def GetMessages(severity=0):
+    return "\n".join(_messages)
+
+
+# ======== Describe / tools ========
+class _Describe(object):
+    def __init__(self, table):
+        self.catalogPath = table.name
+        self.name = table.name
+        self.spatialReference = table.spatialReference
+        self.OIDFieldName = "OBJECTID"
+        self.editorTrackingEnabled = False
+        self.dataType = "Table"
+
+
+def Describe(name):
+    return _Describe(_GetTable(name))
+
+
+class _Result(object):
+    def __init__(self, value):
+        self.value = value
+
+    def getOutput(self, index):
+        return self.value
+
+
+def GetCount_management(name):
+    return _Result(str(len(_GetTable(name).rows)))
+
+
+def Exists(name):
+    return name in _tables
+
+
+def Delete_management(name):
+    _tables.pop(name, None)
+
+
+class SpatialReference(object):
+    def __init__(self, factory_code=None):
+        self.factoryCode = factory_code
+
+
+# ======== Geometry ========
+class Extent(object):
+    def __init__(self, XMin, YMin, XMax, YMax):
+        self.XMin = XMin
+        self.YMin = YMin
+        self.XMax = XMax
+        self.YMax = YMax
+
+
+def _BoxDistance(a, b):
+    dx = max(b[0] - a[2], a[0] - b[2], 0)
+    dy = max(b[1] - a[3], a[1] - b[3], 0)
+    return (dx * dx + dy * dy) ** 0.5
+
+
+class Polygon(object):
+    '''
+    Union of (xmin, ymin, xmax, ymax) rectangles.
+    '''
+
+    def __init__(self, boxes, spatial_reference=None):
+        self.boxes = list(boxes)
+        self.spatialReference = spatial_reference
+
+    @property
+    def extent(self):
+        return Extent(min(b[0] for b in self.boxes), min(b[1] for b in self.boxes),
+                      max(b[2] for b in self.boxes), max(b[3] for b in self.boxes))
+
+    def distanceTo(self, other):
+        return min(_BoxDistance(a, b) for a in self.boxes for b in other.boxes)
+
+    def union(self, other):
+        return Polygon(self.boxes + other.boxes, self.spatialReference)
+
+    def buffer(self, distance):
+        return Polygon([(b[0] - distance, b[1] - distance,
+                         b[2] + distance, b[3] + distance) for b in self.boxes],
+                       self.spatialReference)
+
+    def generalize(self, max_offset):
+        return self
+
+
+# ======== Cursors ========
+def _Filter(table, where_clause):
+    if not where_clause:
+        return table.rows
+
+    match = _in_clause.match(where_clause)
+    if match:
+        i = table.Index(match.group(1))
+        values = set(v.replace("''", "'") for v in _quoted.findall(match.group(2)))
+        return [r for r in table.rows if r[i] in values]
+
+    match = _not_null.match(where_clause)
+    if match:
+        i = table.Index(match.group(1))
+        return [r for r in table.rows if r[i] is not None]
+
+    raise ExecuteError("Unsupported where clause: {}".format(where_clause))
+
+
+class _SearchCursor(object):
+    def __init__(self, name, fields, where_clause=None, spatial_reference=None,
+                 explode_to_points=False, sql_clause=(None, None)):
+        table = _GetTable(name)
+        if isinstance(fields, str):
+            fields = [fields]
+        indexes = [table.Index(f) for f in fields]
+
+        rows = _Filter(table, where_clause)
+        if sql_clause and sql_clause[1]:
+            match = _order_by.search(sql_clause[1])
+            if match:
+                i = table.Index(match.group(1))
+                rows = sorted(rows, key=lambda r: r[i], reverse=bool(match.group(2)))
+
+        self._rows = (tuple(r[i] for i in indexes) for r in rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def next(self):
+        return next(self._rows)
+
+    __next__ = next
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._rows = iter(())
+
+
+class _Da(object):
+    SearchCursor = _SearchCursor
+
+
+da = _Da()
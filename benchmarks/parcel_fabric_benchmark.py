@@ -0,0 +1,241 @@
+#*****************************************************************************
+#
+#  Project:  Parcel Fabric Benchmark
+#  Purpose:  Times the mailing list / public notice pipeline against
+#            synthetic parcel fabrics, without ArcGIS
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Builds a synthetic parcel fabric (a jittered grid of rectangular parcels,
+# roughly county-sized lots in feet) and a matching assessor table where some
+# owners hold several parcels, registers both with fake_arcpy in place of
+# arcpy, and times each stage of a notice run with the repo's own modules:
+#
+#   load_index    parcel_index.ParcelIndex build (once per fabric)
+#   load_assessor assessor_cache.AssessorSnapshot build (once per fabric)
+#   validation    parcel_lookup.CheckParcelIDs (format check and one
+#                 FindKeys query), as called by mailing_list.py
+#   neighbors     ParcelIndex.NeighborPositions for the subject parcels
+#   assessor      AssessorSnapshot.Rows for the neighbors
+#   csv           address_csv.WriteAddresses to a StringIO
+#
+# mailing_list.py and public_notice.py (through notice_products.py) share
+# every one of these stages; the map exports and adding the project polygon
+# can only be timed in ArcGIS.
+#
+# Run from anywhere:
+#   python benchmarks/parcel_fabric_benchmark.py
+#   python benchmarks/parcel_fabric_benchmark.py --sizes 10000 50000 --distances 300 1000
+#
+# Results are printed as a table of median milliseconds per stage.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import fake_arcpy
+sys.modules["arcpy"] = fake_arcpy
+
+import address_csv
+import assessor_cache
+import data_version
+import parcel_index
+import parcel_lookup
+
+DEFAULT_SIZES = [10000, 100000, 500000]
+DEFAULT_DISTANCES = [300, 500, 1000, 2640]
+DEFAULT_SUBJECT_COUNTS = [1, 5, 25]
+
+PARCEL_FC = "parcels"
+ASSESSOR_TABLE = "assessor"
+TID_FIELD = "tax_id"
+TABLE_TID_FIELD = "parcel_number"
+ADDRESS_FIELDS = ["parcel_number", "owner_name", "owner_address1",
+                  "owner_city_state_zip"]
+
+# Average lot size and the street gap between lots, in feet
+LOT_SIZE = 150.0
+STREET_WIDTH = 30.0
+
+# Fraction of parcels that belong to an owner with several parcels
+MULTI_OWNER_SHARE = 0.15
+
+
+def MakeTID(i):
+    return "{:02d}-{:03d}-{:04d}".format(i // 10000000 % 100,
+                                          i // 10000 % 1000, i % 10000)
+
+
+def BuildFabric(size, seed=0):
+    '''
+    Registers a parcel feature class and assessor table with size parcels.
+    '''
+    rng = random.Random(seed)
+    columns = int(size ** 0.5) or 1
+    pitch = LOT_SIZE + STREET_WIDTH
+
+    parcels = []
+    for i in range(size):
+        row, column = divmod(i, columns)
+        x = column * pitch + rng.uniform(0, STREET_WIDTH / 2)
+        y = row * pitch + rng.uniform(0, STREET_WIDTH / 2)
+        width = LOT_SIZE * rng.uniform(0.6, 1.0)
+        height = LOT_SIZE * rng.uniform(0.6, 1.0)
+        parcels.append((MakeTID(i), fake_arcpy.Polygon([(x, y, x + width, y + height)])))
+
+    # Multi-parcel owners are entered with slightly different punctuation and
+    # case on each parcel, like the real assessor data
+    owners = []
+    multi_owners = max(1, int(size * MULTI_OWNER_SHARE / 5))
+    for i in range(size):
+        if rng.random() < MULTI_OWNER_SHARE:
+            owner = rng.randrange(multi_owners)
+            name = "Smith, John {}".format(owner)
+            if rng.random() < 0.5:
+                name = name.upper().replace(",", "")
+            owners.append((MakeTID(i), name, "{} N Main St.".format(owner),
+                           "Logan, UT 84321"))
+        else:
+            owners.append((MakeTID(i), "Owner {}".format(i),
+                           "{} E Center St".format(i), "Logan, UT 84321"))
+
+    fake_arcpy.AddTable(fake_arcpy.Table(PARCEL_FC, [TID_FIELD, "SHAPE"], parcels,
+                                         fake_arcpy.SpatialReference(3566)))
+    fake_arcpy.AddTable(fake_arcpy.Table(ASSESSOR_TABLE, ADDRESS_FIELDS, owners))
+
+
+class Timings(object):
+    def __init__(self):
+        self.times = {}
+
+    def Time(self, stage, function, *args):
+        start = time.time()
+        result = function(*args)
+        self.times.setdefault(stage, []).append((time.time() - start) * 1000)
+        return result
+
+    def Median(self, stage):
+        values = sorted(self.times.get(stage, []))
+        if not values:
+            return 0.0
+        return values[len(values) // 2]
+
+
+def WriteCSV(assessor, parcels):
+    out = StringIO()
+    return address_csv.WriteAddresses(out, assessor, parcels, TABLE_TID_FIELD,
+                                      ADDRESS_FIELDS)
+
+
+def SubjectParcels(size, count, rng):
+    # A contiguous block of parcels in the middle of the fabric
+    columns = int(size ** 0.5) or 1
+    start = rng.randrange(size // 4, max(size // 4 + 1, size * 3 // 4))
+    tids = []
+    for i in range(count):
+        row, column = divmod(i, 5)
+        position = start + row * columns + column
+        if position < size:
+            tids.append(MakeTID(position))
+    return tids
+
+
+def RunFabric(size, distances, subject_counts, repeat):
+    print("Building fabric of {} parcels...".format(size))
+    BuildFabric(size)
+    timings = Timings()
+
+    version = data_version.GetDataVersion(PARCEL_FC)
+    index = timings.Time("load_index", parcel_index.ParcelIndex, PARCEL_FC,
+                         TID_FIELD, version)
+    assessor = timings.Time("load_assessor", assessor_cache.AssessorSnapshot,
+                            ASSESSOR_TABLE, TABLE_TID_FIELD, ADDRESS_FIELDS,
+                            data_version.GetDataVersion(ASSESSOR_TABLE))
+    print("  load_index {:.0f} ms, load_assessor {:.0f} ms".format(
+        timings.Median("load_index"), timings.Median("load_assessor")))
+
+    rng = random.Random(size)
+    results = []
+    for distance in distances:
+        for count in subject_counts:
+            run = Timings()
+            neighbor_count = rows = 0
+            for _ in range(repeat):
+                tids = SubjectParcels(size, count, rng)
+                run.Time("validation", parcel_lookup.CheckParcelIDs, tids,
+                         PARCEL_FC, TID_FIELD)
+                positions = run.Time("neighbors", index.NeighborPositions,
+                                     tids, float(distance))
+                parcels = sorted(set(index.tids[i] for i in positions))
+                run.Time("assessor", lambda: list(assessor.Rows(parcels, ADDRESS_FIELDS)))
+                rows = run.Time("csv", WriteCSV, assessor, parcels)
+                neighbor_count = len(parcels)
+            results.append((size, distance, count, neighbor_count, rows, run))
+    return results
+
+
+def PrintResults(results):
+    stages = ["validation", "neighbors", "assessor", "csv"]
+    header = ["parcels", "distance", "subjects", "neighbors", "csv_rows"] + stages
+    print("")
+    print(" ".join("{:>10}".format(h) for h in header))
+    for size, distance, count, neighbors, rows, run in results:
+        values = [size, distance, count, neighbors, rows]
+        line = ["{:>10}".format(v) for v in values]
+        line += ["{:>10.1f}".format(run.Median(s)) for s in stages]
+        print(" ".join(line))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Times the mailing list pipeline on synthetic parcel fabrics")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Number of parcels in each fabric")
+    parser.add_argument("--distances", type=int, nargs="+",
+                        default=DEFAULT_DISTANCES, help="Notice distances (ft)")
+    parser.add_argument("--subjects", type=int, nargs="+",
+                        default=DEFAULT_SUBJECT_COUNTS,
+                        help="Number of subject parcels per notice")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs per combination (the median is reported)")
+    args = parser.parse_args()
+
+    all_results = []
+    for size in args.sizes:
+        all_results.extend(RunFabric(size, args.distances, args.subjects,
+                                     args.repeat))
+    PrintResults(all_results)
@@ -0,0 +1,205 @@
+#*****************************************************************************
+#
+#  Project:  Composite Geocoder
+#  Purpose:  Geocode addresses against an ordered list of locators, sending
+#            each locator's unmatched addresses on to the next one
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Locators are tried in order (for example: address points, then street
+# centerlines, then a regional locator). Each locator ("tier") geocodes a
+# whole table of addresses in one GeocodeAddresses call, and only the
+# addresses it couldn't match are copied into a new table for the next tier.
+#
+# For batches, GeocodeChunks() splits the addresses into chunks and hands the
+# chunks to a pool of worker processes. Every chunk runs through the tiers on
+# its own, so while one worker is on the first locator another may already be
+# sending its leftovers to the second.
+#
+# Matches are returned as plain (x, y) coordinates plus the locator's spatial
+# reference as a string so that they can be passed back from the worker
+# processes. Use projection_cache.GetSpatialReference() to turn the string
+# back into a SpatialReference.
+
+import arcpy
+import os
+
+import worker_pool
+
+# Geocoding statuses that count as a match
+MATCH_STATUSES = ['M', 'T']
+
+ID_FIELD = "row_id"
+ADDRESS_FIELD = "address"
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def _FindField(feature_class, field_name):
+    '''
+    GeocodeAddresses sometimes renames the input table's fields (for example,
+    with a USER_ prefix). Returns the actual name of field_name in the output.
+    '''
+    for f in arcpy.ListFields(feature_class):
+        name = f.name.lower()
+        if name == field_name.lower() or name.endswith("_" + field_name.lower()):
+            return f.name
+    raise ValueError("Cannot find field {} in {}".format(field_name,
+                                                         feature_class))
+
+
+def GeocodeTier(table, address_field, locator, out_fc, id_field=None):
+    '''
+    Geocodes every address in table with a single locator.
+
+    table: Table or table view holding the addresses
+    address_field: Field holding the single-line address
+    locator: Address locator (path or service)
+    out_fc: Path for the geocoded points; overwritten if it exists
+    id_field: Field identifying each address. If None, results are keyed by
+              their position in the output instead.
+
+    Returns: Dictionary of {id: (status, point geometry)}
+    '''
+    if arcpy.Exists(out_fc):
+        arcpy.Delete_management(out_fc)
+
+    arcpy.GeocodeAddresses_geocoding(table, locator,
+                                     "'Single Line Input' {} VISIBLE NONE".format(address_field),
+                                     out_fc)
+
+    fields = ["Status", "SHAPE@"]
+    if id_field:
+        fields.append(_FindField(out_fc, id_field))
+
+    results = {}
+    with arcpy.da.SearchCursor(out_fc, fields) as sc:
+        for i, row in enumerate(sc):
+            key = row[2] if id_field else i
+            results[key] = (row[0], row[1])
+    return results
+
+
+def _CreateAddressTable(workspace, name, rows):
+    '''
+    Creates (or replaces) a table of row ids and addresses.
+
+    Returns: Path to the table
+    '''
+    table = os.path.join(workspace, name)
+    if arcpy.Exists(table):
+        arcpy.Delete_management(table)
+
+    arcpy.CreateTable_management(workspace, name)
+    arcpy.AddField_management(table, ID_FIELD, "LONG")
+    arcpy.AddField_management(table, ADDRESS_FIELD, "TEXT", field_length=200)
+    with arcpy.da.InsertCursor(table, [ID_FIELD, ADDRESS_FIELD]) as ic:
+        for row in rows:
+            ic.insertRow(row)
+    return table
+
+
+def GeocodeRows(rows, locators, workspace="in_memory", name="geocode"):
+    '''
+    Runs a set of addresses through the locators in order, sending only the
+    unmatched remainder of each tier to the next.
+
+    rows: List of (integer row id, address) tuples
+    locators: Ordered list of address locators
+    workspace: Workspace for the intermediate tables and points
+    name: Base name for the intermediate tables and points
+
+    Returns: Dictionary of {row id: (x, y, status, locator index, spatial
+             reference string)} for matched rows. Unmatched rows are left out.
+    '''
+    matches = {}
+    remaining = list(rows)
+
+    for tier, locator in enumerate(locators):
+        if not remaining:
+            break
+
+        table = _CreateAddressTable(workspace, "{}_t{}".format(name, tier),
+                                    remaining)
+        out_fc = os.path.join(workspace, "{}_p{}".format(name, tier))
+        results = GeocodeTier(table, ADDRESS_FIELD, locator, out_fc, ID_FIELD)
+
+        for row_id, (status, point) in results.items():
+            if status in MATCH_STATUSES and point:
+                matches[row_id] = (point.centroid.X, point.centroid.Y, status,
+                                   tier, point.spatialReference.exportToString())
+
+        remaining = [r for r in remaining if r[0] not in matches]
+
+        arcpy.Delete_management(table)
+        arcpy.Delete_management(out_fc)
+
+    return matches
+
+
+def GeocodeChunkTask(args):
+    '''
+    Worker: runs GeocodeRows() on one chunk in the worker's own in_memory
+    workspace.
+
+    args: Tuple of (chunk number, rows, locators)
+    '''
+    chunk, rows, locators = args
+    return GeocodeRows(rows, locators, "in_memory", "chunk{}".format(chunk))
+
+
+def GeocodeChunks(rows, locators, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    '''
+    Geocodes a large set of addresses by splitting it into chunks that each
+    run through the locator tiers in a pool of worker processes.
+
+    rows: List of (integer row id, address) tuples
+    locators: Ordered list of address locators
+    chunk_size: Number of addresses per chunk
+    workers: Number of worker processes (default: one less than the cores)
+
+    Returns: Same as GeocodeRows()
+    '''
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    tasks = [(i, chunk, locators) for i, chunk in enumerate(chunks)]
+
+    # No point starting processes for a single chunk
+    if not tasks:
+        return {}
+    if len(tasks) == 1:
+        return GeocodeChunkTask(tasks[0])
+
+    pool = worker_pool.GetPool(workers)
+    try:
+        chunk_results = pool.map(GeocodeChunkTask, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    matches = {}
+    for results in chunk_results:
+        matches.update(results)
+    return matches
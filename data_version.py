@@ -0,0 +1,98 @@
+#*****************************************************************************
+#
+#  Project:  Data Version Tokens
+#  Purpose:  Cheap change tokens for tables and feature classes, used to
+#            decide when cached copies of the data need to be rebuilt
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# A version token is the row count plus the most recent edit date (from the
+# editor tracking field, if editor tracking is on) or else the highest
+# ObjectID. Both are read from the underlying data source, not the layer, so
+# selections and definition queries on a layer don't change the token.
+#
+# Edits that change an attribute without editor tracking won't change the
+# token; turn on editor tracking for tables that are cached. Caches of data
+# without editor tracking can't trust the token alone, so they also throw
+# away anything built more than UNTRACKED_MAX_AGE seconds ago (see
+# Expired()). That bounds how long an in-place edit (say, an owner's new
+# mailing address) can go unnoticed.
+
+import arcpy
+import time
+
+# Longest a cached copy of data without editor tracking is used, in seconds
+UNTRACKED_MAX_AGE = 600
+
+
+def GetDataVersion(table):
+    '''
+    Returns a string that changes whenever rows are added to, deleted from,
+    or (with editor tracking) edited in the table's data source.
+
+    table: Table, feature class, table view, or layer
+    '''
+    desc = arcpy.Describe(table)
+    source = desc.catalogPath
+
+    count = int(arcpy.GetCount_management(source).getOutput(0))
+
+    if getattr(desc, "editorTrackingEnabled", False) and desc.editedAtFieldName:
+        order_field = desc.editedAtFieldName
+    else:
+        order_field = desc.OIDFieldName
+
+    latest = None
+    sql = (None, "ORDER BY {} DESC".format(order_field))
+    where = "{} IS NOT NULL".format(order_field)
+    with arcpy.da.SearchCursor(source, [order_field], where, sql_clause=sql) as sc:
+        for row in sc:
+            latest = row[0]
+            break
+
+    return "{}|{}".format(count, latest)
+
+
+def HasEditorTracking(table):
+    '''
+    Returns True if the table's data source records when each row was last
+    edited, so the version token changes on every edit.
+    '''
+    desc = arcpy.Describe(arcpy.Describe(table).catalogPath)
+    return bool(getattr(desc, "editorTrackingEnabled", False) and
+                desc.editedAtFieldName)
+
+
+def Expired(table, built_time, max_age=UNTRACKED_MAX_AGE):
+    '''
+    Returns True if a cached copy of the table built at built_time (from
+    time.time()) must be rebuilt even though the version token hasn't
+    changed: the table has no editor tracking and the copy is older than
+    max_age seconds.
+    '''
+    if time.time() - built_time < max_age:
+        return False
+    return not HasEditorTracking(table)
@@ -0,0 +1,145 @@
+#*****************************************************************************
+#
+#  Project:  Display Output Helpers
+#  Purpose:  Return display-only geometries from a GP service as in-memory
+#            feature sets or GeoJSON instead of scratch GDB feature classes
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Some of our GP services return geometries (buffers, selected parcels) only
+# so the webmap can draw them. Writing those to the scratch GDB costs several
+# disk writes per request for data that's thrown away. These helpers build the
+# outputs straight from geometries already in memory:
+#
+#   SCRATCH_GDB  Feature class in the scratch GDB (the original behavior)
+#   FEATURE_SET  arcpy.FeatureSet built from an in_memory feature class; set
+#                the output parameter's type to Feature Set when publishing
+#   GEOJSON      GeoJSON FeatureCollection string in WGS84, for a String
+#                output parameter
+#
+# Geometries are generalized first (DISPLAY_TOLERANCE, in the data's units)
+# since they're only drawn on screen.
+
+import arcpy
+import json
+import os
+
+import projection_cache
+
+SCRATCH_GDB = "SCRATCH_GDB"
+FEATURE_SET = "FEATURE_SET"
+GEOJSON = "GEOJSON"
+MODES = [SCRATCH_GDB, FEATURE_SET, GEOJSON]
+
+# Maximum offset when generalizing display geometries, in the data's units
+DISPLAY_TOLERANCE = 1.0
+
+
+def Generalize(geometries, tolerance=DISPLAY_TOLERANCE):
+    '''
+    Returns generalized copies of the geometries (or the originals if
+    tolerance is 0/None).
+    '''
+    if not tolerance:
+        return list(geometries)
+    return [g.generalize(tolerance) for g in geometries]
+
+
+def _WriteFeatures(out_fc, geometries, spatial_reference, field=None,
+                   values=None):
+    '''
+    Writes polygons (and optionally one text attribute) to a new feature
+    class, replacing out_fc if it exists.
+    '''
+    if arcpy.Exists(out_fc):
+        arcpy.Delete_management(out_fc)
+
+    workspace, name = os.path.split(out_fc)
+    arcpy.CreateFeatureclass_management(workspace, name, "POLYGON",
+                                        spatial_reference=spatial_reference)
+    fields = ["SHAPE@"]
+    if field:
+        arcpy.AddField_management(out_fc, field, "TEXT", field_length=50)
+        fields.append(field)
+
+    with arcpy.da.InsertCursor(out_fc, fields) as ic:
+        for i, geometry in enumerate(geometries):
+            if field:
+                ic.insertRow((geometry, values[i]))
+            else:
+                ic.insertRow((geometry,))
+    return out_fc
+
+
+def ToGeoJSON(geometries, field=None, values=None):
+    '''
+    Returns a GeoJSON FeatureCollection string of the geometries in WGS84,
+    with an optional single property per feature.
+    '''
+    features = []
+    for i, geometry in enumerate(geometries):
+        wgs84 = projection_cache.ProjectGeometry(geometry, projection_cache.WGS84)
+        properties = {field: values[i]} if field else {}
+        features.append({"type": "Feature",
+                         "geometry": wgs84.__geo_interface__,
+                         "properties": properties})
+    return json.dumps({"type": "FeatureCollection", "features": features})
+
+
+def MakeOutput(mode, name, geometries, spatial_reference, field=None,
+               values=None, tolerance=DISPLAY_TOLERANCE):
+    '''
+    Builds a display output in the requested mode.
+
+    mode: SCRATCH_GDB, FEATURE_SET, or GEOJSON
+    name: Feature class name (used for the scratch GDB and in_memory copies)
+    geometries: List of polygons
+    spatial_reference: Spatial reference of the geometries
+    field, values: Optional text attribute name and one value per geometry
+    tolerance: Generalization tolerance; only used for FEATURE_SET/GEOJSON
+
+    Returns: Feature class path (SCRATCH_GDB), arcpy.FeatureSet
+             (FEATURE_SET), or GeoJSON string (GEOJSON)
+    '''
+    if mode == SCRATCH_GDB:
+        out_fc = os.path.join(arcpy.env.scratchGDB, name)
+        return _WriteFeatures(out_fc, geometries, spatial_reference, field,
+                              values)
+
+    geometries = Generalize(geometries, tolerance)
+
+    if mode == GEOJSON:
+        return ToGeoJSON(geometries, field, values)
+
+    if mode == FEATURE_SET:
+        temp_fc = _WriteFeatures("in_memory\\" + name, geometries,
+                                 spatial_reference, field, values)
+        feature_set = arcpy.FeatureSet()
+        feature_set.load(temp_fc)
+        arcpy.Delete_management(temp_fc)
+        return feature_set
+
+    raise ValueError("Output mode must be one of: " + ", ".join(MODES))
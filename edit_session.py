@@ -0,0 +1,140 @@
+#*****************************************************************************
+#
+#  Project:  Managed Edit Sessions
+#  Purpose:  Runs writes to versioned data in an edit session that retries
+#            when the version is redefined by another editor
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# When someone saves edits to the version the GP service is writing to, the
+# service's cached connection still points at the old state of the version.
+# The next write fails with "version has been redefined", and because the
+# stale connection stays cached in the service process, later writes seem to
+# succeed but never show up. The old fix was to restart the service.
+#
+# RunEdit() does the write inside an arcpy.da.Editor session and operation.
+# If it fails because the version was redefined, the operation is aborted,
+# the workspace's cached connection is cleared (ClearWorkspaceCache), and the
+# write is tried again on a fresh connection that sees the current state of
+# the version. Because the failed operation was aborted, nothing is written
+# twice.
+
+import time
+
+import arcpy
+
+# Number of times to retry a write after the version is redefined
+DEFAULT_RETRIES = 3
+
+# Seconds to wait before the first retry; doubled for each one after that
+DEFAULT_DELAY = 1.0
+
+# Errors that mean our connection's view of the version is out of date
+REDEFINED_MESSAGES = ["version has been redefined"]
+
+
+def IsVersionRedefined(error):
+    '''
+    Returns True if the exception was caused by another editor saving to the
+    version we're editing.
+    '''
+    text = str(error).lower()
+    return any(m in text for m in REDEFINED_MESSAGES)
+
+
+def GetWorkspace(layer):
+    '''
+    Returns the workspace (geodatabase or SDE connection) holding a layer's
+    data, skipping over any feature dataset.
+    '''
+    path = arcpy.Describe(arcpy.Describe(layer).catalogPath).path
+    if arcpy.Describe(path).dataType == "FeatureDataset":
+        path = arcpy.Describe(path).path
+    return path
+
+
+def IsEnterprise(workspace):
+    '''
+    Returns True for an enterprise (SDE) geodatabase, which is edited in
+    multiuser mode.
+    '''
+    return arcpy.Describe(workspace).workspaceType == "RemoteDatabase"
+
+
+def Reconnect(workspace):
+    '''
+    Drops the cached connection to an enterprise workspace so the next edit
+    session opens a new one.
+    '''
+    if IsEnterprise(workspace):
+        arcpy.ClearWorkspaceCache_management(workspace)
+
+
+def RunEdit(workspace, edit, retries=DEFAULT_RETRIES, delay=DEFAULT_DELAY):
+    '''
+    Calls edit() inside an edit session and operation on workspace and saves
+    the edits. If another editor redefines the version while we're editing,
+    reconnects and tries again, up to retries more times.
+
+    edit: Function with no arguments that does all of the writes (ie, opens
+          an InsertCursor and inserts the rows). It may be called more than
+          once, so it must not consume its input.
+
+    Returns: Whatever edit() returns
+
+    Raises: The last error if the edit fails for any other reason, or still
+            fails after every retry
+    '''
+    multiuser = IsEnterprise(workspace)
+    attempt = 0
+    while True:
+        editor = arcpy.da.Editor(workspace)
+        editor.startEditing(False, multiuser)
+        try:
+            editor.startOperation()
+            result = edit()
+            editor.stopOperation()
+            editor.stopEditing(True)
+            return result
+        except Exception as e:
+            # Throw away anything written in this attempt
+            try:
+                editor.abortOperation()
+            except Exception:
+                pass
+            try:
+                editor.stopEditing(False)
+            except Exception:
+                pass
+
+            if not IsVersionRedefined(e) or attempt >= retries:
+                raise
+
+            arcpy.AddWarning("Version was redefined by another editor; "
+                             "reconnecting and trying again...")
+            Reconnect(workspace)
+            time.sleep(delay * 2 ** attempt)
+            attempt += 1
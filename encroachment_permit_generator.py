@@ -36,6 +36,9 @@ import sys
 import traceback
 #from numpy import array, array_split
 
+import layout_prep
+import permit_index
+
 # ========== Parameters from ArcMap Script Tool ==========
 
 # All layers/table views should be in an MXD and selected from the dropdown
@@ -49,9 +52,12 @@ permit_number = arcpy.GetParameterAsText(2)  # Text, hand-entered
 mxd_file = arcpy.GetParameterAsText(3)  # File, MXD with layers and layout
 # Parameter 4 is pdf out path
 # Parameter 5 is error output string
+use_index_raw = arcpy.GetParameterAsText(6)  # Optional; Boolean, default False- find permits through a cached permit number index
 
 messages = []
 
+use_index = use_index_raw.lower() == "true"
+
 try:
     # Text box variables, must have a blank space to show up blank in mxd
     parcel_no = " "
@@ -67,20 +73,18 @@ try:
     # Set up where clause for singling out a permit
     where = "permit_num = '{}'".format(permit_number)
 
-    with arcpy.da.SearchCursor(permit_layer, "permit_num",
-                               where) as search_cursor:
-        if sum(1 for _ in search_cursor) < 1:  # sums number of records
-            raise ValueError("Cannot find permit {} in permit list.".format(
-                permit_number))
-
     # Create dictionary that holds the attribute data accessible by field name
     # ie, {"permit_num":"2017-001", "work_type":"Minor", ...}
-    fields = {}
-    with arcpy.da.SearchCursor(permit_layer, permit_fields, where) as sc:
-        for row in sc:
-            # Change <Null> entries to be blank ("") instead of None
-            row_blanked = [f if f else "" for f in row]
-            fields = dict(zip(sc.fields, row_blanked))
+    # Checking that the permit exists and reading its fields is one query (see
+    # permit_index.py)
+    fields = permit_index.FetchRow(permit_layer, "permit_num", permit_number,
+                                   permit_fields, use_index)
+    if fields is None:
+        raise ValueError("Cannot find permit {} in permit list.".format(
+            permit_number))
+
+    # Change <Null> entries to be blank ("") instead of None
+    fields = dict((k, v if v else "") for k, v in fields.items())
 
     # Update text box variables.
     # Uses string substitution, so that {} gets replaced with whatever is in
@@ -163,56 +167,49 @@ try:
         fields["winter_maintenance"]))
     inspector_findings = "\r\n".join(lines)
 
-    # Set up map document
-    mxd = arcpy.mapping.MapDocument(mxd_file)
-    df = arcpy.mapping.ListDataFrames(mxd)[0]
-    layers = arcpy.mapping.ListLayers(mxd)
+    # Set up map document, opened and indexed once per service process (see
+    # layout_prep.py)
+    layout = layout_prep.GetLayout(mxd_file)
 
     # Populate text boxes
-    # Checks the text box's .name property to find the right text box. In ArcMap
+    # Uses the text box's .name property to find the right text box. In ArcMap
     # layout view, set the location and size of the appropriate box and then set
     # it's Element Name (under Size and Position tab) to match these strings. The
     # box names match the variable names for simplicity's sake, but they don't have
     # to match.
-    text_boxes = arcpy.mapping.ListLayoutElements(mxd, "TEXT_ELEMENT")
-    for box in text_boxes:
-        if box.name == "parcel_no":
-            box.text = parcel_no
-        elif box.name == "permit_no":
-            box.text = permit_no
-        elif box.name == "inspector_findings":
-            box.text = inspector_findings
-        elif box.name == "payment_type":
-            box.text = payment_type
-        elif box.name == "receipt":
-            box.text = receipt
-        elif box.name == "description":
-            box.text = description
-        elif box.name == "fee":
-            box.text = fee
-        # Set contact and contractor boxes and adjust position if one is empty
-        elif box.name == "contractor":
-            box.text = contractor
-            # shift contractor box up half an inch if there's no contact info
-            if contact == " ":
-                box.elementPositionY += .5
-        elif box.name == "contact":
-            box.text = contact
-            # shift contact box down half an inch if there's no contractor info
-            if contractor == " ":
-                box.elementPositionY -= .5
-
-    # Set layers to be visible, get reference for permit layer to set extent
-    for l in layers:
-        l.visible = True
-        if l.name in permit_layer:
-            p_map_layer = l
-
-    # Set definition query on permit layer
-    p_map_layer.definitionQuery = where
-
-    # Set extent
-    df.extent = p_map_layer.getExtent()  # Set extent to match selected permit
+    text = {"parcel_no": parcel_no, "permit_no": permit_no,
+            "inspector_findings": inspector_findings,
+            "payment_type": payment_type, "receipt": receipt,
+            "description": description, "fee": fee,
+            "contractor": contractor, "contact": contact}
+
+    # Adjust the contact and contractor boxes' positions if one is empty
+    move = {}
+    if contact == " ":
+        # shift contractor box up half an inch if there's no contact info
+        move["contractor"] = (0, .5)
+    if contractor == " ":
+        # shift contact box down half an inch if there's no contractor info
+        move["contact"] = (0, -.5)
+
+    # Get the name of the permit layer in the mxd to set the extent: the last
+    # layer whose name is part of the permit layer's name
+    names = [n for n in layout.layer_names if n in permit_layer]
+    if not names:
+        raise ValueError("Cannot find layer {} in {}".format(permit_layer, layout.path))
+    p_map_name = names[-1]
+
+    # Set layers to be visible, set definition query on permit layer, and set
+    # extent to match selected permit
+    layout.Apply({"layers": {p_map_name: {"visible": True,
+                                          "definitionQuery": where}},
+                  "other_layers": True,
+                  "text": text,
+                  "move": move,
+                  "extent_layer": p_map_name})
+    p_map_layer = layout.Layer(p_map_name)
+
+    df = layout.data_frame
     if df.scale < 300:
         # If small scale (small feature, really zoomed in), set scale to 700%
         df.scale *= 7
@@ -226,13 +223,11 @@ try:
     # Create permit pdf
     out_path = os.path.join(arcpy.env.scratchFolder,
                             "Encroachment_Permit_{}.pdf".format(permit_number))
-    arcpy.mapping.ExportToPDF(mxd, out_path)
+    arcpy.mapping.ExportToPDF(layout.mxd, out_path)
 
     # Return pdf
     arcpy.SetParameter(4, out_path)
 
-    del mxd
-
 except arcpy.ExecuteError:
     # Log the errors as warnings on the server
     # (adding as errors would cause the task to fail)
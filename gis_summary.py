@@ -37,6 +37,8 @@ import sys
 import traceback
 from numpy import array, array_split
 
+import layout_prep
+
 # ========== Parameters from ArcMap Script Tool ==========
 
 # All layers/table views should be in the MXD and selected from the dropdown
@@ -359,73 +361,44 @@ try:
         results1 = "No areas requiring further analysis were found on, or within %d feet of, parcel %s." % (buffer_distance, parcel)
 
     # ========== Set up map document ==========
-    mxd = arcpy.mapping.MapDocument(mxd_file)
-    df = arcpy.mapping.ListDataFrames(mxd)[0]
-    layers = arcpy.mapping.ListLayers(mxd)
+    # The MXD is opened and indexed once per service process (see
+    # layout_prep.py)
+    layout = layout_prep.GetLayout(mxd_file)
 
     # Populate text boxes
-    # Checks the text box's .text property to find the right textbox. In ArcMap
-    # layout view, set the location and size of the appropriate box and then
-    # set it's text to match these strings.
-    text_boxes = arcpy.mapping.ListLayoutElements(mxd, "TEXT_ELEMENT")
-    for box in text_boxes:
-        if box.text == "pnum":
-            box.text = pnum
-        elif box.text == "date":
-            box.text = date
-        elif box.text == "paddr":
-            box.text = paddr
-        elif box.text == "lac":
-            box.text = lac
-        elif box.text == "oname":
-            box.text = oname
-        elif box.text == "oaddr":
-            box.text = oaddr
-        elif box.text == "czone":
-            box.text = czone
-        elif box.text == "jurisdiction":
-            box.text = jurisdiction
-        elif box.text == "annex":
-            box.text = annex
-        elif box.text == "coverlay":
-            box.text = coverlay
-        elif box.text == "legality":
-            box.text = legality
-        elif box.text == "Results1":
-            box.text = results1
-        elif box.text == "Results2":
-            box.text = results2
-        elif box.text == "Results3":
-            box.text = results3
-
-    # Turn on applicable layers and get references for certain layers
-    for l in layers:
-        if l.name in trimmed_layers:
-            l.visible = True
-            arcpy.AddMessage("Turning on %s" % (l.name))
-        elif l.name == "Parcels":
-            p_layer = l
-            l.visible = True
-        elif l.name == "Selected Parcels":
-            sp_layer = l
-            l.visible = True
-        elif l.name == "Roads":
-            l.visible = True
-        elif l.name == "Municipal Solid":
-            l.visible = True
-        elif l.name == overlay_layer.rpartition('\\')[2] and show_overlay:
-            l.visible = True
-        elif l.name == "Aerial":
-            l.visible = True
-        else:
-            l.visible = False
+    # Finds the text boxes by the text they have in the MXD. In ArcMap layout
+    # view, set the location and size of the appropriate box and then set it's
+    # text to match these strings.
+    placeholders = {"pnum": pnum, "date": date, "paddr": paddr, "lac": lac,
+                    "oname": oname, "oaddr": oaddr, "czone": czone,
+                    "jurisdiction": jurisdiction, "annex": annex,
+                    "coverlay": coverlay, "legality": legality,
+                    "Results1": results1, "Results2": results2,
+                    "Results3": results3}
+
+    # Turn on applicable layers and turn everything else off
+    visible_layers = set(trimmed_layers)
+    visible_layers.update(["Parcels", "Selected Parcels", "Roads",
+                           "Municipal Solid", "Aerial"])
+    if show_overlay:
+        visible_layers.add(overlay_layer.rpartition('\\')[2])
+    for name in trimmed_layers:
+        if name in layout.layers:
+            arcpy.AddMessage("Turning on %s" % (name))
+    layer_states = dict((name, {"visible": True}) for name in visible_layers
+                        if name in layout.layers)
 
     # Set definition query on selected parcel layer
-    sp_layer.definitionQuery = where
+    layer_states["Selected Parcels"] = {"visible": True, "definitionQuery": where}
 
-    # Set extent
-    df.extent = sp_layer.getExtent()  # Set extent to match selected parcel
-    df.scale *= 1.1  # set scale to 110% to view vicinity
+    # Set extent to match selected parcel, then set scale to 110% to view
+    # vicinity
+    layout.Apply({"layers": layer_states,
+                  "other_layers": False,
+                  "placeholders": placeholders,
+                  "extent_layer": "Selected Parcels",
+                  "scale_factor": 1.1})
+    p_layer = layout.Layer("Parcels")
 
     # Clear selection to avoid feature selection highlights in the map
     arcpy.SelectLayerByAttribute_management(p_layer, "CLEAR_SELECTION")
@@ -434,7 +407,7 @@ try:
     # Create summary pdf
     out_path = os.path.join(arcpy.env.scratchFolder,
                             parcel + " Parcel Summary.pdf")
-    arcpy.mapping.ExportToPDF(mxd, out_path)
+    arcpy.mapping.ExportToPDF(layout.mxd, out_path)
 
     # Append legend to pdf
     pdf_doc = arcpy.mapping.PDFDocumentOpen(out_path)
@@ -447,8 +420,6 @@ try:
 
     messages.append("Click the link below to download the parcel summary")
 
-    del mxd
-
 except arcpy.ExecuteError:
     # Log the errors as warnings on the server (adding as errors would cause
     # the task to fail)
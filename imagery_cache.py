@@ -0,0 +1,317 @@
+#*****************************************************************************
+#
+#  Project:  Imagery Tile Cache
+#  Purpose:  Disk cache of image service tiles so aerial notice maps don't
+#            depend on the remote ortho service answering in time
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# The aerial notice map draws the city's ortho image service, and when that
+# service times out the export fails with "Failed to get raster". This cache
+# keeps square tiles of the imagery on disk:
+#
+#   * The tiles are on a fixed grid (TILE_METERS on the ground, rounded to
+#     whole map units, and TILE_PIXELS pixels wide) in the spatial reference
+#     the cache was created with, so the same tile always has the same file
+#     name: <column>_<row>.jpg, with a .jgw world file next to it. The
+#     spatial reference must be projected.
+#   * Tiles are fetched with the image service's REST exportImage operation.
+#     When a map needs tiles that aren't cached and one can't be fetched, the
+#     rest aren't tried: the service is probably down, and waiting out a
+#     timeout for every tile would only delay falling back to the live layer.
+#   * Each use of a tile updates its modified time. When the cache is bigger
+#     than max_mb, the least recently used tiles are deleted.
+#
+# BuildRaster() mosaics the tiles covering an extent into one raster, which
+# public_notice.py draws in place of the remote imagery layer. If every tile
+# is already cached, the export never touches the remote service.
+#
+# Run this script as a tool (or scheduled task) to pre-warm the cache for the
+# whole county:
+#   cache folder, image service URL, feature class to cover, max size in MB
+
+import arcpy
+import json
+import os
+import sys
+import time
+import traceback
+
+try:
+    from urllib import urlencode
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+
+# Tile width/height on the ground (1000 ft) and in pixels: about 1 ft per
+# pixel
+TILE_METERS = 304.8
+TILE_PIXELS = 1000
+
+# Default maximum cache size, in megabytes
+DEFAULT_MAX_MB = 4096
+
+# Seconds to wait for the image service for each tile
+DEFAULT_TIMEOUT = 10
+
+SETTINGS_FILE = "imagery_cache.json"
+
+
+class TileCache(object):
+    '''
+    A folder of imagery tiles from one image service. The folder remembers the
+    service and spatial reference it was created with.
+    '''
+
+    def __init__(self, folder, service_url, spatial_reference,
+                 max_mb=DEFAULT_MAX_MB, timeout=DEFAULT_TIMEOUT):
+        '''
+        folder: Cache folder (created if needed)
+        service_url: Image service REST URL, ending in /ImageServer
+        spatial_reference: arcpy.SpatialReference of the tile grid (the map's)
+        max_mb: Maximum size of the cache on disk
+        timeout: Seconds to wait for the service for each tile
+        '''
+        self.folder = folder
+        self.service_url = service_url.rstrip("/")
+        self.spatial_reference = spatial_reference
+        self.wkid = spatial_reference.factoryCode
+        self.tile_size = TileSize(spatial_reference)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.timeout = timeout
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        # A cache folder is only valid for one service and tile grid
+        settings = {"service_url": self.service_url, "wkid": self.wkid,
+                    "tile_size": self.tile_size, "tile_pixels": TILE_PIXELS}
+        settings_path = os.path.join(folder, SETTINGS_FILE)
+        if os.path.exists(settings_path):
+            with open(settings_path, 'r') as f:
+                if json.load(f) != settings:
+                    raise ValueError("Imagery cache {} was created for a different service or grid".format(folder))
+        else:
+            with open(settings_path, 'w') as f:
+                json.dump(settings, f)
+
+    def Tiles(self, extent):
+        '''
+        Returns the (column, row) of every tile that touches the extent.
+        '''
+        first_column = int(extent.XMin // self.tile_size)
+        last_column = int(extent.XMax // self.tile_size)
+        first_row = int(extent.YMin // self.tile_size)
+        last_row = int(extent.YMax // self.tile_size)
+        return [(c, r) for c in range(first_column, last_column + 1)
+                for r in range(first_row, last_row + 1)]
+
+    def TilePath(self, tile):
+        return os.path.join(self.folder, "{}_{}.jpg".format(*tile))
+
+    def _Fetch(self, tile):
+        '''
+        Downloads one tile and writes its world file.
+        '''
+        column, row = tile
+        xmin = column * self.tile_size
+        ymin = row * self.tile_size
+        query = urlencode({"bbox": "{},{},{},{}".format(xmin, ymin,
+                                                       xmin + self.tile_size,
+                                                       ymin + self.tile_size),
+                           "bboxSR": self.wkid,
+                           "imageSR": self.wkid,
+                           "size": "{},{}".format(TILE_PIXELS, TILE_PIXELS),
+                           "format": "jpg",
+                           "f": "image"})
+        response = urlopen(self.service_url + "/exportImage?" + query,
+                           timeout=self.timeout)
+        data = response.read()
+        if not data.startswith(b"\xff\xd8"):
+            raise IOError("Image service did not return a JPEG for tile {}".format(tile))
+
+        # World file first (pixel size, rotation, rotation, -pixel size, and
+        # the center of the upper left pixel) so a tile is never visible
+        # without one
+        path = self.TilePath(tile)
+        pixel = float(self.tile_size) / TILE_PIXELS
+        with open(os.path.splitext(path)[0] + ".jgw", 'w') as f:
+            f.write("\n".join(str(v) for v in (pixel, 0, 0, -pixel,
+                                               xmin + pixel / 2,
+                                               ymin + self.tile_size - pixel / 2)))
+
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(path + ".tmp", path)
+
+    def GetTiles(self, extent):
+        '''
+        Makes sure every tile covering the extent is cached, fetching any that
+        are missing, and marks them as recently used. After the first tile
+        that can't be fetched, no more are tried.
+
+        Returns: (list of tile paths, list of tiles that couldn't be fetched
+                 or weren't tried)
+        '''
+        paths = []
+        failed = []
+        now = time.time()
+        for tile in self.Tiles(extent):
+            path = self.TilePath(tile)
+            if os.path.exists(path):
+                os.utime(path, (now, now))
+            elif failed:
+                failed.append(tile)
+                continue
+            else:
+                try:
+                    self._Fetch(tile)
+                except Exception as e:
+                    arcpy.AddWarning("Could not fetch imagery tile {}: {}".format(tile, e))
+                    failed.append(tile)
+                    continue
+            paths.append(path)
+
+        self.Evict(keep=set(paths))
+        return paths, failed
+
+    def Evict(self, keep=()):
+        '''
+        Deletes the least recently used tiles (except those in keep) until the
+        cache is no bigger than max_bytes.
+        '''
+        tiles = []
+        total = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith(".jpg"):
+                continue
+            path = os.path.join(self.folder, name)
+            stat = os.stat(path)
+            tiles.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for mtime, size, path in sorted(tiles):
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            for tile_file in (path, os.path.splitext(path)[0] + ".jgw"):
+                if os.path.exists(tile_file):
+                    os.remove(tile_file)
+            total -= size
+
+    def BuildRaster(self, extent, out_folder, name="cached_imagery.tif"):
+        '''
+        Mosaics the cached tiles covering the extent into a single raster,
+        fetching any that are missing.
+
+        Returns: Path of the raster, or None if any tile couldn't be fetched
+                 (the caller should use the live service instead)
+        '''
+        paths, failed = self.GetTiles(extent)
+        if failed or not paths:
+            return None
+
+        out_raster = os.path.join(out_folder, name)
+        if arcpy.Exists(out_raster):
+            arcpy.Delete_management(out_raster)
+        arcpy.MosaicToNewRaster_management(";".join(paths), out_folder, name,
+                                           self.spatial_reference,
+                                           "8_BIT_UNSIGNED", number_of_bands=3)
+        return out_raster
+
+    def Prewarm(self, extent):
+        '''
+        Fetches every tile in the extent that isn't cached yet.
+
+        Returns: Number of tiles fetched
+        '''
+        tiles = self.Tiles(extent)
+        needed = len(tiles) * TILE_PIXELS * TILE_PIXELS * 3 // 10  # ~10:1 JPEG
+        if needed > self.max_bytes:
+            arcpy.AddWarning("The extent needs roughly {} MB of tiles, more than the cache's {} MB limit; the oldest tiles will be evicted.".format(
+                needed // (1024 * 1024), self.max_bytes // (1024 * 1024)))
+
+        fetched = 0
+        for i, tile in enumerate(tiles):
+            if os.path.exists(self.TilePath(tile)):
+                continue
+            try:
+                self._Fetch(tile)
+                fetched += 1
+            except Exception as e:
+                arcpy.AddWarning("Could not fetch imagery tile {}: {}".format(tile, e))
+            if i % 100 == 0:
+                arcpy.AddMessage("{} of {} tiles checked...".format(i, len(tiles)))
+
+        self.Evict()
+        return fetched
+
+
+def TileSize(spatial_reference):
+    '''
+    Returns the tile width in the spatial reference's units: TILE_METERS
+    rounded to a whole number of units (1000 for feet).
+    '''
+    if spatial_reference.type != "Projected":
+        raise ValueError("The imagery cache needs a projected spatial reference, not {}".format(spatial_reference.name))
+    return int(round(TILE_METERS / spatial_reference.metersPerUnit))
+
+
+def PaddedExtent(extent, margin):
+    '''
+    Returns a new arcpy.Extent margin map units bigger on every side.
+    '''
+    return arcpy.Extent(extent.XMin - margin, extent.YMin - margin,
+                        extent.XMax + margin, extent.YMax + margin)
+
+
+if __name__ == '__main__':
+    cache_folder = arcpy.GetParameterAsText(0)  # Folder
+    service_url = arcpy.GetParameterAsText(1)  # String, image service REST URL
+    coverage_fc = arcpy.GetParameterAsText(2)  # Feature Class, ie county boundary
+    max_mb = arcpy.GetParameterAsText(3)  # Optional; Long, maximum cache size in MB
+
+    try:
+        desc = arcpy.Describe(coverage_fc)
+        cache = TileCache(cache_folder, service_url, desc.spatialReference,
+                          int(max_mb) if max_mb else DEFAULT_MAX_MB)
+
+        arcpy.AddMessage("Pre-warming {} tiles...".format(len(cache.Tiles(desc.extent))))
+        fetched = cache.Prewarm(desc.extent)
+        arcpy.AddMessage("Fetched {} new tiles.".format(fetched))
+
+    except arcpy.ExecuteError:
+        arcpy.AddError(arcpy.GetMessages(2))
+
+    except:
+        tb = sys.exc_info()[2]
+        tbinfo = traceback.format_tb(tb)[0]
+        pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+        arcpy.AddError(pymsg)
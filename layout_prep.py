@@ -0,0 +1,205 @@
+#*****************************************************************************
+#
+#  Project:  Map Document Layout Preparation
+#  Purpose:  Opens and indexes a map document once, then sets up its layers
+#            and text for each product from a plain dictionary
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Every map product used to open its MXD, walk ListLayers() to find layers by
+# name, and walk ListLayoutElements() to find its text boxes, before setting
+# anything. GetLayout() does that once per MXD and keeps the MapDocument and
+# its indexes in the process (a GP service reuses its process between
+# requests). The cached copy is reopened when the MXD file changes.
+#
+# The cache only pays off in a long-lived process: gis_summary.py and
+# encroachment_permit_generator.py running in a GP service. The notice map
+# exports start a new map_export_worker.py process for every map, so each one
+# still opens and indexes the MXD once; there it only saves the repeated
+# ListLayers() walks within that export.
+#
+# The state a product needs is a dictionary passed to Layout.Apply():
+#
+#   layers:        {layer name: {"visible": bool, "definitionQuery": str}};
+#                  any key may be left out to keep the MXD's setting
+#   other_layers:  Optional visibility for every layer not in layers
+#   text:          {element name: text} for text elements found by their
+#                  Element Name
+#   placeholders:  {original text: text} for text elements found by the text
+#                  they had in the MXD (ie, "pnum")
+#   move:          {element name: (dx, dy)} page units to shift an element
+#   extent_layer:  Optional layer name to zoom the first data frame to
+#   scale_factor:  Optional number the scale is multiplied by after zooming
+#   scale_offset:  Optional number added to the scale after zooming
+#
+# A reused MapDocument still has the last product's changes, so GetLayout()
+# first puts back every layer's visibility and definition query, every text
+# element's text and position, and the data frame's extent as they were in
+# the MXD, and removes any layers added since.
+
+import os
+
+import arcpy
+
+# {absolute MXD path: Layout}
+_layouts = {}
+
+
+def _Text(text):
+    # ArcMap won't set a text element to an empty string
+    return text if text else " "
+
+
+class Layout(object):
+    '''
+    A map document with its first data frame, layers, and text elements
+    indexed by name.
+    '''
+
+    def __init__(self, mxd_file):
+        self.path = os.path.abspath(mxd_file)
+        self.mtime = os.path.getmtime(self.path)
+        self.mxd = arcpy.mapping.MapDocument(self.path)
+        self.data_frame = arcpy.mapping.ListDataFrames(self.mxd)[0]
+
+        self.layers = {}
+        self.layer_names = []  # In ListLayers() order
+        self._layer_state = []
+        for layer in arcpy.mapping.ListLayers(self.mxd):
+            self.layers.setdefault(layer.name, []).append(layer)
+            self.layer_names.append(layer.name)
+            query = None
+            if layer.supports("DEFINITIONQUERY"):
+                query = layer.definitionQuery
+            self._layer_state.append((layer, layer.visible, query))
+
+        self.text_elements = {}
+        self.placeholders = {}
+        self._text_state = []
+        for element in arcpy.mapping.ListLayoutElements(self.mxd, "TEXT_ELEMENT"):
+            if element.name:
+                self.text_elements[element.name] = element
+            self.placeholders.setdefault(element.text, []).append(element)
+            self._text_state.append((element, element.text,
+                                     element.elementPositionX,
+                                     element.elementPositionY))
+
+        self._extent = self.data_frame.extent
+        self._added = []
+
+    def Layer(self, name):
+        '''
+        Returns the first layer with the name.
+        '''
+        if name not in self.layers:
+            raise ValueError("Cannot find layer {} in {}".format(name, self.path))
+        return self.layers[name][0]
+
+    def Reset(self):
+        '''
+        Puts the map document back the way it was in the MXD.
+        '''
+        for layer in self._added:
+            arcpy.mapping.RemoveLayer(self.data_frame, layer)
+        self._added = []
+
+        for layer, visible, query in self._layer_state:
+            layer.visible = visible
+            if query is not None:
+                layer.definitionQuery = query
+        for element, text, x, y in self._text_state:
+            element.text = _Text(text)
+            element.elementPositionX = x
+            element.elementPositionY = y
+        self.data_frame.extent = self._extent
+
+    def InsertLayer(self, layer, before):
+        '''
+        Adds a layer above the layer named before. It's removed again by the
+        next Reset().
+        '''
+        arcpy.mapping.InsertLayer(self.data_frame, self.Layer(before), layer,
+                                  "BEFORE")
+        added = arcpy.mapping.ListLayers(self.mxd, layer.name, self.data_frame)[0]
+        self._added.append(added)
+        return added
+
+    def Apply(self, state):
+        '''
+        Sets up the layers, text, and extent described by a state dictionary
+        (see the top of this file).
+        '''
+        layer_states = state.get("layers", {})
+        for name in layer_states:
+            self.Layer(name)  # Check the name before changing anything
+
+        if state.get("other_layers") is not None:
+            for name, layers in self.layers.items():
+                if name not in layer_states:
+                    for layer in layers:
+                        layer.visible = state["other_layers"]
+
+        for name, layer_state in layer_states.items():
+            for layer in self.layers[name]:
+                if "definitionQuery" in layer_state:
+                    layer.definitionQuery = layer_state["definitionQuery"]
+                if "visible" in layer_state:
+                    layer.visible = layer_state["visible"]
+
+        for name, text in state.get("text", {}).items():
+            if name in self.text_elements:
+                self.text_elements[name].text = _Text(text)
+        for original, text in state.get("placeholders", {}).items():
+            for element in self.placeholders.get(original, []):
+                element.text = _Text(text)
+        for name, (dx, dy) in state.get("move", {}).items():
+            if name in self.text_elements:
+                self.text_elements[name].elementPositionX += dx
+                self.text_elements[name].elementPositionY += dy
+
+        if state.get("extent_layer"):
+            self.data_frame.extent = self.Layer(state["extent_layer"]).getExtent()
+        if state.get("scale_factor"):
+            self.data_frame.scale = self.data_frame.scale * state["scale_factor"]
+        if state.get("scale_offset"):
+            self.data_frame.scale = self.data_frame.scale + state["scale_offset"]
+
+
+def GetLayout(mxd_file):
+    '''
+    Returns the Layout for the MXD, reset to the MXD's own settings. The
+    MapDocument is opened and indexed once per process, and again if the
+    file has changed.
+    '''
+    path = os.path.abspath(mxd_file)
+    layout = _layouts.get(path)
+    if layout is not None and layout.mtime == os.path.getmtime(path):
+        layout.Reset()
+        return layout
+
+    layout = Layout(path)
+    _layouts[path] = layout
+    return layout
@@ -0,0 +1,108 @@
+#*****************************************************************************
+#
+#  Project:  Land Use Project Features
+#  Purpose:  Builds land use project polygons from the subject parcels and
+#            writes them to the projects layer
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# A project polygon is the union of its subject parcels. Rather than
+# selecting the parcels, dissolving them into a temporary feature class,
+# adding and filling in the project fields, and appending that to the
+# projects layer, the parcel shapes are read with one cursor, unioned in
+# memory, and written with one InsertCursor inside a managed edit session.
+
+import arcpy
+
+import edit_session
+import parcel_lookup
+
+# Fields of the projects layer filled in for each new project, in the order
+# of ProjectRow()'s values
+PROJECT_FIELDS = ["projecttype", "projectname", "projectaddress",
+                  "projectsummary", "nextmeeting", "staffreport", "status",
+                  "parcelids", "active", "landuseauthority"]
+
+# Characters that can't be in a project name, which is used as a folder name
+NAME_PATTERN = r'[<>:"/\|?*]+'
+
+
+def ParcelGeometry(parcel_layer, tid_field, tids):
+    '''
+    Returns the union of all the parcel features for the parcel IDs, or None
+    if none of them are found.
+    '''
+    return ParcelGeometries(parcel_layer, tid_field, [tids])[0]
+
+
+def ParcelGeometries(parcel_layer, tid_field, tid_lists):
+    '''
+    Returns the union of the parcel features for each list of parcel IDs
+    (None where none are found). All the parcels are read with one cursor.
+    '''
+    all_tids = set(t for tids in tid_lists for t in tids)
+    shapes = {}
+    for tid, shape in parcel_lookup.IterRows(parcel_layer, tid_field, all_tids,
+                                             [tid_field, "SHAPE@"]):
+        if shape is not None:
+            shapes.setdefault(tid, []).append(shape)
+
+    geometries = []
+    for tids in tid_lists:
+        geometry = None
+        for tid in tids:
+            for shape in shapes.get(tid, []):
+                geometry = shape if geometry is None else geometry.union(shape)
+        geometries.append(geometry)
+    return geometries
+
+
+def ProjectRow(geometry, project_type, project_name, project_address,
+               request_summary, meeting_date, sr_link, status, tids, lua):
+    '''
+    Returns the InsertCursor row for a new, active project.
+    '''
+    return (geometry, project_type, project_name, project_address,
+            request_summary, meeting_date, sr_link, status, ", ".join(tids),
+            "Yes", lua)
+
+
+def InsertProjects(projects_layer, rows, retries=edit_session.DEFAULT_RETRIES):
+    '''
+    Writes the ProjectRow() rows to the projects layer with a single cursor,
+    in one edit session and operation so a batch is saved (or, if anything
+    fails, discarded) as a whole. If another editor redefines the version
+    first, the session reconnects and tries again (see edit_session.py).
+    '''
+    rows = list(rows)
+
+    def Insert():
+        with arcpy.da.InsertCursor(projects_layer, ["SHAPE@"] + PROJECT_FIELDS) as ic:
+            for row in rows:
+                ic.insertRow(row)
+
+    edit_session.RunEdit(edit_session.GetWorkspace(projects_layer), Insert,
+                         retries)
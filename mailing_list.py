@@ -34,14 +34,39 @@ import arcpy
 import re
 import os
 import csv
+import sys
 import traceback
+import zipfile
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import address_csv
+import assessor_cache
+import display_output
+import mailing_list_cache
+import neighbor_graph
+import parcel_index
+import parcel_lookup
 
 # ======== Mailing list tool ========
 # Creates a .csv containing the owner address info for all parcels within the
-# specified buffer distance. Also creates scratch feature classes for the buffer
-# and the selected parcels for display in a webmap. Buffer distance is specified
-# in raw values to allow the script to check the distance. The unit is whatever
-# projection the data/mxd use.
+# specified buffer distance. Also returns the buffer and the selected parcels
+# for display in a webmap, either as scratch feature classes or, with the
+# output_mode parameter, as in-memory feature sets or GeoJSON (see
+# display_output.py). Buffer distance is specified in raw values to allow the
+# script to check the distance. The unit is whatever projection the data/mxd use.
+#
+# Batch mode: if a batch file is given, the TIDs and distance parameters are
+# ignored and every notice in the file is run against the same parcel index
+# and assessor snapshot. The batch file is a CSV with a header row and the
+# columns item, tids, and distance (tids separated by spaces or ';'), eg:
+#   item,tids,distance
+#   CUP 18-004,06-019-0009 06-019-0010,300
+# The output is a zip of one CSV per item plus Combined.csv, which lists each
+# neighboring parcel once no matter how many notices it falls in.
 
 # ======== Setup ========
 # Set up script tool in ArcMap: Set parameters as shown below.
@@ -55,6 +80,7 @@ import traceback
 #       tid_field
 #       assessor_table
 #       table_tid_field
+#   If batch mode will be used, make the TIDs and distance parameters optional
 #   After everything looks good, stage the service.
 # Upload the staged service.
 #   Toolbox -> Server Tools -> Publishing -> Upload Service Definition.
@@ -71,151 +97,248 @@ import traceback
 # And you're off to the races
 # ======== ======== ========
 
-TIDs = arcpy.GetParameterAsText(0) # Multivalue, "Any Value"
-buffer_distance = arcpy.GetParameterAsText(1) # Raw value(Long), treated as feet
-parcel_layer = arcpy.GetParameterAsText(2) # Table View
-tid_field = arcpy.GetParameterAsText(3) # Field, derived from parcel_layer
-assessor_table = arcpy.GetParameterAsText(4) # Table view (add table to mxd)
-table_tid_field = arcpy.GetParameterAsText(5) # Field, derived from assessor_table
-address_fields_raw = arcpy.GetParameterAsText(6) # Multivalue, Field, derived from assessor_table
-# Paramter 7 is csv out path- file, derived output
-# Parameter 8 is buffer feature class- Feature Layer, derived output
-# Parameter 9 is neighboring parcels feature class- Feature Layer, derived output
-try:
-    arcpy.AddMessage(parcel_layer)
-
-    # Set up variables
-    # Split multivalue parameter on ";" to get list
-    TID = TIDs.split(";")
-    address_fields = address_fields_raw.split(";")
-
-    # Limit to prevent selecting the entire county
-    buffer_max = 1000
-
-    # Table view name
-    table_view = "assessor_table_view"
-
-    # temp fc for surrounding parcels
-    surrounding_parcels_fc = "in_memory\\surrounding_fc"
-
-    # Path to buffer fc- feature class names can't have '-' in them
-    buffer_fc = os.path.join(arcpy.env.scratchGDB, "buffer%s" %(TID[0]).replace('-', '_'))
-
-    # Path to selected layer
-    selected_fc = os.path.join(arcpy.env.scratchGDB, "selected%s" %(TID[0]).replace('-', '_'))
-
-    # Clear any selections and in_memory objects for safety
-    arcpy.SelectLayerByAttribute_management(parcel_layer, "CLEAR_SELECTION")
-    arcpy.Delete_management("in_memory")
-
-    # ========= Sanity Checks ===========
-    # Make sure the distance won't be absurd
-    if int(buffer_distance) > buffer_max:
-        raise Exception("Buffer cannot be greater than %d feet" %(buffer_max))
-
-    arcpy.AddMessage("Verifying input parcels...")
-
-    # Regex pattern for parcel IDs
-    pattern = "[0-9]{2}-[0-9]{3}-[0-9]{4}"
-
-    # Make sure parcel numbers are valid
-    for tid in TID:
-        if tid and tid != "#":
-            # Make sure the parcel ID is formatted correctly
-            if not re.match(pattern, tid):
-                raise Exception("Input Parcel IDs must be in the format " +
-                                  "YY-YYY-YYYY, where Y is a single digit number." +
-                                  " For example, 06-019-0009.")
-
-            # Make sure parcel ID is a valid parcel
-            where = tid_field + " = '" + tid + "'"
-            with arcpy.da.SearchCursor(parcel_layer, tid_field, where) as search_cursor:
-                if sum(1 for _ in search_cursor) < 1: #sums number of records
-                    raise Exception("Cannot find parcel ID " + tid + " in parcel " +
-                                      "list.")
-
-    # ========= Select subject parcels ===========
-    # Wrap parcel id's in single quotes for where clauses
-    parcel_list = ["\'%s\'" %(p) for p in TID]
-
-    # Set definition query for subject parcels
-    if len(parcel_list) > 1:
-        tid_string = ", ".join(parcel_list)
-    elif len(parcel_list) == 1:
-        tid_string = parcel_list[0]
-    elif len(parcel_list) < 1:
-        raise Exception("No parcels specified.")
-    dq = tid_field + " IN (" + tid_string + ")"
-
-    arcpy.AddMessage("Selecting parcels...")
-
-    # Add all desired parcels to selection
-    arcpy.SelectLayerByAttribute_management(parcel_layer, "ADD_TO_SELECTION", dq)
-
-    # ========= Create feature classes for buffer and neighbor parcels ===========
-    # Clear out buffer and selected fc's if they already exist
-    if arcpy.Exists(buffer_fc):
-        arcpy.Delete_management(buffer_fc)
-    if arcpy.Exists(selected_fc):
-        arcpy.Delete_management(selected_fc)
-
-    # Create buffer to display for visual clarity
-    arcpy.Buffer_analysis(parcel_layer, buffer_fc, buffer_distance,
-                          dissolve_option = "ALL")
-    arcpy.SetParameter(8, buffer_fc)
-
-    # Select nearby features
-    selection = arcpy.SelectLayerByLocation_management(parcel_layer,
-                                                overlap_type = "WITHIN_A_DISTANCE",
-                                                select_features = parcel_layer,
-                                                search_distance = buffer_distance,
-                                                selection_type = "NEW_SELECTION")
-
-    # Make layer of selected features to display for visual clarity
-    arcpy.CopyFeatures_management(parcel_layer, selected_fc)
-    arcpy.SetParameter(9, selected_fc)
-
-    # ========= Create table view of neighbor parcels from assessor ===========
-    # Get nearby parcel IDs
-    nearby_parcels = []
-    with arcpy.da.SearchCursor(parcel_layer, tid_field) as parcel_cursor:
-        nearby_parcels = ["\'%s\'" %(r[0]) for r in parcel_cursor]
-
-    # Table definition query
-    if len(nearby_parcels) > 1:
-        table_tid_string = ", ".join(nearby_parcels)
-    elif len(nearby_parcels) == 1:
-        table_tid_string = nearby_parcels[0]
+# Limit to prevent selecting the entire county. Neighbors come from the
+# in-process parcel index (parcel_index.py) rather than a selection on the
+# server's parcel layer, so statutory distances up to half a mile are cheap
+# enough to allow.
+buffer_max = 2640
+
+
+def BuildCSV(assessor, parcels, key_field, address_fields, consolidate):
+    '''
+    Returns the text of the address CSV for the parcels (see address_csv.py).
+    The assessor snapshot is a keyed copy of the assessor table that's only
+    re-read when the table changes, so this is a dictionary lookup per parcel.
+    '''
+    csv_buffer = StringIO()
+    address_csv.WriteAddresses(csv_buffer, assessor, parcels, key_field,
+                               address_fields, consolidate)
+    return csv_buffer.getvalue()
+
+
+def GetResult(tids, distance, index, assessor, graph, parcel_layer,
+              assessor_table, address_fields, consolidate):
+    '''
+    Returns the mailing_list_cache.CachedResult for one notice, reusing a
+    previous result for the same inputs and data if there is one.
+    '''
+    cache_key = mailing_list_cache.MakeKey(parcel_layer, assessor_table, tids,
+                                           distance, address_fields,
+                                           consolidate,
+                                           (index.version, index.built,
+                                            index.where_clause),
+                                           (assessor.version, assessor.built,
+                                            assessor.where_clause))
+    result = mailing_list_cache.Get(cache_key)
+    if result is not None:
+        return result
+
+    # Standard distances are answered from the precomputed neighbor graph
+    # (see neighbor_graph.py) as long as it was built from the current parcel
+    # data, all of it (the graph ignores definition queries); anything else is
+    # worked out from the geometry.
+    nearby_parcels = None
+    if graph and graph.version == index.version and not index.where_clause:
+        nearby_parcels = graph.Neighbors(tids, int(distance))
+
+    if nearby_parcels is None:
+        nearby_positions = index.NeighborPositions(tids, float(distance))
+        nearby_parcels = sorted(set(index.tids[i] for i in nearby_positions))
     else:
-        table_tid_string = ""
-    table_where = "%s IN (%s)" %(table_tid_field, table_tid_string)
-
-    # Make table view with subsetted entries
-    arcpy.MakeTableView_management(assessor_table, table_view, table_where)
-
-    # ========= Write out to csv ===========
-    arcpy.AddMessage("Creating CSV...")
-
-    # Create CSV of records from new feature class
-    csv_file = os.path.join(arcpy.env.scratchFolder, "Addresses.csv")
-    with open(csv_file, 'w') as csvfile:
-        csvfile.write("sep=|\n")
-        writer = csv.writer(csvfile, delimiter='|', lineterminator='\n')
-        with arcpy.da.SearchCursor(table_view, field_names=address_fields) as cursor:
-            writer.writerow(address_fields)
-            for row in cursor:
-                writer.writerow(row)
-
-    # Sends path of the csv file back to the service handler
-    arcpy.SetParameter(7, csv_file)
-
-except Exception:
-    e = sys.exc_info()
-    tbinfo = traceback.format_tb(e[2])[0]
-    err = "%s\n%s" %(tbinfo, e[1])
-    arcpy.AddError(err)
-
-# Make sure the in_memory data are removed no matter what happens
-finally:
-    # Be a good citizen and delete the in_memory workspace
-    arcpy.Delete_management("in_memory")
+        nearby_positions = sorted(p for t in nearby_parcels
+                                  for p in index.positions.get(t, []))
+
+    # Dissolved buffer around the subject parcels for visual clarity
+    buffer_geometry = index.SubjectGeometry(tids).buffer(float(distance))
+
+    result = mailing_list_cache.CachedResult(
+        BuildCSV(assessor, nearby_parcels, assessor.key_field, address_fields,
+                 consolidate), buffer_geometry,
+        nearby_positions)
+    mailing_list_cache.Put(cache_key, result)
+    return result
+
+
+def _StripBOM(text):
+    '''
+    Removes the byte order mark Excel puts at the start of UTF-8 CSVs, read
+    as bytes (Python 2) or text (Python 3).
+    '''
+    for bom in ("\xef\xbb\xbf", u"\ufeff"):
+        # Only compare like types, so Python 2 doesn't try to decode bytes
+        if type(text) == type(bom) and text.startswith(bom):
+            return text[len(bom):]
+    return text
+
+
+def ReadBatch(batch_file):
+    '''
+    Reads the notice definitions from a batch CSV.
+
+    Returns: List of (item name, [tids], distance) tuples
+    '''
+    notices = []
+    with open(batch_file, 'r') as f:
+        reader = csv.reader(f)
+        header = [h.strip().lower() for h in next(reader)]
+        if header:
+            header[0] = _StripBOM(header[0]).strip()
+        for column in ("item", "tids", "distance"):
+            if column not in header:
+                raise Exception("Batch file must have item, tids, and distance columns.")
+
+        for row in reader:
+            if not any(v.strip() for v in row):
+                continue
+            values = dict(zip(header, row))
+            item = values["item"].strip()
+            tids = [t for t in re.split("[;\\s]+", values["tids"]) if t]
+            if not item or not tids:
+                raise Exception("Every batch item needs a name and parcel IDs.")
+            notices.append((item, tids, values["distance"].strip()))
+
+    if not notices:
+        raise Exception("No notices in batch file.")
+    return notices
+
+
+if __name__ == '__main__':
+    TIDs = arcpy.GetParameterAsText(0) # Multivalue, "Any Value"
+    buffer_distance = arcpy.GetParameterAsText(1) # Raw value(Long), treated as feet
+    parcel_layer = arcpy.GetParameterAsText(2) # Table View
+    tid_field = arcpy.GetParameterAsText(3) # Field, derived from parcel_layer
+    assessor_table = arcpy.GetParameterAsText(4) # Table view (add table to mxd)
+    table_tid_field = arcpy.GetParameterAsText(5) # Field, derived from assessor_table
+    address_fields_raw = arcpy.GetParameterAsText(6) # Multivalue, Field, derived from assessor_table
+    # Paramter 7 is csv out path- file, derived output (zip file in batch mode)
+    # Parameter 8 is buffer feature class- Feature Layer, derived output
+    # Parameter 9 is neighboring parcels feature class- Feature Layer, derived output
+    graph_folder = arcpy.GetParameterAsText(10) # Optional; Folder holding the nightly neighbor graph
+    output_mode = arcpy.GetParameterAsText(11) # Optional; String: SCRATCH_GDB (default), FEATURE_SET, or GEOJSON
+    # Parameter 12 is buffer GeoJSON- String, derived output (GEOJSON mode only)
+    # Parameter 13 is neighboring parcels GeoJSON- String, derived output (GEOJSON mode only)
+    batch_file = arcpy.GetParameterAsText(14) # Optional; File, batch of notice definitions
+    consolidate_raw = arcpy.GetParameterAsText(15) # Optional; Boolean, default True- one row per owner/address
+    try:
+        arcpy.AddMessage(parcel_layer)
+
+        # Set up variables
+        # Split multivalue parameter on ";" to get list
+        address_fields = address_fields_raw.split(";")
+
+        # Owners with several parcels get one row (and one letter) unless
+        # consolidation is turned off
+        consolidate = consolidate_raw.lower() != "false"
+
+        if batch_file and batch_file != "#":
+            notices = ReadBatch(batch_file)
+        else:
+            TID = [tid for tid in TIDs.split(";") if tid and tid != "#"]
+            if not TID:
+                raise Exception("No parcels specified.")
+            notices = [(None, TID, buffer_distance)]
+
+        # Display outputs go to the scratch GDB unless another mode is requested
+        if not output_mode or output_mode == "#":
+            output_mode = display_output.SCRATCH_GDB
+        output_mode = output_mode.upper()
+
+        # Names for the buffer and selected parcel outputs- feature class names
+        # can't have '-' in them
+        first_tid = notices[0][1][0]
+        buffer_name = "buffer%s" %(first_tid).replace('-', '_')
+        selected_name = "selected%s" %(first_tid).replace('-', '_')
+
+        # Clear any selections and in_memory objects for safety
+        arcpy.SelectLayerByAttribute_management(parcel_layer, "CLEAR_SELECTION")
+        arcpy.Delete_management("in_memory")
+
+        # ========= Sanity Checks ===========
+        # Make sure the distances won't be absurd
+        for item, tids, distance in notices:
+            if int(distance) > buffer_max:
+                raise Exception("Buffer cannot be greater than %d feet" %(buffer_max))
+
+        if output_mode not in display_output.MODES:
+            raise Exception("Output mode must be one of: " + ", ".join(display_output.MODES))
+
+        arcpy.AddMessage("Verifying input parcels...")
+        all_tids = sorted(set(t for item, tids, distance in notices for t in tids))
+        parcel_lookup.CheckParcelIDs(all_tids, parcel_layer, tid_field)
+
+        # ========= Load parcel index and assessor snapshot ===========
+        # Both are loaded once per service process and reloaded when their
+        # data changes (see parcel_index.py and assessor_cache.py), and shared
+        # by every notice in a batch
+        index = parcel_index.GetIndex(parcel_layer, tid_field)
+        assessor = assessor_cache.GetSnapshot(assessor_table, table_tid_field,
+                                              address_fields)
+        graph = neighbor_graph.GetGraph(graph_folder) if graph_folder else None
+
+        # ========= Find neighbor parcels and build csvs ===========
+        # Re-runs with the same inputs against the same data reuse the
+        # previous buffer, neighbors, and CSV (see mailing_list_cache.py)
+        arcpy.AddMessage("Finding neighboring parcels...")
+        results = []
+        for item, tids, distance in notices:
+            results.append(GetResult(tids, distance, index, assessor, graph,
+                                     parcel_layer, assessor_table,
+                                     address_fields, consolidate))
+
+        # ========= Write outputs ===========
+        # The buffer and neighbors are only drawn in the webmap. In
+        # FEATURE_SET and GEOJSON modes they're built from the geometries
+        # already in memory and generalized, without writing to the scratch
+        # GDB. A batch's buffers are all in one output, as are its neighbors.
+        neighbor_positions = sorted(set(p for r in results
+                                        for p in r.neighbor_positions))
+        buffer_output = display_output.MakeOutput(
+            output_mode, buffer_name, [r.buffer_geometry for r in results],
+            index.spatial_reference)
+        selected_output = display_output.MakeOutput(
+            output_mode, selected_name,
+            [index.geometries[i] for i in neighbor_positions],
+            index.spatial_reference, tid_field,
+            [index.tids[i] for i in neighbor_positions])
+
+        if output_mode == display_output.GEOJSON:
+            arcpy.SetParameterAsText(12, buffer_output)
+            arcpy.SetParameterAsText(13, selected_output)
+        else:
+            arcpy.SetParameter(8, buffer_output)
+            arcpy.SetParameter(9, selected_output)
+
+        arcpy.AddMessage("Creating CSV...")
+        if notices[0][0] is None:
+            out_file = os.path.join(arcpy.env.scratchFolder, "Addresses.csv")
+            with open(out_file, 'w') as csvfile:
+                csvfile.write(results[0].csv_text)
+        else:
+            # One CSV per item plus the combined list, zipped together
+            out_file = os.path.join(arcpy.env.scratchFolder, "MailingLists.zip")
+            combined_parcels = sorted(set(index.tids[i] for i in neighbor_positions))
+            with zipfile.ZipFile(out_file, 'w', zipfile.ZIP_DEFLATED) as z:
+                names = set()
+                for (item, tids, distance), result in zip(notices, results):
+                    name = re.sub("[^\\w\\-]+", "_", item)
+                    while name in names:
+                        name += "_"
+                    names.add(name)
+                    z.writestr(name + ".csv", result.csv_text)
+                z.writestr("Combined.csv",
+                           BuildCSV(assessor, combined_parcels, assessor.key_field,
+                                    address_fields, consolidate))
+
+        # Sends path of the csv file back to the service handler
+        arcpy.SetParameter(7, out_file)
+
+    except Exception:
+        e = sys.exc_info()
+        tbinfo = traceback.format_tb(e[2])[0]
+        err = "%s\n%s" %(tbinfo, e[1])
+        arcpy.AddError(err)
+
+    # Make sure the in_memory data are removed no matter what happens
+    finally:
+        # Be a good citizen and delete the in_memory workspace
+        arcpy.Delete_management("in_memory")
@@ -0,0 +1,115 @@
+#*****************************************************************************
+#
+#  Project:  Mailing List Result Cache
+#  Purpose:  Remember recent mailing list results so re-running the tool with
+#            the same inputs doesn't redo the buffer, selection, and CSV
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Planners often re-run the mailing list with the same parcels and distance
+# while working on a staff report. Each result is kept in memory (the CSV
+# text, the buffer geometry, and the neighbor parcels' positions in the parcel
+# index), keyed by:
+#   * the parcel layer and assessor table,
+#   * the sorted subject parcel IDs, the distance, the address fields, and
+#     whether owners are consolidated (see address_csv.py), and
+#   * the parcel and assessor data versions (see data_version.py), along
+#     with when the parcel index and assessor snapshot were built, so a
+#     snapshot rebuilt for its age doesn't serve results from the old one.
+#
+# A GP service job has to return files from its own scratch folder, so a hit
+# still writes the outputs, but from the cached values instead of
+# recalculating them.
+#
+# Because the data versions are part of the key, a result can never be
+# returned for data that has since changed. When a result for a newer version
+# is stored, every entry for an older version is dropped, and the cache is
+# capped at MAX_ENTRIES, dropping the least recently used first.
+
+from collections import OrderedDict
+
+MAX_ENTRIES = 50
+
+# {key: CachedResult}, least recently used first
+_results = OrderedDict()
+
+
+class CachedResult(object):
+    '''
+    The parts of a mailing list run needed to recreate its outputs.
+    '''
+
+    def __init__(self, csv_text, buffer_geometry, neighbor_positions):
+        '''
+        csv_text: Full text of the CSV file
+        buffer_geometry: Dissolved buffer polygon around the subject parcels
+        neighbor_positions: Positions of the neighbor parcels in the parcel
+                            index
+        '''
+        self.csv_text = csv_text
+        self.buffer_geometry = buffer_geometry
+        self.neighbor_positions = neighbor_positions
+
+
+def MakeKey(parcel_layer, assessor_table, tids, distance, address_fields,
+            consolidate, parcel_version, assessor_version):
+    '''
+    Returns the cache key for a mailing list request. The data versions are
+    kept at the end of the key so stale entries can be found.
+    '''
+    return (parcel_layer, assessor_table, tuple(sorted(set(tids))),
+            float(distance), tuple(address_fields), bool(consolidate),
+            parcel_version, assessor_version)
+
+
+def Get(key):
+    '''
+    Returns the CachedResult for key, or None.
+    '''
+    result = _results.pop(key, None)
+    if result is not None:
+        _results[key] = result  # Move to the most recently used end
+    return result
+
+
+def Put(key, result):
+    '''
+    Stores a result, dropping any entries for older versions of the same
+    parcel layer and assessor table and trimming to MAX_ENTRIES.
+    '''
+    for old_key in list(_results):
+        if old_key[:2] == key[:2] and old_key[-2:] != key[-2:]:
+            del _results[old_key]
+
+    _results.pop(key, None)
+    _results[key] = result
+
+    while len(_results) > MAX_ENTRIES:
+        _results.popitem(last=False)
+
+
+def Clear():
+    _results.clear()
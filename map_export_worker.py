@@ -0,0 +1,222 @@
+#*****************************************************************************
+#
+#  Project:  Map Export Worker
+#  Purpose:  Exports several map products from one MXD at the same time, each
+#            in its own process with its own copy of the map document
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# A 600 dpi export is a long, single-threaded render, and arcpy.mapping can't
+# render two maps at once from one MapDocument. ExportMaps() writes each map
+# product as a JSON job file and starts this script once per job:
+#
+#   python map_export_worker.py <job.json>
+#
+# Each worker opens its own copy of the MXD, sets the layer visibility and
+# definition queries, zooms to the job's extent, and exports. The jobs run
+# side by side, so exporting several maps takes about as long as the slowest
+# one.
+#
+# Workers are separate scripts started with subprocess rather than a
+# multiprocessing pool, because a pool re-imports the calling script in every
+# worker, and tool scripts like public_notice.py run their tool code at
+# import.
+#
+# A job is a dictionary:
+#   mxd:          Path to the map document
+#   output:       Path of the exported file
+#   format:       "JPEG", "PNG", or "PDF" (default "JPEG")
+#   resolution:   Export dpi (default 600)
+#   options:      Extra keyword arguments for the arcpy.mapping export
+#                 function (ie, jpeg_quality, progressive, image_compression)
+#   layers:       {layer name: {"visible": bool, "definitionQuery": str}}; any
+#                 key may be left out to keep the MXD's setting
+#   rasters:      Optional list of {"path", "name", "before"}: raster datasets
+#                 to add as layers named name, above the layer named before
+#   extent_layer: Optional layer name to zoom the first data frame to
+#   scale_offset: Optional number added to the scale after zooming
+
+import json
+import os
+import subprocess
+import sys
+import traceback
+
+import worker_pool
+
+
+# Named export settings, so each request only renders what its consumer
+# needs. "full" is the original 600 dpi JPEG. arcpy.mapping can't write WebP,
+# so the web profile is a progressive JPEG.
+PROFILES = {
+    "full": {"format": "JPEG", "resolution": 600,
+             "options": {"jpeg_quality": 100}},
+    "web": {"format": "JPEG", "resolution": 150,
+            "options": {"jpeg_quality": 80, "progressive": True}},
+    "print": {"format": "PDF", "resolution": 300,
+              "options": {"image_quality": "BEST", "image_compression": "JPEG",
+                          "jpeg_compression_quality": 90}},
+    "thumbnail": {"format": "JPEG", "resolution": 30,
+                  "options": {"jpeg_quality": 70}},
+}
+DEFAULT_PROFILE = "full"
+
+_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "PDF": ".pdf"}
+
+
+def GetProfile(name):
+    '''
+    Returns the export profile with the given name (case insensitive), or the
+    default profile for a blank name.
+    '''
+    name = (name or DEFAULT_PROFILE).lower()
+    if name not in PROFILES:
+        raise ValueError("Export profile must be one of: " + ", ".join(sorted(PROFILES)))
+    return PROFILES[name]
+
+
+def OutputPath(base_path, profile=None):
+    '''
+    Returns base_path (without an extension) with the extension for the
+    profile's format.
+    '''
+    return base_path + _EXTENSIONS[GetProfile(profile)["format"]]
+
+
+def MakeJob(mxd, output, layers, extent_layer=None, scale_offset=0,
+            resolution=600, export_format="JPEG", rasters=None, profile=None):
+    '''
+    Returns a job dictionary for ExportMaps(). If a profile name is given, its
+    format, resolution, and options are used instead of resolution and
+    export_format.
+    '''
+    options = {}
+    if profile:
+        settings = GetProfile(profile)
+        export_format = settings["format"]
+        resolution = settings["resolution"]
+        options = settings["options"]
+
+    return {"mxd": mxd,
+            "output": output,
+            "format": export_format,
+            "resolution": resolution,
+            "options": options,
+            "layers": layers,
+            "rasters": rasters or [],
+            "extent_layer": extent_layer,
+            "scale_offset": scale_offset}
+
+
+def RunJob(job):
+    '''
+    Exports one map product. Runs in the worker process.
+
+    Returns: Path of the exported file
+    '''
+    import arcpy
+    import layout_prep
+
+    # Layers are found by name from one index of the MXD (see layout_prep.py).
+    # This process exits after one job, so the MXD is still opened every time.
+    layout = layout_prep.GetLayout(job["mxd"])
+    layout.Apply({"layers": job["layers"]})
+
+    for raster in job.get("rasters", []):
+        arcpy.MakeRasterLayer_management(raster["path"], raster["name"])
+        layout.InsertLayer(arcpy.mapping.Layer(raster["name"]), raster["before"])
+
+    layout.Apply({"extent_layer": job.get("extent_layer"),
+                  "scale_offset": job.get("scale_offset")})
+
+    export_format = job.get("format", "JPEG").upper()
+    exporters = {"JPEG": arcpy.mapping.ExportToJPEG,
+                 "PNG": arcpy.mapping.ExportToPNG,
+                 "PDF": arcpy.mapping.ExportToPDF}
+    if export_format not in exporters:
+        raise ValueError("Unsupported export format: {}".format(export_format))
+
+    options = dict((str(k), v) for k, v in job.get("options", {}).items())
+    exporters[export_format](layout.mxd, job["output"],
+                             resolution=job.get("resolution", 600), **options)
+
+    return job["output"]
+
+
+def ExportMaps(jobs, job_folder, workers=None):
+    '''
+    Runs the jobs in worker processes, all at the same time or at most
+    workers at a time, and waits for them to finish.
+
+    jobs: List of job dictionaries (see MakeJob())
+    job_folder: Folder for the job files (ie, arcpy.env.scratchFolder)
+    workers: Maximum number of exports running at once (default: all)
+
+    Returns: List of output paths, in the order of the jobs
+
+    Raises: Exception with every failed job's error message if any fail
+    '''
+    script = os.path.abspath(__file__)
+    if script.endswith(".pyc"):
+        script = script[:-1]
+    python = worker_pool.PythonExecutable()
+    workers = workers or len(jobs)
+
+    waiting = list(enumerate(jobs))
+    running = []
+    errors = []
+    while waiting or running:
+        while waiting and len(running) < workers:
+            i, job = waiting.pop(0)
+            job_file = os.path.join(job_folder, "map_export_job_{}.json".format(i))
+            with open(job_file, 'w') as f:
+                json.dump(job, f)
+            running.append((job, subprocess.Popen([python, script, job_file],
+                                                  stdout=subprocess.PIPE,
+                                                  stderr=subprocess.PIPE)))
+
+        # Wait for the oldest export, then start the next one
+        job, process = running.pop(0)
+        out, err = process.communicate()
+        if process.returncode != 0:
+            if not isinstance(err, str):
+                err = err.decode("utf-8", "replace")
+            errors.append("{}: {}".format(os.path.basename(job["output"]),
+                                          err.strip()))
+
+    if errors:
+        raise Exception("Map export failed:\n" + "\n".join(errors))
+
+    return [job["output"] for job in jobs]
+
+
+if __name__ == '__main__':
+    try:
+        with open(sys.argv[1], 'r') as f:
+            RunJob(json.load(f))
+    except Exception:
+        sys.stderr.write(traceback.format_exc())
+        sys.exit(1)
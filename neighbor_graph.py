@@ -0,0 +1,317 @@
+#*****************************************************************************
+#
+#  Project:  Parcel Neighbor Graph
+#  Purpose:  Nightly job that precomputes every parcel's neighbors at the
+#            county's standard notice distances, and the lookup used by
+#            mailing_list.py to answer standard-distance requests from it
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Notice distances are almost always 300, 500, or 1000 feet. Rather than
+# working out the neighbors from the geometry every time, this script (run
+# nightly as a scheduled task) computes each parcel's neighbors at every
+# standard distance and saves them in a new subfolder of the graph folder:
+#
+#   current_graph.txt               Name of the subfolder with the current
+#                                   graph
+#   graph_<time>/neighbor_graph.json
+#                                   Parcel IDs (position -> ID), the
+#                                   distances, and the parcel data version
+#                                   at build time
+#   graph_<time>/neighbors_<distance>.offsets
+#                                   Array of len(parcels) + 1 int32s
+#   graph_<time>/neighbors_<distance>.ids
+#                                   Array of int32 parcel positions
+#
+# A graph's files are never changed once written. A new build is written to
+# its own subfolder and then made current by replacing current_graph.txt, so
+# a service reading the graph at the same time sees either the old graph or
+# the new one, never a mix. The previous build is kept for readers that are
+# still loading it; older ones are deleted.
+#
+# The neighbors of the parcel at position p are ids[offsets[p]:offsets[p+1]]
+# (compressed sparse row adjacency), which for the whole county is a few
+# megabytes per distance. Each pair of parcels is only measured once, at the
+# largest distance, and the measured distance is reused for the smaller ones.
+#
+# GetGraph() loads the current graph (cached until a new one is made current)
+# and Neighbors() unions the precomputed lists for the subject parcels. If
+# the graph can't be read, GetGraph() returns None rather than failing the
+# request. Callers should only use the graph when there is one, its version
+# matches the current parcel data version, and the distance is one of the
+# standard ones; otherwise fall back to parcel_index.
+
+import arcpy
+import json
+import os
+import shutil
+import sys
+import time
+import traceback
+from array import array
+
+import data_version
+import parcel_index
+
+STANDARD_DISTANCES = [300, 500, 1000]
+
+META_FILE = "neighbor_graph.json"
+POINTER_FILE = "current_graph.txt"
+BUILD_PREFIX = "graph_"
+
+# {folder: (current build folder name, NeighborGraph)}
+_graphs = {}
+
+
+class NeighborGraph(object):
+    '''
+    Precomputed parcel adjacency at one or more distances.
+    '''
+
+    def __init__(self, tids, version, adjacency):
+        '''
+        tids: List of parcel IDs; a parcel's position in this list is its
+              number in the adjacency arrays
+        version: Parcel data version the graph was built from
+        adjacency: {distance: (offsets array, neighbor positions array)}
+        '''
+        self.tids = tids
+        self.version = version
+        self.adjacency = adjacency
+        self.distances = sorted(adjacency)
+
+        self.positions = {}
+        for i, tid in enumerate(tids):
+            self.positions.setdefault(tid, []).append(i)
+
+    def Neighbors(self, subject_tids, distance):
+        '''
+        Returns the sorted list of unique parcel IDs within distance of the
+        subject parcels, including the subject parcels, or None if the graph
+        doesn't have that distance.
+        '''
+        if distance not in self.adjacency:
+            return None
+
+        offsets, neighbors = self.adjacency[distance]
+        found = set()
+        for tid in subject_tids:
+            for p in self.positions.get(tid, []):
+                found.add(p)
+                found.update(neighbors[offsets[p]:offsets[p + 1]])
+        return sorted(set(self.tids[p] for p in found))
+
+
+def BuildGraph(index, distances=STANDARD_DISTANCES):
+    '''
+    Computes the neighbors of every parcel in a parcel_index.ParcelIndex at
+    each of the distances.
+
+    Returns: NeighborGraph
+    '''
+    distances = sorted(distances)
+    max_distance = distances[-1]
+    count = len(index.tids)
+
+    # neighbor_lists[d][p] = positions within distances[d] of parcel p
+    neighbor_lists = [[[] for _ in range(count)] for _ in distances]
+
+    for p in range(count):
+        xmin, ymin, xmax, ymax = index.boxes[p]
+        search_box = (xmin - max_distance, ymin - max_distance,
+                      xmax + max_distance, ymax + max_distance)
+        geometry = index.geometries[p]
+
+        # Only measure each pair once (q > p) and record it both ways
+        for q in index.tree.Query(search_box):
+            if q <= p:
+                continue
+            measured = geometry.distanceTo(index.geometries[q])
+            for d, distance in enumerate(distances):
+                if measured <= distance:
+                    neighbor_lists[d][p].append(q)
+                    neighbor_lists[d][q].append(p)
+
+    adjacency = {}
+    for d, distance in enumerate(distances):
+        offsets = array('i', [0])
+        neighbors = array('i')
+        for p in range(count):
+            neighbors.extend(sorted(neighbor_lists[d][p]))
+            offsets.append(len(neighbors))
+        adjacency[distance] = (offsets, neighbors)
+
+    return NeighborGraph(list(index.tids), index.version, adjacency)
+
+
+def _Replace(temp_path, path):
+    if hasattr(os, "replace"):
+        os.replace(temp_path, path)
+        return
+    # Python 2's os.rename won't overwrite an existing file on Windows. The
+    # pointer file is briefly missing; GetGraph() keeps using the graph it
+    # already has (or falls back to the geometry) until it's back.
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+
+def _CurrentBuild(folder):
+    '''
+    Returns the name of the current build subfolder, or None if there is no
+    graph.
+    '''
+    pointer_path = os.path.join(folder, POINTER_FILE)
+    if not os.path.exists(pointer_path):
+        return None
+    with open(pointer_path, 'r') as f:
+        return f.read().strip() or None
+
+
+def SaveGraph(graph, folder):
+    '''
+    Writes the graph's files to a new subfolder of folder and makes it the
+    current graph.
+
+    Returns: Path of the new subfolder
+    '''
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    name = "{}{}_{}".format(BUILD_PREFIX, time.strftime("%Y%m%d%H%M%S"), os.getpid())
+    build_folder = os.path.join(folder, name)
+    os.makedirs(build_folder)
+
+    for distance, (offsets, neighbors) in graph.adjacency.items():
+        for suffix, values in (("offsets", offsets), ("ids", neighbors)):
+            path = os.path.join(build_folder, "neighbors_{}.{}".format(distance, suffix))
+            with open(path, 'wb') as f:
+                values.tofile(f)
+
+    with open(os.path.join(build_folder, META_FILE), 'w') as f:
+        json.dump({"version": graph.version,
+                   "distances": graph.distances,
+                   "tids": graph.tids}, f)
+
+    # Switch readers to the new build in one step
+    previous = _CurrentBuild(folder)
+    pointer_path = os.path.join(folder, POINTER_FILE)
+    with open(pointer_path + ".tmp", 'w') as f:
+        f.write(name)
+    _Replace(pointer_path + ".tmp", pointer_path)
+
+    # Keep the new and previous builds; delete anything older
+    for old in os.listdir(folder):
+        if old.startswith(BUILD_PREFIX) and old not in (name, previous):
+            shutil.rmtree(os.path.join(folder, old), ignore_errors=True)
+
+    return build_folder
+
+
+def LoadGraph(folder):
+    '''
+    Reads the graph in one build subfolder written by SaveGraph().
+
+    Returns: NeighborGraph
+    '''
+    with open(os.path.join(folder, META_FILE), 'r') as f:
+        meta = json.load(f)
+
+    count = len(meta["tids"])
+    adjacency = {}
+    for distance in meta["distances"]:
+        base = os.path.join(folder, "neighbors_{}".format(distance))
+
+        offsets = array('i')
+        with open(base + ".offsets", 'rb') as f:
+            offsets.fromfile(f, count + 1)
+
+        neighbors = array('i')
+        size = os.path.getsize(base + ".ids") // neighbors.itemsize
+        with open(base + ".ids", 'rb') as f:
+            neighbors.fromfile(f, size)
+
+        if offsets[-1] != len(neighbors):
+            raise ValueError("Neighbor graph files for {} ft don't match".format(distance))
+        adjacency[distance] = (offsets, neighbors)
+
+    return NeighborGraph(meta["tids"], meta["version"], adjacency)
+
+
+def GetGraph(folder):
+    '''
+    Returns the current graph saved in folder, cached until a new one is
+    made current. Returns None if there is no graph there or it can't be
+    read, so callers fall back to the geometry.
+    '''
+    if not folder:
+        return None
+
+    try:
+        build = _CurrentBuild(folder)
+        if build is None:
+            return None
+
+        if folder not in _graphs or _graphs[folder][0] != build:
+            _graphs[folder] = (build, LoadGraph(os.path.join(folder, build)))
+        return _graphs[folder][1]
+
+    except (IOError, OSError, ValueError, EOFError, KeyError) as e:
+        arcpy.AddWarning("Could not read neighbor graph in {}: {}".format(folder, e))
+        return None
+
+
+if __name__ == '__main__':
+    parcel_fc = arcpy.GetParameterAsText(0)  # Feature Class
+    tid_field = arcpy.GetParameterAsText(1)  # Field, from parcel_fc
+    graph_folder = arcpy.GetParameterAsText(2)  # Folder
+    distances_raw = arcpy.GetParameterAsText(3)  # Optional; Multivalue Long
+
+    try:
+        if distances_raw:
+            distances = [int(d) for d in distances_raw.split(";")]
+        else:
+            distances = STANDARD_DISTANCES
+
+        arcpy.AddMessage("Loading parcels...")
+        version = data_version.GetDataVersion(parcel_fc)
+        index = parcel_index.ParcelIndex(parcel_fc, tid_field, version)
+
+        arcpy.AddMessage("Computing neighbors of {} parcels at {} ft...".format(
+            len(index.tids), ", ".join(str(d) for d in distances)))
+        graph = BuildGraph(index, distances)
+
+        arcpy.AddMessage("Saving neighbor graph to {}...".format(graph_folder))
+        SaveGraph(graph, graph_folder)
+
+    except arcpy.ExecuteError:
+        arcpy.AddError(arcpy.GetMessages(2))
+
+    except:
+        tb = sys.exc_info()[2]
+        tbinfo = traceback.format_tb(tb)[0]
+        pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+        arcpy.AddError(pymsg)
@@ -0,0 +1,374 @@
+#*****************************************************************************
+#
+#  Project:  Public Notice Job Queue
+#  Purpose:  Background queue for the mailing list and maps of a new land use
+#            project, so public_notice.py can return as soon as the project
+#            polygon is added
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# The queue is a folder (a local folder for testing, or a share that both the
+# GP server and the worker machine can reach) with one JSON file per job:
+#
+#   queued/<job id>.json    Waiting for a worker
+#   running/<job id>.json   Claimed by a worker
+#   done/<job id>.json      Finished; every product was made
+#   failed/<job id>.json    Finished; at least one product failed
+#   results/<job id>/       The job's CSV and maps
+#
+# A worker claims a job by renaming it from queued/ to running/, which only
+# one worker can do. If a worker dies mid-job, the job would sit in running/
+# forever, so idle workers move any job that has been running longer than
+# STALE_SECONDS back to queued/ (or, after MAX_ATTEMPTS tries, to failed/).
+# To retry a stuck job by hand, stop the workers and move its file from
+# running/ back to queued/. The mailing list and the maps are made separately and
+# their results recorded separately, so a failed map doesn't hide a good
+# mailing list (or the polygon, which was added before the job was queued).
+#
+# Start a worker from the command line or a scheduled task:
+#   python notice_jobs.py worker <queue folder> [--once]
+# (--once processes whatever is queued and exits, which is handy for testing.)
+#
+# As a script tool/GP service, this script reports a job's status:
+#   0 queue folder, 1 job ID; outputs: 2 status, 3 messages, 4 CSV,
+#   5 vicinity map, 6 aerial map (copied to the GP job's scratch folder)
+
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import traceback
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATES = [QUEUED, RUNNING, DONE, FAILED]
+
+RESULTS = "results"
+
+# Seconds between checks for new jobs
+DEFAULT_POLL_SECONDS = 5
+
+# Seconds a job can be running before it's assumed its worker died
+STALE_SECONDS = 3600
+
+# Times a job is started before it's given up on
+MAX_ATTEMPTS = 2
+
+
+# Job IDs are uuid4().hex, so a job ID from a request can't name a path
+# outside the queue
+_job_id_pattern = re.compile(r"[0-9a-f]{32}\Z")
+
+
+def _JobPath(queue_folder, state, job_id):
+    if not _job_id_pattern.match(job_id):
+        raise ValueError("Invalid job ID {}".format(job_id))
+    return os.path.join(queue_folder, state, job_id + ".json")
+
+
+def _Write(path, record):
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(record, f, indent=2)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(path + ".tmp", path)
+
+
+def Submit(queue_folder, spec):
+    '''
+    Adds a job to the queue.
+
+    spec: Dictionary of MakeSpec() values
+
+    Returns: The new job ID
+    '''
+    job_id = uuid.uuid4().hex
+    record = {"job_id": job_id,
+              "status": QUEUED,
+              "submitted": time.time(),
+              "spec": spec,
+              "messages": [],
+              "outputs": {}}
+    _Write(_JobPath(queue_folder, QUEUED, job_id), record)
+    return job_id
+
+
+def GetStatus(queue_folder, job_id):
+    '''
+    Returns the job's record (status, messages, and output paths), or None if
+    there is no such job.
+    '''
+    # A job can move between folders while we look for it, so try again a
+    # couple of times before giving up
+    for attempt in range(3):
+        for state in STATES:
+            path = _JobPath(queue_folder, state, job_id)
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        return json.load(f)
+                except (IOError, OSError, ValueError):
+                    break
+        else:
+            return None
+        time.sleep(0.1)
+    return None
+
+
+def ClaimNext(queue_folder):
+    '''
+    Moves the oldest queued job to running/ and returns its record, or None
+    if nothing is queued.
+    '''
+    queued_folder = os.path.join(queue_folder, QUEUED)
+    if not os.path.exists(queued_folder):
+        return None
+
+    names = [n for n in os.listdir(queued_folder) if n.endswith(".json")]
+    names.sort(key=lambda n: os.path.getmtime(os.path.join(queued_folder, n)))
+    for name in names:
+        job_id = name[:-len(".json")]
+        if not _job_id_pattern.match(job_id):
+            continue  # Not a job file
+        running_path = _JobPath(queue_folder, RUNNING, job_id)
+        if not os.path.exists(os.path.dirname(running_path)):
+            os.makedirs(os.path.dirname(running_path))
+        try:
+            os.rename(os.path.join(queued_folder, name), running_path)
+        except OSError:
+            continue  # Another worker got it first
+        with open(running_path, 'r') as f:
+            record = json.load(f)
+        record["status"] = RUNNING
+        record["started"] = time.time()
+        record["attempts"] = record.get("attempts", 0) + 1
+        _Write(running_path, record)
+        return record
+    return None
+
+
+def RequeueStale(queue_folder, stale_seconds=STALE_SECONDS,
+                 max_attempts=MAX_ATTEMPTS):
+    '''
+    Moves jobs that have been running longer than stale_seconds back to
+    queued/, or to failed/ once they've been tried max_attempts times.
+
+    Returns: Number of jobs moved
+    '''
+    running_folder = os.path.join(queue_folder, RUNNING)
+    if not os.path.exists(running_folder):
+        return 0
+
+    moved = 0
+    now = time.time()
+    for name in os.listdir(running_folder):
+        if not (name.endswith(".json") and
+                _job_id_pattern.match(name[:-len(".json")])):
+            continue
+        path = os.path.join(running_folder, name)
+        try:
+            if now - os.path.getmtime(path) < stale_seconds:
+                continue
+            with open(path, 'r') as f:
+                record = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue  # Finished or moved while we looked
+
+        if record.get("attempts", 1) >= max_attempts:
+            record["status"] = FAILED
+            record["finished"] = now
+            record["messages"].append("Job stopped running; gave up after {} tries.".format(
+                record.get("attempts", 1)))
+        else:
+            record["status"] = QUEUED
+            record["messages"].append("Job stopped running; queued again.")
+        try:
+            # Claim it the same way ClaimNext() does, so only one worker
+            # moves it
+            claimed = path + ".stale"
+            os.rename(path, claimed)
+        except OSError:
+            continue
+        _Write(_JobPath(queue_folder, record["status"], record["job_id"]), record)
+        os.remove(claimed)
+        moved += 1
+    return moved
+
+
+def MakeSpec(project_name, input_tids, parcel_layer, parcel_tid_field,
+             buffer_distance, assessor_table, table_tid_field, consolidate,
+             mxd_file, project_extent, imagery_cache_folder=None,
+             imagery_url=None, export_profile=None):
+    '''
+    Returns the job spec for a project's notice products. Layers and table
+    views are replaced with their data sources so the worker can open them.
+    '''
+    import arcpy
+    import parcel_index
+
+    return {"project_name": project_name,
+            "input_tids": list(input_tids),
+            "parcel_source": arcpy.Describe(parcel_layer).catalogPath,
+            "parcel_where": parcel_index.LayerWhereClause(parcel_layer),
+            "parcel_tid_field": parcel_tid_field,
+            "buffer_distance": buffer_distance,
+            "assessor_source": arcpy.Describe(assessor_table).catalogPath,
+            "assessor_where": parcel_index.LayerWhereClause(assessor_table),
+            "table_tid_field": table_tid_field,
+            "consolidate": consolidate,
+            "mxd_file": mxd_file,
+            "extent": [project_extent.XMin, project_extent.YMin,
+                       project_extent.XMax, project_extent.YMax],
+            "spatial_reference": project_extent.spatialReference.exportToString(),
+            "imagery_cache_folder": imagery_cache_folder,
+            "imagery_url": imagery_url,
+            "export_profile": export_profile}
+
+
+def RunJob(queue_folder, record):
+    '''
+    Makes a claimed job's mailing list and maps and moves it to done/ or
+    failed/.
+    '''
+    import arcpy
+    import notice_products
+    import projection_cache
+
+    spec = record["spec"]
+    job_id = record["job_id"]
+    out_folder = os.path.join(queue_folder, RESULTS, job_id)
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    failed = False
+
+    try:
+        record["outputs"]["csv"] = notice_products.CreateMailingList(
+            spec["parcel_source"], spec["parcel_tid_field"], spec["input_tids"],
+            spec["buffer_distance"], spec["assessor_source"],
+            spec["table_tid_field"], out_folder,
+            consolidate=spec["consolidate"],
+            parcel_where=spec.get("parcel_where"),
+            assessor_where=spec.get("assessor_where"))
+        record["messages"].append("Mailing list created.")
+    except Exception as e:
+        failed = True
+        record["messages"].append("Mailing list failed: {}".format(e))
+
+    try:
+        # Rebuild the extent (with its spatial reference) from its corners
+        sr = projection_cache.GetSpatialReference(spec["spatial_reference"])
+        xmin, ymin, xmax, ymax = spec["extent"]
+        corners = arcpy.Array([arcpy.Point(xmin, ymin), arcpy.Point(xmin, ymax),
+                               arcpy.Point(xmax, ymax), arcpy.Point(xmax, ymin)])
+        extent = arcpy.Polygon(corners, sr).extent
+        vicinity, aerial = notice_products.CreateMaps(
+            spec["mxd_file"], spec["input_tids"], spec["parcel_tid_field"],
+            spec["project_name"], extent, out_folder,
+            spec.get("imagery_cache_folder"), spec.get("imagery_url"),
+            spec.get("export_profile"))
+        record["outputs"]["vicinity"] = vicinity
+        record["outputs"]["aerial"] = aerial
+        record["messages"].append("Maps created.")
+    except Exception as e:
+        failed = True
+        record["messages"].append("Maps failed: {}".format(e))
+
+    record["status"] = FAILED if failed else DONE
+    record["finished"] = time.time()
+    _Write(_JobPath(queue_folder, record["status"], job_id), record)
+    try:
+        os.remove(_JobPath(queue_folder, RUNNING, job_id))
+    except OSError:
+        pass  # Already moved by RequeueStale()
+    return record
+
+
+def RunWorker(queue_folder, poll_seconds=DEFAULT_POLL_SECONDS, once=False):
+    '''
+    Processes queued jobs until stopped (or, with once, until the queue is
+    empty).
+    '''
+    while True:
+        record = ClaimNext(queue_folder)
+        if record is None:
+            moved = RequeueStale(queue_folder)
+            if moved:
+                print("Moved {} stale jobs out of running/.".format(moved))
+                continue
+            if once:
+                return
+            time.sleep(poll_seconds)
+            continue
+
+        print("Running job {}...".format(record["job_id"]))
+        try:
+            RunJob(queue_folder, record)
+        except Exception:
+            traceback.print_exc()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == "worker":
+        RunWorker(sys.argv[2], once="--once" in sys.argv)
+        sys.exit(0)
+
+    import arcpy
+
+    queue_folder = arcpy.GetParameterAsText(0)  # Folder (constant in the service)
+    job_id = arcpy.GetParameterAsText(1)  # String
+    # Parameter 2 is the job status- String, derived output
+    # Parameter 3 is the job's messages- String, derived output
+    # Parameters 4-6 are the CSV, vicinity map, and aerial map- File, derived outputs
+
+    try:
+        record = GetStatus(queue_folder, job_id.strip().lower())
+        if record is None:
+            raise ValueError("Cannot find job {}".format(job_id))
+
+        arcpy.SetParameterAsText(2, record["status"])
+        arcpy.SetParameterAsText(3, "\n".join(record["messages"]))
+
+        # Files have to be in the GP job's own scratch folder to be returned
+        for i, product in ((4, "csv"), (5, "vicinity"), (6, "aerial")):
+            path = record["outputs"].get(product)
+            if path and os.path.exists(path):
+                copy = os.path.join(arcpy.env.scratchFolder, os.path.basename(path))
+                shutil.copy(path, copy)
+                arcpy.SetParameter(i, copy)
+
+    except Exception:
+        e = sys.exc_info()
+        tbinfo = traceback.format_tb(e[2])[0]
+        arcpy.AddError("%s\n%s" %(tbinfo, e[1]))
@@ -0,0 +1,162 @@
+#*****************************************************************************
+#
+#  Project:  Public Notice Products
+#  Purpose:  The mailing list and map products of a land use project, shared
+#            by public_notice.py and the background notice job worker
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Once a project polygon has been added, everything else public_notice.py
+# makes depends only on the subject parcels and the project's extent:
+#
+#   CreateMailingList()  Addresses.csv of the owners within the notice distance
+#   CreateMaps()         The vicinity and aerial maps
+#
+# Everything is passed in as data source paths and plain values rather than
+# layers, so the same functions can run in the GP service or in a separate
+# worker process (see notice_jobs.py).
+
+import os
+
+import address_csv
+import assessor_cache
+import imagery_cache
+import map_export_worker
+import parcel_index
+import parcel_lookup
+
+ADDRESS_FIELDS = ["parcel_number", "owner_name", "owner_address1", "owner_city_state_zip"]
+
+# Largest notice distance in feet, to prevent selecting the entire county
+BUFFER_MAX = 2640
+
+
+def CreateMailingList(parcel_layer, parcel_tid_field, input_tids,
+                      buffer_distance, assessor_table, table_tid_field,
+                      out_folder, address_fields=ADDRESS_FIELDS,
+                      consolidate=True, parcel_where=None,
+                      assessor_where=None):
+    '''
+    Writes Addresses.csv with the owner info of every parcel within
+    buffer_distance of the subject parcels.
+
+    The neighbors come from the in-process parcel index and the owner info
+    from the cached assessor snapshot (see parcel_index.py and
+    assessor_cache.py), so this doesn't touch any selections.
+
+    parcel_where: Definition query to use in place of the parcel layer's own
+                  (for the worker, which only has the feature class)
+    assessor_where: Definition query to use in place of the assessor table
+                    view's own
+
+    Returns: Path of the CSV
+    '''
+    index = parcel_index.GetIndex(parcel_layer, parcel_tid_field,
+                                  where_clause=parcel_where)
+    nearby_parcels = index.Neighbors(input_tids, float(buffer_distance))
+
+    # Owners with several parcels get one row listing all of them (see
+    # address_csv.py) unless consolidation is turned off
+    assessor = assessor_cache.GetSnapshot(assessor_table, table_tid_field,
+                                          address_fields,
+                                          where_clause=assessor_where)
+    csv_file = os.path.join(out_folder, "Addresses.csv")
+    with open(csv_file, 'w') as csvfile:
+        address_csv.WriteAddresses(csvfile, assessor, nearby_parcels,
+                                   table_tid_field, address_fields, consolidate)
+    return csv_file
+
+
+def MapJobs(mxd_file, input_tids, parcel_tid_field, project_name,
+            project_extent, out_folder, imagery_cache_folder=None,
+            imagery_url=None, profile=None):
+    '''
+    Returns the map_export_worker jobs for the vicinity and aerial maps.
+
+    project_extent: arcpy.Extent of the project, with its spatial reference
+    profile: Name of a map_export_worker export profile (default: 600 dpi
+             JPEG)
+    '''
+    profile = profile or map_export_worker.DEFAULT_PROFILE
+
+    # Both parcel layers only show the subject parcels. Long lists are split
+    # into several IN (...) clauses joined with OR.
+    dq = " OR ".join(parcel_lookup.BuildWhereClauses(parcel_tid_field, input_tids))
+
+    # Vicinity Map: turn on vicinity parcels, turn off imagery, zoom to layer, add 10k to extent, export with the profile (600 dpi jpg by default)
+    out_path_v = map_export_worker.OutputPath(
+        os.path.join(out_folder, project_name + " Vicinity"), profile)
+    vicinity_job = map_export_worker.MakeJob(
+        mxd_file, out_path_v,
+        {"Vicinity Parcels": {"visible": True, "definitionQuery": dq},
+         "Aerial Parcels": {"visible": True, "definitionQuery": dq},
+         "Imagery": {"visible": False}},
+        extent_layer="Vicinity Parcels", scale_offset=10000, profile=profile)
+
+    # Imagery for the aerial map comes from the local tile cache when one is
+    # set up, so a slow or down image service doesn't fail the export. If any
+    # tile can't be had, the mxd's live imagery layer is used as before.
+    cached_imagery = None
+    if imagery_cache_folder and imagery_url:
+        # Room around the project for the page's shape
+        margin = max(project_extent.width, project_extent.height) + 500
+        cache = imagery_cache.TileCache(imagery_cache_folder, imagery_url,
+                                        project_extent.spatialReference)
+        cached_imagery = cache.BuildRaster(
+            imagery_cache.PaddedExtent(project_extent, margin), out_folder)
+
+    # Aerial Map: turn off vicinity parcels, turn on imagery, zoom to layer, add 200 to scale to give a little bit of space at the edges, export
+    out_path_a = map_export_worker.OutputPath(
+        os.path.join(out_folder, project_name + " Aerial"), profile)
+    aerial_layers = {"Vicinity Parcels": {"visible": False, "definitionQuery": dq},
+                     "Aerial Parcels": {"visible": True, "definitionQuery": dq},
+                     "Imagery": {"visible": True}}
+    aerial_rasters = []
+    if cached_imagery:
+        aerial_layers["Imagery"]["visible"] = False
+        aerial_rasters.append({"path": cached_imagery,
+                               "name": "Cached Imagery",
+                               "before": "Imagery"})
+    aerial_job = map_export_worker.MakeJob(
+        mxd_file, out_path_a, aerial_layers, extent_layer="Vicinity Parcels",
+        scale_offset=200, rasters=aerial_rasters, profile=profile)
+
+    return [vicinity_job, aerial_job]
+
+
+def CreateMaps(mxd_file, input_tids, parcel_tid_field, project_name,
+               project_extent, out_folder, imagery_cache_folder=None,
+               imagery_url=None, profile=None):
+    '''
+    Exports the vicinity and aerial maps at the same time, each in its own
+    worker process with its own copy of the mxd (see map_export_worker.py).
+
+    Returns: (vicinity map path, aerial map path)
+    '''
+    jobs = MapJobs(mxd_file, input_tids, parcel_tid_field, project_name,
+                   project_extent, out_folder, imagery_cache_folder,
+                   imagery_url, profile)
+    return tuple(map_export_worker.ExportMaps(jobs, out_folder))
@@ -0,0 +1,267 @@
+#*****************************************************************************
+#
+#  Project:  Parcel Spatial Index
+#  Purpose:  In-process spatial index of the parcel layer for finding all the
+#            parcels within a notice distance of the subject parcels
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Every parcel's geometry is read once and kept in memory, with the parcel
+# envelopes in an R-tree (built with the sort-tile-recursive packing, which
+# suits data that is loaded all at once and then only queried). A notice
+# distance query:
+#   1. Unions the subject parcels into a single geometry.
+#   2. Pulls every parcel whose envelope is within the distance of a subject
+#      parcel's envelope out of the R-tree.
+#   3. Keeps the candidates whose actual distance to the subject geometry is
+#      within the notice distance (the same test as SelectLayerByLocation's
+#      WITHIN_A_DISTANCE, including the subject parcels themselves).
+#
+# arcpy doesn't have prepared geometries like GEOS does; the nearest thing is
+# keeping the geometry objects themselves loaded so no geometry is read or
+# rebuilt while answering a query.
+#
+# The index is cached at module level, which persists between requests in a
+# geoprocessing service. It is rebuilt when the parcel data version changes
+# (see data_version.py), checked at most every check_interval seconds, or
+# when it is data_version.UNTRACKED_MAX_AGE seconds old if the parcel data
+# has no editor tracking (in-place edits don't change the version then).
+#
+# Like SelectLayerByLocation on the layer, the index only holds the parcels
+# that pass the layer's definition query (any selection is ignored). Layers
+# with different queries on the same data get separate indexes.
+
+import arcpy
+import math
+import time
+
+import data_version
+
+# Seconds between checks of the parcel data for changes
+DEFAULT_CHECK_INTERVAL = 30
+
+# Entries per R-tree node
+NODE_CAPACITY = 16
+
+# {(parcel source, tid field, where clause): [index, last_check_time]}
+_indexes = {}
+
+
+def _Intersects(a, b):
+    return not (a[2] < b[0] or a[0] > b[2] or a[3] < b[1] or a[1] > b[3])
+
+
+def _Union(boxes):
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+class EnvelopeTree(object):
+    '''
+    Static R-tree of (xmin, ymin, xmax, ymax) envelopes, bulk loaded with the
+    sort-tile-recursive algorithm. Query() returns the positions of the
+    envelopes in the original list.
+    '''
+
+    def __init__(self, boxes, capacity=NODE_CAPACITY):
+        self.capacity = capacity
+
+        # Each node is (envelope, [(child envelope, child)], is_leaf). Leaf
+        # children are the item positions.
+        nodes = self._Pack([(box, i) for i, box in enumerate(boxes)], True)
+        while len(nodes) > 1:
+            nodes = self._Pack([(n[0], n) for n in nodes], False)
+        self.root = nodes[0] if nodes else None
+
+    def _Pack(self, entries, leaf):
+        if not entries:
+            return []
+
+        node_count = int(math.ceil(len(entries) / float(self.capacity)))
+        slice_count = int(math.ceil(math.sqrt(node_count)))
+        slice_size = slice_count * self.capacity
+
+        entries = sorted(entries, key=lambda e: e[0][0] + e[0][2])
+        nodes = []
+        for i in range(0, len(entries), slice_size):
+            vertical_slice = sorted(entries[i:i + slice_size],
+                                    key=lambda e: e[0][1] + e[0][3])
+            for j in range(0, len(vertical_slice), self.capacity):
+                children = vertical_slice[j:j + self.capacity]
+                nodes.append((_Union([c[0] for c in children]), children, leaf))
+        return nodes
+
+    def Query(self, box):
+        '''
+        Returns the positions of all envelopes that intersect box.
+        '''
+        results = []
+        if self.root is None or not _Intersects(self.root[0], box):
+            return results
+
+        stack = [self.root]
+        while stack:
+            envelope, children, leaf = stack.pop()
+            for child_box, child in children:
+                if _Intersects(child_box, box):
+                    if leaf:
+                        results.append(child)
+                    else:
+                        stack.append(child)
+        return results
+
+
+class ParcelIndex(object):
+    '''
+    All the parcels of a layer, with their geometries and an envelope R-tree.
+    Use GetIndex() instead of creating these directly so the index is cached.
+    '''
+
+    def __init__(self, parcel_source, tid_field, version, where_clause=None):
+        '''
+        parcel_source: Parcel feature class (catalog path)
+        tid_field: Field holding the parcel ID
+        version: data_version token of the parcel data
+        where_clause: Optional query limiting the parcels that are indexed
+                      (ie, the layer's definition query)
+        '''
+        self.version = version
+        self.built = time.time()
+        self.where_clause = where_clause or None
+        self.spatial_reference = arcpy.Describe(parcel_source).spatialReference
+
+        self.tids = []
+        self.geometries = []
+        boxes = []
+        with arcpy.da.SearchCursor(parcel_source, [tid_field, "SHAPE@"],
+                                   self.where_clause) as sc:
+            for row in sc:
+                if row[1] is None:
+                    continue
+                extent = row[1].extent
+                self.tids.append(row[0])
+                self.geometries.append(row[1])
+                boxes.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+
+        # Parcel IDs aren't guaranteed unique (multipart parcels may be split
+        # into several features), so each ID maps to a list of positions
+        self.positions = {}
+        for i, tid in enumerate(self.tids):
+            self.positions.setdefault(tid, []).append(i)
+
+        self.boxes = boxes
+        self.tree = EnvelopeTree(boxes)
+
+    def SubjectGeometry(self, subject_tids):
+        '''
+        Returns the union of all the features for the subject parcel IDs, or
+        None if none of them are in the index.
+        '''
+        geometry = None
+        for tid in subject_tids:
+            for i in self.positions.get(tid, []):
+                if geometry is None:
+                    geometry = self.geometries[i]
+                else:
+                    geometry = geometry.union(self.geometries[i])
+        return geometry
+
+    def NeighborPositions(self, subject_tids, distance):
+        '''
+        Returns the sorted positions of every feature within distance (in the
+        parcel layer's units) of the subject parcels, including the subject
+        parcels themselves.
+        '''
+        subject = self.SubjectGeometry(subject_tids)
+        if subject is None:
+            return []
+
+        # Candidates from the R-tree, one envelope search per subject feature
+        candidates = set()
+        for tid in subject_tids:
+            for i in self.positions.get(tid, []):
+                xmin, ymin, xmax, ymax = self.boxes[i]
+                search_box = (xmin - distance, ymin - distance,
+                              xmax + distance, ymax + distance)
+                candidates.update(self.tree.Query(search_box))
+
+        # Exact distance test against the combined subject geometry
+        return sorted(i for i in candidates
+                      if subject.distanceTo(self.geometries[i]) <= distance)
+
+    def Neighbors(self, subject_tids, distance):
+        '''
+        Returns the sorted list of unique parcel IDs within distance of the
+        subject parcels, including the subject parcels themselves.
+        '''
+        positions = self.NeighborPositions(subject_tids, distance)
+        return sorted(set(self.tids[i] for i in positions))
+
+
+def LayerWhereClause(layer):
+    '''
+    Returns a layer's definition query, or None for a feature class or a
+    layer without one.
+    '''
+    return getattr(arcpy.Describe(layer), "whereClause", None) or None
+
+
+def GetIndex(parcel_layer, tid_field, check_interval=DEFAULT_CHECK_INTERVAL,
+             where_clause=None):
+    '''
+    Returns the cached ParcelIndex for the parcel layer's data source,
+    building it if it hasn't been built yet or if the parcel data has changed.
+    The data is only re-checked for changes if it has been more than
+    check_interval seconds since the last check.
+
+    parcel_layer: Parcel layer or feature class. The parcels passing the
+                  layer's definition query are indexed, regardless of any
+                  selection on the layer.
+    tid_field: Field holding the parcel ID
+    where_clause: Query to use in place of the layer's definition query (ie,
+                  for a worker that only has the feature class path)
+    '''
+    source = arcpy.Describe(parcel_layer).catalogPath
+    where_clause = where_clause or LayerWhereClause(parcel_layer)
+    key = (source, tid_field, where_clause)
+    now = time.time()
+
+    if key in _indexes:
+        index, last_check = _indexes[key]
+        if now - last_check < check_interval:
+            return index
+        version = data_version.GetDataVersion(source)
+        if (version == index.version and
+                not data_version.Expired(source, index.built)):
+            _indexes[key][1] = now
+            return index
+    else:
+        version = data_version.GetDataVersion(source)
+
+    index = ParcelIndex(source, tid_field, version, where_clause)
+    _indexes[key] = [index, now]
+    return index
+
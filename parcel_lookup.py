@@ -0,0 +1,196 @@
+#*****************************************************************************
+#
+#  Project:  Parcel Lookup Helpers
+#  Purpose:  Look up rows for large sets of parcel numbers without building
+#            one giant IN (...) where clause
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Shared by mailing_list.py and public_notice.py for pulling assessor rows
+# (and checking parcel IDs) for every parcel near the subject parcels.
+#
+# Building a single "parcel_number IN ('a', 'b', ...)" clause for thousands of
+# parcels makes a huge SQL statement that some databases reject outright
+# (Oracle stops at 1000 items) or plan badly, and an empty list produces the
+# invalid "IN ()". Instead:
+#   * Keys are de-duplicated, quoted with any single quotes escaped, and split
+#     into where clauses of at most chunk_size keys each. No keys means no
+#     queries at all.
+#   * Rows are streamed back from one cursor per chunk, so the caller can
+#     write them out as they arrive.
+#   * Past join_threshold keys, the keys are written to a temporary table in
+#     the scratch GDB instead, and the table is joined to the keys
+#     (KEEP_COMMON) and read with a single cursor.
+
+import arcpy
+import os
+import re
+
+# Keys per IN (...) clause
+DEFAULT_CHUNK_SIZE = 500
+
+# Above this many keys, join to a temporary key table instead
+DEFAULT_JOIN_THRESHOLD = 5000
+
+_KEY_TABLE = "lookup_keys"
+_KEY_FIELD = "lookup_key"
+
+# Regex pattern for parcel IDs
+PARCEL_ID_PATTERN = "[0-9]{2}-[0-9]{3}-[0-9]{4}"
+
+
+def QuoteValue(value):
+    '''
+    Returns value as a SQL string literal, with single quotes doubled so a
+    stray quote can't break out of the literal.
+    '''
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def BuildWhereClauses(field, keys, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Builds "field IN (...)" where clauses covering all the keys, with at most
+    chunk_size keys per clause.
+
+    field: Name of the field to match
+    keys: Iterable of key values; duplicates and blank values are dropped
+    chunk_size: Maximum number of keys per clause
+
+    Returns: List of where clause strings (empty if there are no keys)
+    '''
+    unique_keys = sorted(set(k for k in keys if k not in (None, "")))
+    clauses = []
+    for i in range(0, len(unique_keys), chunk_size):
+        chunk = unique_keys[i:i + chunk_size]
+        clauses.append("{} IN ({})".format(field,
+                                           ", ".join(QuoteValue(k) for k in chunk)))
+    return clauses
+
+
+def _QualifiedFields(view, fields):
+    '''
+    Fields in a joined view are named "table.field". Returns the qualified
+    name for each of the plain field names given.
+    '''
+    names = [f.name for f in arcpy.ListFields(view)]
+    qualified = []
+    for field in fields:
+        matches = [n for n in names
+                   if n.lower().rpartition(".")[2] == field.lower()
+                   and _KEY_TABLE not in n.lower()]
+        if not matches:
+            raise ValueError("Cannot find field {} in joined table".format(field))
+        qualified.append(matches[0])
+    return qualified
+
+
+def _IterJoinedRows(table, key_field, keys, fields):
+    '''
+    Writes the keys to a temporary table, joins table to it (keeping only
+    matching rows), and yields the requested fields from the join.
+    '''
+    workspace = arcpy.env.scratchGDB
+    key_table = os.path.join(workspace, _KEY_TABLE)
+    view = "parcel_lookup_view"
+
+    if arcpy.Exists(key_table):
+        arcpy.Delete_management(key_table)
+    if arcpy.Exists(view):
+        arcpy.Delete_management(view)
+
+    arcpy.CreateTable_management(workspace, _KEY_TABLE)
+    arcpy.AddField_management(key_table, _KEY_FIELD, "TEXT", field_length=50)
+    with arcpy.da.InsertCursor(key_table, _KEY_FIELD) as ic:
+        for key in keys:
+            ic.insertRow((key,))
+
+    try:
+        arcpy.MakeTableView_management(table, view)
+        arcpy.AddJoin_management(view, key_field, key_table, _KEY_FIELD,
+                                 "KEEP_COMMON")
+        with arcpy.da.SearchCursor(view, _QualifiedFields(view, fields)) as sc:
+            for row in sc:
+                yield row
+    finally:
+        if arcpy.Exists(view):
+            arcpy.Delete_management(view)
+        arcpy.Delete_management(key_table)
+
+
+def IterRows(table, key_field, keys, fields, chunk_size=DEFAULT_CHUNK_SIZE,
+             join_threshold=DEFAULT_JOIN_THRESHOLD):
+    '''
+    Yields the requested fields for every row of table whose key_field is in
+    keys.
+
+    table: Table, table view, or layer to read
+    key_field: Field to match the keys against
+    keys: Iterable of key values
+    fields: List of fields to return for each row
+    chunk_size: Maximum number of keys per IN (...) clause
+    join_threshold: Number of keys above which a temporary key table join is
+                    used instead of IN (...) clauses
+
+    Yields: Row tuples, in the order of fields
+    '''
+    unique_keys = sorted(set(k for k in keys if k not in (None, "")))
+
+    if len(unique_keys) > join_threshold:
+        for row in _IterJoinedRows(table, key_field, unique_keys, fields):
+            yield row
+        return
+
+    for where in BuildWhereClauses(key_field, unique_keys, chunk_size):
+        with arcpy.da.SearchCursor(table, fields, where) as sc:
+            for row in sc:
+                yield row
+
+
+def FindKeys(table, key_field, keys, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Returns the set of keys that exist in table's key_field.
+    '''
+    return set(r[0] for r in IterRows(table, key_field, keys, [key_field],
+                                      chunk_size))
+
+
+def CheckParcelIDs(tids, parcel_layer, tid_field):
+    '''
+    Makes sure the parcel IDs are formatted correctly and exist in the parcel
+    layer. All the IDs are checked in a single query and any that aren't found
+    are reported together.
+    '''
+    for tid in tids:
+        if not re.match(PARCEL_ID_PATTERN, tid):
+            raise Exception("Input Parcel IDs must be in the format " +
+                              "YY-YYY-YYYY, where Y is a single digit number." +
+                              " For example, 06-019-0009.")
+
+    found_tids = FindKeys(parcel_layer, tid_field, tids)
+    missing_tids = [t for t in tids if t not in found_tids]
+    if missing_tids:
+        raise Exception("Cannot find parcel ID(s) " + ", ".join(missing_tids) +
+                          " in parcel list.")
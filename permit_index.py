@@ -0,0 +1,185 @@
+#*****************************************************************************
+#
+#  Project:  Permit Number Index
+#  Purpose:  Finds a permit's row in one query, optionally through a cached
+#            index from permit number to ObjectID
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# FetchRow() checks that a permit exists and reads its fields with one
+# cursor, rather than one cursor to count the matching rows and another to
+# read them.
+#
+# With use_index, the permit number is first looked up in a dictionary of
+# permit number to ObjectIDs, and the row is read by ObjectID. The index is
+# cached at module level (it persists between requests in a geoprocessing
+# service) and kept up to date without rereading the whole layer: permits
+# are only ever added, and new rows get higher ObjectIDs, so a refresh only
+# reads the rows above the highest ObjectID already indexed. If the row count
+# shows that rows were deleted, the index is rebuilt.
+#
+# The index is only a shortcut, and it's built from the layer's data source,
+# so it can include rows the layer's definition query hides. The row read by
+# ObjectID must still have the requested permit number; if it doesn't (the
+# number was edited, the row is gone, or the layer hides it), the lookup
+# falls back to the plain query through the layer. Only if that finds the
+# permit is the index out of date and rebuilt; a permit the layer doesn't
+# show never triggers a rebuild.
+#
+# A permit number that isn't in the index costs a refresh (a cursor over the
+# rows added since the last one, plus a row count) and then the plain query.
+# One that is indexed but not shown by the layer costs the ObjectID read and
+# the plain query.
+
+import time
+
+import arcpy
+
+# Seconds between checks of the permit layer for new rows
+DEFAULT_CHECK_INTERVAL = 30
+
+# {(layer source, key field): [index, last_check_time]}
+_indexes = {}
+
+
+class KeyIndex(object):
+    '''
+    Dictionary of key field value to the ObjectIDs of the rows with that
+    value. Use GetIndex() instead of creating these directly so the index is
+    cached.
+    '''
+
+    def __init__(self, source, key_field):
+        self.source = source
+        self.key_field = key_field
+        self.oid_field = arcpy.Describe(source).OIDFieldName
+        self.oids = {}
+        self.count = 0
+        self.max_oid = None
+        self._Read(None)
+
+    def _Read(self, where):
+        with arcpy.da.SearchCursor(self.source, ["OID@", self.key_field],
+                                   where) as sc:
+            for oid, key in sc:
+                self.oids.setdefault(key, []).append(oid)
+                self.count += 1
+                if self.max_oid is None or oid > self.max_oid:
+                    self.max_oid = oid
+
+    def Refresh(self):
+        '''
+        Adds any rows added since the last refresh.
+
+        Returns: False if rows have been deleted and the index must be
+                 rebuilt instead
+        '''
+        if self.max_oid is None:
+            self._Read(None)
+        else:
+            self._Read("{} > {}".format(self.oid_field, self.max_oid))
+        count = int(arcpy.GetCount_management(self.source).getOutput(0))
+        return count == self.count
+
+    def Lookup(self, key):
+        return self.oids.get(key, [])
+
+
+def GetIndex(layer, key_field, check_interval=DEFAULT_CHECK_INTERVAL,
+             rebuild=False):
+    '''
+    Returns the cached KeyIndex for the layer's data source, adding new rows
+    at most every check_interval seconds.
+
+    rebuild: Read the whole data source again
+    '''
+    source = arcpy.Describe(layer).catalogPath
+    cache_key = (source, key_field)
+    now = time.time()
+
+    if cache_key in _indexes and not rebuild:
+        index, last_check = _indexes[cache_key]
+        if now - last_check < check_interval:
+            return index
+        if index.Refresh():
+            _indexes[cache_key][1] = now
+            return index
+
+    index = KeyIndex(source, key_field)
+    _indexes[cache_key] = [index, now]
+    return index
+
+
+def _Fetch(layer, fields, where):
+    '''
+    Returns a dictionary of the fields of the last row matching where, or
+    None if there are none.
+    '''
+    values = None
+    with arcpy.da.SearchCursor(layer, fields, where) as sc:
+        for row in sc:
+            values = dict(zip(sc.fields, row))
+    return values
+
+
+def FetchRow(layer, key_field, key, fields, use_index=False,
+             check_interval=DEFAULT_CHECK_INTERVAL):
+    '''
+    Returns a dictionary of the fields of the row whose key_field is key (the
+    last one, if there are several), or None if there isn't one.
+
+    use_index: Find the row by ObjectID through the cached index instead of
+               querying key_field
+    '''
+    where = "{} = '{}'".format(key_field, key)
+    if not use_index:
+        return _Fetch(layer, fields, where)
+
+    read_fields = list(fields)
+    if key_field not in read_fields:
+        read_fields.append(key_field)
+
+    index = GetIndex(layer, key_field, check_interval)
+    oids = index.Lookup(key)
+    if not oids:
+        # It may have been added since the last check
+        index = GetIndex(layer, key_field, 0)
+        oids = index.Lookup(key)
+    if oids:
+        oid_where = "{} IN ({})".format(index.oid_field,
+                                        ", ".join(str(o) for o in sorted(oids)))
+        values = _Fetch(layer, read_fields, oid_where)
+        if values is not None and values[key_field] == key:
+            return dict((f, values[f]) for f in fields)
+
+    # Not in the index, or the indexed row doesn't have this key through the
+    # layer: use the plain query, and if that finds it the index is out of
+    # date. If it doesn't, the row was deleted (the next refresh's row count
+    # catches that) or is hidden by the layer, and rebuilding wouldn't help.
+    values = _Fetch(layer, fields, where)
+    if values is not None:
+        GetIndex(layer, key_field, rebuild=True)
+    return values
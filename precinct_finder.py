@@ -43,9 +43,14 @@ import os
 import sys
 import traceback
 
+import composite_geocoder
+import precinct_grid
+import projection_cache
+import stage_metrics
+
 # ========== Parameters from ArcMap Script Tool ==========
 address = arcpy.GetParameterAsText(0)  # Text
-locator = arcpy.GetParameterAsText(1)  # Address Locator Service
+locators = arcpy.GetParameterAsText(1).split(";")  # Multivalue Address Locator Service, in order of preference
 precinct_layer = arcpy.GetParameterAsText(2)  # Feature Layer
 precinct_field = arcpy.GetParameterAsText(3)  # Field
 # Parameter 4 is precinct ID
@@ -58,7 +63,6 @@ precinct_field = arcpy.GetParameterAsText(3)  # Field
 
 # ========== Set up non-paramter variables ==========
 address_point_fc = "in_memory\\address_point"
-address_point_layer = "address_point_layer"
 scratch_table = os.path.join(arcpy.env.scratchGDB, "addr_table")
 #scratch_table = "in_memory\\addr_table"
 addr_table_view = "addr_table_view"
@@ -74,6 +78,10 @@ xy = ()
 match_info = ''
 errors = []
 
+# Time each stage so we can tell where a slow request spends its time. The
+# breakdown is added to the output messages and to a rolling local log.
+timer = stage_metrics.StageTimer("precinct_finder")
+
 # Clean up in_memory for safety
 arcpy.Delete_management("in_memory")
 
@@ -84,48 +92,65 @@ try:
     # disk accesses that probably slow it down a little bit, but it shouldn't
     # be too unbearable.
 
-    # Delete the old table.
-    if arcpy.Exists(scratch_table):
-        arcpy.Delete_management(scratch_table)
-
-    # Create the table and associated view to hold the address
-    arcpy.CreateTable_management(arcpy.env.scratchGDB, "addr_table")
-    arcpy.MakeTableView_management(scratch_table, addr_table_view)
-
-    # Add the address field and copy the address to the table
-    arcpy.AddField_management(addr_table_view, address_field, "TEXT", 200)
-    with arcpy.da.InsertCursor(addr_table_view, address_field) as ic:
-        ic.insertRow((address,))
-
-    # Geocode the address
-    arcpy.GeocodeAddresses_geocoding(addr_table_view, locator, "'Single Line Input' {} VISIBLE NONE".format(address_field), address_point_fc)
-
-    # Make sure we have a match, translate point to Web Mercator
-    arcpy.MakeFeatureLayer_management(address_point_fc, address_point_layer)
-    with arcpy.da.SearchCursor(address_point_layer, ["Status", "SHAPE@XY", "SHAPE@"]) as point_sc:
-        for row in point_sc:
-            match_info = "Type: {}, Location: {}".format(row[0], str(row[1]))
-            if row[0] not in ['M', 'T']:
-                raise ValueError("Address not found: {}".format(address))
-
-            # If it is a valid match, translate to web mercator
-            web_point = row[2].projectAs(arcpy.SpatialReference(3857))
-            xy = (web_point.centroid.X, web_point.centroid.Y)
-
-    # Select Precinct
-    arcpy.SelectLayerByLocation_management(precinct_layer, "CONTAINS",
-                                           address_point_layer, 0,
-                                           "NEW_SELECTION")
-
-    # Make sure we have just one precinct
-    precinct_count = int(arcpy.GetCount_management(precinct_layer).getOutput(0))
-    if precinct_count != 1:
-        raise ValueError("No precincts found.")
-
-    # Get precinct ID and return
-    with arcpy.da.SearchCursor(precinct_layer, precinct_field) as sc:
-        for row in sc:
-            precinct = row[0]
+    with timer.Stage("setup"):
+        # Delete the old table.
+        if arcpy.Exists(scratch_table):
+            arcpy.Delete_management(scratch_table)
+
+        # Create the table and associated view to hold the address
+        arcpy.CreateTable_management(arcpy.env.scratchGDB, "addr_table")
+        arcpy.MakeTableView_management(scratch_table, addr_table_view)
+
+        # Add the address field and copy the address to the table
+        arcpy.AddField_management(addr_table_view, address_field, "TEXT", 200)
+        with arcpy.da.InsertCursor(addr_table_view, address_field) as ic:
+            ic.insertRow((address,))
+
+    with timer.Stage("geocode"):
+        # Geocode the address, trying each locator in turn until one of them
+        # finds a match
+        address_point = None
+        for locator in locators:
+            results = composite_geocoder.GeocodeTier(addr_table_view, address_field,
+                                                     locator, address_point_fc)
+            for status, point in results.values():
+                location = (point.firstPoint.X, point.firstPoint.Y) if point else ()
+                match_info = "Type: {}, Location: {}, Locator: {}".format(
+                    status, str(location), locator)
+                if status in composite_geocoder.MATCH_STATUSES:
+                    address_point = point
+            if address_point is not None:
+                break
+
+        # Make sure we have a match
+        if address_point is None:
+            raise ValueError("Address not found: {}".format(address))
+
+    with timer.Stage("selection_setup"):
+        # Get the precinct lookup grid. This is only built on the first run of
+        # the service or after the precinct boundaries change; otherwise it
+        # comes straight from precinct_grid's cache. Clear any selection first
+        # so the grid is built from all the precincts.
+        if arcpy.Describe(precinct_layer).dataType == "FeatureLayer":
+            arcpy.SelectLayerByAttribute_management(precinct_layer, "CLEAR_SELECTION")
+        grid = precinct_grid.GetGrid(precinct_layer, precinct_field)
+
+    with timer.Stage("projection"):
+        # If it is a valid match, translate to web mercator. The spatial
+        # reference and transformation are cached between runs.
+        web_point = projection_cache.ProjectGeometry(address_point, projection_cache.WEB_MERCATOR)
+        xy = (web_point.centroid.X, web_point.centroid.Y)
+
+        # Also get the point in the precincts' projection for the lookup
+        grid_point = projection_cache.ProjectGeometry(address_point, grid.spatial_reference)
+
+    with timer.Stage("selection"):
+        # Find the precinct
+        precinct = grid.Lookup(grid_point.centroid.X, grid_point.centroid.Y)
+
+        # Make sure we found a precinct
+        if precinct is None or precinct == "":
+            raise ValueError("No precincts found.")
 
     arcpy.SetParameterAsText(4, precinct)
 
@@ -185,6 +210,11 @@ except Exception as e:
 # Set all the output parameters
 finally:
     arcpy.SetParameterAsText(5, str(xy))
-    arcpy.SetParameterAsText(6, match_info)
+    timing = timer.Breakdown()
+    arcpy.AddMessage(timing)
+    timer.Log()
+    if match_info:
+        match_info += "\n"
+    arcpy.SetParameterAsText(6, match_info + timing)
     error_string = '---'.join(errors)
     arcpy.SetParameterAsText(7, error_string)
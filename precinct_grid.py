@@ -0,0 +1,286 @@
+#*****************************************************************************
+#
+#  Project:  Precinct Lookup Grid
+#  Purpose:  Precomputed grid over the precinct layer that answers most
+#            point-in-precinct lookups with a simple array index
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# The county is divided into a square grid of cells. Each cell holds either:
+#   * the index of the one precinct that completely contains it,
+#   * EMPTY if no precinct touches it, or
+#   * BOUNDARY if a precinct line runs through it, in which case the indexes
+#     of the precincts that touch the cell are kept in a separate dictionary
+#     and the point is checked against just those geometries.
+# Most points land in an interior cell, so the lookup is an array index
+# instead of a point-in-polygon test against the full precinct boundaries.
+#
+# Cells are classified one precinct at a time by recursively splitting the
+# precinct's extent into quarters: blocks that are entirely inside or entirely
+# outside the precinct are settled in one geometry test, and only the blocks
+# along the boundary get split all the way down to single cells.
+#
+# The grid is kept in a module-level cache. When a script tool is run as a
+# geoprocessing service, imported modules stay loaded between requests, so the
+# grid is only built the first time and whenever the precinct geometry
+# changes. The precinct layer is fingerprinted (object ids, precinct ids,
+# areas, and perimeters) at most once every check_interval seconds to detect
+# changes.
+
+import arcpy
+import hashlib
+import time
+from array import array
+
+# Special cell values. Anything >= 0 is an index into the precinct list.
+EMPTY = -1
+BOUNDARY = -2
+
+# Default number of cells along the longer side of the precinct extent
+DEFAULT_CELLS = 256
+
+# Seconds between checks of the precinct layer for geometry changes
+DEFAULT_CHECK_INTERVAL = 60
+
+# {(precinct_layer, precinct_field, cells): [grid, last_check_time]}
+_grids = {}
+
+
+class PrecinctGrid(object):
+    '''
+    Lookup grid built from a precinct layer. Use GetGrid() instead of creating
+    these directly so that the grid is cached and rebuilt when needed.
+    '''
+
+    def __init__(self, ids, geometries, spatial_reference, cells, signature):
+        '''
+        ids: List of precinct IDs, in the same order as geometries
+        geometries: List of precinct polygons (arcpy.Polygon)
+        spatial_reference: Spatial reference of the precinct geometries
+        cells: Number of cells along the longer side of the precinct extent
+        signature: Fingerprint of the precinct layer used to build the grid
+        '''
+        self.ids = ids
+        self.geometries = geometries
+        self.spatial_reference = spatial_reference
+        self.signature = signature
+
+        # Overall extent of all precincts
+        self.xmin = min(g.extent.XMin for g in geometries)
+        self.ymin = min(g.extent.YMin for g in geometries)
+        xmax = max(g.extent.XMax for g in geometries)
+        ymax = max(g.extent.YMax for g in geometries)
+
+        # Square cells, with enough rows/columns to cover the whole extent
+        self.cell_size = max(xmax - self.xmin, ymax - self.ymin) / float(cells)
+        self.ncols = max(1, int((xmax - self.xmin) / self.cell_size) + 1)
+        self.nrows = max(1, int((ymax - self.ymin) / self.cell_size) + 1)
+
+        self.cells = array('i', [EMPTY]) * (self.ncols * self.nrows)
+
+        # {cell index: [precinct indexes]} for cells marked BOUNDARY
+        self.candidates = {}
+
+        for i, geometry in enumerate(geometries):
+            extent = geometry.extent
+            col0, row0 = self._CellOf(extent.XMin, extent.YMin)
+            col1, row1 = self._CellOf(extent.XMax, extent.YMax)
+            self._Classify(i, geometry, col0, row0, col1 + 1, row1 + 1)
+
+    def _CellOf(self, x, y):
+        '''
+        Returns the (column, row) of the cell containing x, y, clamped to the
+        edges of the grid.
+        '''
+        col = int((x - self.xmin) / self.cell_size)
+        row = int((y - self.ymin) / self.cell_size)
+        return (min(max(col, 0), self.ncols - 1),
+                min(max(row, 0), self.nrows - 1))
+
+    def _Block(self, col0, row0, col1, row1):
+        '''
+        Returns a polygon covering the cells from col0, row0 up to (but not
+        including) col1, row1.
+        '''
+        xmin = self.xmin + col0 * self.cell_size
+        ymin = self.ymin + row0 * self.cell_size
+        xmax = self.xmin + col1 * self.cell_size
+        ymax = self.ymin + row1 * self.cell_size
+        points = arcpy.Array([arcpy.Point(xmin, ymin), arcpy.Point(xmin, ymax),
+                              arcpy.Point(xmax, ymax), arcpy.Point(xmax, ymin),
+                              arcpy.Point(xmin, ymin)])
+        return arcpy.Polygon(points, self.spatial_reference)
+
+    def _Classify(self, i, geometry, col0, row0, col1, row1):
+        '''
+        Marks the cells in the block col0, row0 to col1, row1 (exclusive) as
+        inside, outside, or on the boundary of precinct i, splitting the block
+        into quarters until each piece is settled.
+        '''
+        block = self._Block(col0, row0, col1, row1)
+
+        # Just touching an edge doesn't make the precinct a candidate
+        if geometry.disjoint(block) or geometry.touches(block):
+            return
+
+        if geometry.contains(block):
+            for row in range(row0, row1):
+                for col in range(col0, col1):
+                    self._MarkInterior(row * self.ncols + col, i)
+            return
+
+        # Down to a single cell that straddles the boundary
+        if col1 - col0 == 1 and row1 - row0 == 1:
+            self._MarkBoundary(row0 * self.ncols + col0, i)
+            return
+
+        # Otherwise split into (up to) four smaller blocks and try again
+        col_mid = (col0 + col1 + 1) // 2 if col1 - col0 > 1 else col1
+        row_mid = (row0 + row1 + 1) // 2 if row1 - row0 > 1 else row1
+        for c0, c1 in ((col0, col_mid), (col_mid, col1)):
+            for r0, r1 in ((row0, row_mid), (row_mid, row1)):
+                if c0 < c1 and r0 < r1:
+                    self._Classify(i, geometry, c0, r0, c1, r1)
+
+    def _MarkInterior(self, k, i):
+        current = self.cells[k]
+        if current == EMPTY:
+            self.cells[k] = i
+        elif current == BOUNDARY:
+            self.candidates[k].append(i)
+        elif current != i:
+            # Overlapping precincts; let the exact test sort it out
+            self.cells[k] = BOUNDARY
+            self.candidates[k] = [current, i]
+
+    def _MarkBoundary(self, k, i):
+        current = self.cells[k]
+        if current == EMPTY:
+            self.cells[k] = BOUNDARY
+            self.candidates[k] = [i]
+        elif current == BOUNDARY:
+            self.candidates[k].append(i)
+        else:
+            self.cells[k] = BOUNDARY
+            self.candidates[k] = [current, i]
+
+    def Lookup(self, x, y):
+        '''
+        Returns the ID of the precinct containing the point x, y (in the
+        grid's spatial reference), or None if it isn't inside any precinct.
+        '''
+        col = int((x - self.xmin) / self.cell_size)
+        row = int((y - self.ymin) / self.cell_size)
+        if col < 0 or row < 0 or col >= self.ncols or row >= self.nrows:
+            return None
+
+        k = row * self.ncols + col
+        value = self.cells[k]
+        if value >= 0:
+            return self.ids[value]
+        if value == EMPTY:
+            return None
+
+        # Boundary cell: exact test against the precincts that touch it
+        point = arcpy.PointGeometry(arcpy.Point(x, y), self.spatial_reference)
+        for i in self.candidates[k]:
+            if self.geometries[i].contains(point):
+                return self.ids[i]
+        return None
+
+
+def GetSignature(precinct_layer, precinct_field):
+    '''
+    Fingerprints the precinct layer so that changes to the precinct
+    boundaries or IDs can be detected without comparing full geometries.
+
+    Returns: Hex digest string
+    '''
+    fields = ["OID@", precinct_field, "SHAPE@AREA", "SHAPE@LENGTH"]
+    with arcpy.da.SearchCursor(precinct_layer, fields) as sc:
+        rows = sorted((r[0], str(r[1]), round(r[2] or 0, 3), round(r[3] or 0, 3))
+                      for r in sc)
+    return hashlib.md5(repr(rows).encode("utf-8")).hexdigest()
+
+
+def BuildGrid(precinct_layer, precinct_field, cells=DEFAULT_CELLS,
+              signature=None):
+    '''
+    Reads all the precincts and builds a new lookup grid.
+
+    precinct_layer: Feature layer or feature class of precinct polygons
+    precinct_field: Field holding the precinct ID
+    cells: Number of cells along the longer side of the precinct extent
+    signature: Precomputed GetSignature() value, if already known
+
+    Returns: PrecinctGrid
+    '''
+    if signature is None:
+        signature = GetSignature(precinct_layer, precinct_field)
+
+    ids = []
+    geometries = []
+    with arcpy.da.SearchCursor(precinct_layer, [precinct_field, "SHAPE@"]) as sc:
+        for row in sc:
+            if row[1]:
+                ids.append(row[0])
+                geometries.append(row[1])
+
+    if not geometries:
+        raise ValueError("No precincts found in {}".format(precinct_layer))
+
+    spatial_reference = arcpy.Describe(precinct_layer).spatialReference
+
+    return PrecinctGrid(ids, geometries, spatial_reference, cells, signature)
+
+
+def GetGrid(precinct_layer, precinct_field, cells=DEFAULT_CELLS,
+            check_interval=DEFAULT_CHECK_INTERVAL):
+    '''
+    Returns the cached lookup grid for the precinct layer, building it if it
+    doesn't exist yet or if the precinct layer has changed since it was
+    built. The layer is only re-checked for changes if it has been more than
+    check_interval seconds since the last check.
+
+    Returns: PrecinctGrid
+    '''
+    key = (precinct_layer, precinct_field, cells)
+    now = time.time()
+
+    if key in _grids:
+        grid, last_check = _grids[key]
+        if now - last_check < check_interval:
+            return grid
+        signature = GetSignature(precinct_layer, precinct_field)
+        if signature == grid.signature:
+            _grids[key][1] = now
+            return grid
+    else:
+        signature = GetSignature(precinct_layer, precinct_field)
+
+    grid = BuildGrid(precinct_layer, precinct_field, cells, signature)
+    _grids[key] = [grid, now]
+    return grid
@@ -0,0 +1,250 @@
+#*****************************************************************************
+#
+#  Project:  Precinct Reassignment Tool
+#  Purpose:  Recompute the voting precinct of every address point after the
+#            precinct boundaries are redrawn and report only the addresses
+#            whose precinct changed
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# ==============================================================================
+# After redistricting, every address point in the county needs its precinct
+# recomputed against the new precinct layer. Doing that one geocoded address
+# at a time through precinct_finder.py would take hours, so this tool:
+#
+#   1. Splits the extent of the address points into tiles.
+#   2. Spatially joins the address points in each tile to the new precincts,
+#      with the tiles spread across a pool of worker processes.
+#   3. Reads the previous assignment from the address points and compares it
+#      to the joined results.
+#   4. Writes only the addresses whose precinct changed to a CSV, and
+#      optionally updates the address points' precinct field for just those
+#      addresses, in an edit session (see edit_session.py) so versioned data
+#      can be updated.
+#
+# The new precinct field doesn't have to be the same type as the address
+# points' precinct field (ie, text "12" and integer 12): the joined values
+# are converted to the address points' field type before they're compared.
+#
+# Points that sit exactly on a tile edge are picked up by both tiles; they get
+# the same answer in both, so the duplicate is just dropped. Address points
+# that fall outside every new precinct are reported with a blank new precinct.
+#
+# The address point and precinct inputs must be feature classes (not layers
+# from a map) so that the worker processes can open them.
+#
+# Run this as a stand-alone script or a script tool that runs out-of-process;
+# see worker_pool.py for why the tool code lives under __main__.
+# ==============================================================================
+
+import arcpy
+import csv
+import os
+import sys
+import traceback
+
+import edit_session
+import worker_pool
+
+# Name of the joined precinct field in each tile's output, so it can't clash
+# with a precinct field already on the address points
+JOINED_FIELD = "new_precinct"
+
+
+def JoinTile(args):
+    '''
+    Worker: spatially joins the address points within one tile to the
+    precincts.
+
+    args: Tuple of (address point fc, address id field, precinct fc, precinct
+          field, (xmin, ymin, xmax, ymax) of the tile)
+
+    Returns: Dictionary of {address id: new precinct id (None if not in any
+             precinct)}
+    '''
+    points_fc, id_field, precinct_fc, precinct_field, tile = args
+
+    arcpy.env.overwriteOutput = True
+    arcpy.env.extent = arcpy.Extent(*tile)
+    out_fc = "in_memory\\tile_join"
+
+    # Only carry the address id and the new precinct id through the join
+    mappings = arcpy.FieldMappings()
+
+    id_map = arcpy.FieldMap()
+    id_map.addInputField(points_fc, id_field)
+    mappings.addFieldMap(id_map)
+
+    precinct_map = arcpy.FieldMap()
+    precinct_map.addInputField(precinct_fc, precinct_field)
+    out_field = precinct_map.outputField
+    out_field.name = JOINED_FIELD
+    out_field.aliasName = JOINED_FIELD
+    precinct_map.outputField = out_field
+    mappings.addFieldMap(precinct_map)
+
+    arcpy.SpatialJoin_analysis(points_fc, precinct_fc, out_fc,
+                               "JOIN_ONE_TO_ONE", "KEEP_ALL", mappings,
+                               "WITHIN")
+
+    results = {}
+    with arcpy.da.SearchCursor(out_fc, [id_field, JOINED_FIELD]) as sc:
+        for row in sc:
+            results[row[0]] = row[1]
+
+    arcpy.Delete_management(out_fc)
+    return results
+
+
+def GetTiles(feature_class, tiles_per_side):
+    '''
+    Splits the extent of a feature class into tiles_per_side x tiles_per_side
+    tiles.
+
+    Returns: List of (xmin, ymin, xmax, ymax) tuples
+    '''
+    extent = arcpy.Describe(feature_class).extent
+    width = (extent.XMax - extent.XMin) / float(tiles_per_side)
+    height = (extent.YMax - extent.YMin) / float(tiles_per_side)
+
+    tiles = []
+    for i in range(tiles_per_side):
+        for j in range(tiles_per_side):
+            xmin = extent.XMin + i * width
+            ymin = extent.YMin + j * height
+            tiles.append((xmin, ymin, xmin + width, ymin + height))
+    return tiles
+
+
+def ToFieldType(value, field_type):
+    '''
+    Converts a precinct value to the Python type of a field of field_type
+    (arcpy.Field.type), so values from fields of different types compare
+    equal. Text is stripped, and whole numbers are written without a
+    decimal point.
+
+    Raises: ValueError if the value can't be stored in the field
+    '''
+    if value is None:
+        return None
+    if field_type in ("SmallInteger", "Integer"):
+        number = float(value)
+        if number != int(number):
+            raise ValueError("Precinct {} is not a whole number".format(value))
+        return int(number)
+    if field_type in ("Single", "Double"):
+        return float(value)
+    if isinstance(value, float) and value == int(value):
+        value = int(value)
+    text = value if hasattr(value, "strip") else str(value)
+    return text.strip() or None
+
+
+if __name__ == '__main__':
+    address_points = arcpy.GetParameterAsText(0)  # Feature Class
+    address_id_field = arcpy.GetParameterAsText(1)  # Field, from address_points
+    old_precinct_field = arcpy.GetParameterAsText(2)  # Field, from address_points
+    precinct_fc = arcpy.GetParameterAsText(3)  # Feature Class, new precincts
+    precinct_field = arcpy.GetParameterAsText(4)  # Field, from precinct_fc
+    update_points = arcpy.GetParameter(5)  # Boolean, write changes back
+    tiles_per_side = arcpy.GetParameter(6)  # Optional; Long
+    workers = arcpy.GetParameter(7)  # Optional; Long
+    # Parameter 8 is the changed addresses csv- file, derived output
+
+    try:
+        if not tiles_per_side:
+            tiles_per_side = 4
+
+        # Previous assignments, straight from the address points
+        arcpy.AddMessage("Reading previous precinct assignments...")
+        old_type = arcpy.ListFields(address_points, old_precinct_field)[0].type
+        old_precincts = {}
+        with arcpy.da.SearchCursor(address_points, [address_id_field,
+                                                    old_precinct_field]) as sc:
+            for row in sc:
+                old_precincts[row[0]] = ToFieldType(row[1], old_type)
+
+        # New assignments, one tile per task
+        tiles = GetTiles(address_points, tiles_per_side)
+        arcpy.AddMessage("Joining {} address points to new precincts in {} tiles...".format(
+            len(old_precincts), len(tiles)))
+
+        tasks = [(address_points, address_id_field, precinct_fc,
+                  precinct_field, tile) for tile in tiles]
+        pool = worker_pool.GetPool(workers)
+        try:
+            tile_results = pool.map(JoinTile, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        new_precincts = {}
+        for results in tile_results:
+            new_precincts.update(results)
+
+        # Diff the assignments, with both sides as the address points' type
+        changes = []
+        for address_id, old_precinct in old_precincts.items():
+            new_precinct = ToFieldType(new_precincts.get(address_id), old_type)
+            if new_precinct != old_precinct:
+                changes.append((address_id, old_precinct, new_precinct))
+
+        arcpy.AddMessage("{} addresses changed precincts.".format(len(changes)))
+
+        # Write out only the changed addresses
+        csv_file = os.path.join(arcpy.env.scratchFolder, "PrecinctChanges.csv")
+        with open(csv_file, 'w') as csvfile:
+            csvfile.write("sep=|\n")
+            writer = csv.writer(csvfile, delimiter='|', lineterminator='\n')
+            writer.writerow([address_id_field, "old_precinct", "new_precinct"])
+            for change in changes:
+                writer.writerow(["" if v is None else v for v in change])
+        arcpy.SetParameter(8, csv_file)
+
+        # Update only the rows that changed
+        if update_points and changes:
+            arcpy.AddMessage("Updating address points...")
+            changed = dict((c[0], c[2]) for c in changes)
+
+            def UpdatePoints():
+                with arcpy.da.UpdateCursor(address_points, [address_id_field,
+                                                            old_precinct_field]) as uc:
+                    for row in uc:
+                        if row[0] in changed:
+                            row[1] = changed[row[0]]
+                            uc.updateRow(row)
+
+            edit_session.RunEdit(edit_session.GetWorkspace(address_points),
+                                 UpdatePoints)
+
+    except arcpy.ExecuteError:
+        arcpy.AddError(arcpy.GetMessages(2))
+
+    except:
+        tb = sys.exc_info()[2]
+        tbinfo = traceback.format_tb(tb)[0]
+        pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+        arcpy.AddError(pymsg)
@@ -0,0 +1,186 @@
+#*****************************************************************************
+#
+#  Project:  Projection Cache
+#  Purpose:  Reusable spatial references and geographic transformations for
+#            projecting single geometries and batches of coordinates
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Creating an arcpy.SpatialReference and looking up the right geographic
+# transformation both take a surprising amount of time compared to the
+# projection itself. The objects are created once here and kept in
+# module-level dictionaries, which persist between requests when a script is
+# run as a geoprocessing service.
+#
+# ProjectGeometry() is for one-off geometries (a single geocoded address).
+# ProjectXYArrays() is for batches: the whole coordinate array is projected in
+# one call instead of creating and projecting a geometry per point.
+
+import arcpy
+import math
+import numpy
+
+WEB_MERCATOR = 3857
+WGS84 = 4326
+
+# Radius of the sphere used by Web Mercator, in meters
+_EARTH_RADIUS = 6378137.0
+
+# Web Mercator is undefined at the poles, so latitudes are clipped here
+_MAX_LATITUDE = 85.0511287798
+
+# {wkid or spatial reference string: arcpy.SpatialReference}
+_spatial_references = {}
+
+# {(from key, to key): transformation name, '' if none needed}
+_transformations = {}
+
+
+def _Key(spatial_reference):
+    '''
+    Returns a hashable key for a spatial reference: its WKID if it has one,
+    otherwise its full string representation.
+    '''
+    if spatial_reference.factoryCode:
+        return spatial_reference.factoryCode
+    return spatial_reference.exportToString()
+
+
+def GetSpatialReference(spatial_reference):
+    '''
+    Returns a cached arcpy.SpatialReference for a WKID or for a string from
+    SpatialReference.exportToString(). Passing in an existing
+    SpatialReference just returns it so callers can use any of the three.
+    '''
+    if isinstance(spatial_reference, arcpy.SpatialReference):
+        return spatial_reference
+
+    if spatial_reference not in _spatial_references:
+        if isinstance(spatial_reference, int):
+            sr = arcpy.SpatialReference(spatial_reference)
+        else:
+            sr = arcpy.SpatialReference()
+            sr.loadFromString(spatial_reference)
+        _spatial_references[spatial_reference] = sr
+    return _spatial_references[spatial_reference]
+
+
+def GetTransformation(from_sr, to_sr):
+    '''
+    Returns the name of the default geographic transformation between two
+    spatial references, or '' if they share a datum. The lookup is cached.
+    '''
+    from_sr = GetSpatialReference(from_sr)
+    to_sr = GetSpatialReference(to_sr)
+    key = (_Key(from_sr), _Key(to_sr))
+
+    if key not in _transformations:
+        transformation = ''
+        if from_sr.GCS.name != to_sr.GCS.name:
+            transformations = arcpy.ListTransformations(from_sr, to_sr)
+            if transformations:
+                transformation = transformations[0]
+        _transformations[key] = transformation
+
+    return _transformations[key]
+
+
+def ProjectGeometry(geometry, to_sr):
+    '''
+    Projects a single geometry using the cached spatial reference and
+    transformation.
+
+    geometry: arcpy geometry object with a spatial reference
+    to_sr: WKID or arcpy.SpatialReference to project to
+
+    Returns: Projected geometry
+    '''
+    to_sr = GetSpatialReference(to_sr)
+    if _Key(geometry.spatialReference) == _Key(to_sr):
+        return geometry
+
+    transformation = GetTransformation(geometry.spatialReference, to_sr)
+    if transformation:
+        return geometry.projectAs(to_sr, transformation)
+    return geometry.projectAs(to_sr)
+
+
+def ProjectXYArrays(xs, ys, from_sr, to_sr):
+    '''
+    Projects arrays of x and y coordinates in one pass.
+
+    WGS84 to Web Mercator (the usual web map case) is done directly with
+    numpy. Anything else goes through an in_memory feature class that is read
+    back with a projecting cursor, so arcpy projects the whole batch at once.
+
+    xs, ys: Sequences of coordinates in from_sr
+    from_sr, to_sr: WKIDs or arcpy.SpatialReferences
+
+    Returns: (x array, y array) as numpy arrays in to_sr
+    '''
+    from_sr = GetSpatialReference(from_sr)
+    to_sr = GetSpatialReference(to_sr)
+    xs = numpy.asarray(xs, dtype=numpy.float64)
+    ys = numpy.asarray(ys, dtype=numpy.float64)
+
+    if len(xs) == 0 or _Key(from_sr) == _Key(to_sr):
+        return (xs, ys)
+
+    if _Key(from_sr) == WGS84 and _Key(to_sr) == WEB_MERCATOR:
+        lat = numpy.clip(ys, -_MAX_LATITUDE, _MAX_LATITUDE)
+        x = numpy.radians(xs) * _EARTH_RADIUS
+        y = numpy.log(numpy.tan(math.pi / 4.0 + numpy.radians(lat) / 2.0)) * _EARTH_RADIUS
+        return (x, y)
+
+    # General case: let arcpy project the entire array
+    temp_fc = "in_memory\\project_xy"
+    if arcpy.Exists(temp_fc):
+        arcpy.Delete_management(temp_fc)
+
+    points = numpy.empty(len(xs), dtype=[("idx", numpy.int32),
+                                          ("x", numpy.float64),
+                                          ("y", numpy.float64)])
+    points["idx"] = numpy.arange(len(xs))
+    points["x"] = xs
+    points["y"] = ys
+    arcpy.da.NumPyArrayToFeatureClass(points, temp_fc, ["x", "y"], from_sr)
+
+    # The projecting read uses the environment's transformation list
+    old_transformations = arcpy.env.geographicTransformations
+    transformation = GetTransformation(from_sr, to_sr)
+    if transformation:
+        arcpy.env.geographicTransformations = transformation
+    try:
+        projected = arcpy.da.FeatureClassToNumPyArray(temp_fc,
+                                                      ["idx", "SHAPE@X", "SHAPE@Y"],
+                                                      spatial_reference=to_sr)
+    finally:
+        arcpy.env.geographicTransformations = old_transformations
+        arcpy.Delete_management(temp_fc)
+
+    # Put the points back in their original order just to be safe
+    projected.sort(order="idx")
+    return (projected["SHAPE@X"], projected["SHAPE@Y"])
@@ -32,11 +32,17 @@
 
 import arcpy
 import re
-import os
-import csv
 import sys
 import traceback
 
+import edit_session
+import lu_projects
+import map_export_worker
+import notice_jobs
+import notice_products
+import parcel_lookup
+import publish_projects
+
 TIDs = arcpy.GetParameterAsText(0) # Multivalue paramter
 project_type = arcpy.GetParameterAsText(1) # Specify values in script tool
 project_name = arcpy.GetParameterAsText(2)
@@ -53,6 +59,18 @@ mxd_file = arcpy.GetParameterAsText(14)
 lua = arcpy.GetParameterAsText(15) # Again, specify values
 solo_table = arcpy.GetParameterAsText(16) # Table in mxd
 # Parameter 17 used as message/error parameter below
+consolidate_raw = arcpy.GetParameterAsText(18) # Optional; Boolean, default True- one CSV row per owner/address
+imagery_cache_folder = arcpy.GetParameterAsText(19) # Optional; Folder for cached imagery tiles (see imagery_cache.py)
+imagery_url = arcpy.GetParameterAsText(20) # Optional; Image service REST URL for the cache
+queue_folder = arcpy.GetParameterAsText(21) # Optional; Folder of the notice job queue (see notice_jobs.py)
+# Parameter 22 is the queued job's ID- String, derived output (only set when queue_folder is given)
+export_profile = arcpy.GetParameterAsText(23) # Optional; String: full (600 dpi jpg, default), web, print, or thumbnail
+public_file = arcpy.GetParameterAsText(24) # Optional; File, GeoJSON of active projects for the public map (see publish_projects.py)
+
+# Omitted optional parameters can come through as "#"
+imagery_cache_folder, imagery_url, queue_folder, export_profile, public_file = [
+    "" if value == "#" else value for value in
+    (imagery_cache_folder, imagery_url, queue_folder, export_profile, public_file)]
 
 
 # Previous notes below left here for posterity's sake
@@ -79,30 +97,8 @@ solo_table = arcpy.GetParameterAsText(16) # Table in mxd
 # MultiValue parameters come in as a single long string with each entry
 # separated by a ";". split(";") creates a list by spliting on the ";"
 TID = TIDs.split(";")
-temp_fc = "in_memory\\temp_fc"
-surrounding_parcels_fc = "in_memory\\surrounding_fc"
-table_view = "assessor_table_view"
 parcel_tid_field = "tax_id"
 table_tid_field = "parcel_number"
-address_fields_list = ["parcel_number", "owner_name", "owner_address1", "owner_city_state_zip"]
-fields = {
-            "projecttype" : "TEXT",
-            "projectname" : "TEXT",
-            "projectaddress" : "TEXT",
-            "projectsummary" : "TEXT",
-            "nextmeeting" : "DATE",
-            "staffreport" : "TEXT",
-            "status" : "TEXT",
-            "parcelids" : "TEXT",
-            "active" : "TEXT",
-            "landuseauthority" : "TEXT"
-          }
-
-field_list = ["projecttype", "projectname", "projectaddress",
-              "projectsummary", "nextmeeting", "staffreport", "status", "parcelids",
-              "active", "landuseauthority"]
-
-verified_parcels = []
 
 messages = []
 
@@ -117,186 +113,93 @@ try:
     # Regex pattern for parcel IDs
     pattern = "[0-9]{2}-[0-9]{3}-[0-9]{4}"
 
-    # Make sure parcel numbers are valid
-    for tid in TID:
-        if tid and tid != "#":
-            # Make sure the parcel ID is formatted correctly
-            if not re.match(pattern, tid):
-                raise ValueError("Input Parcel IDs must be in the format " +
-                                  "YY-YYY-YYYY, where Y is a single digit number." +
-                                  " For example, 06-019-0009.")
-
-            # Make sure parcel ID is a valid parcel
-            where = parcel_tid_field + " = '" + tid + "'"
-            with arcpy.da.SearchCursor(parcel_layer, parcel_tid_field, where) as search_cursor:
-                if sum(1 for _ in search_cursor) < 1: #sums number of records
-                    raise ValueError("Cannot find parcel ID " + tid + " in parcel " +
-                                      "list.")
+    # Make sure the parcel IDs are formatted correctly
+    input_tids = [tid for tid in TID if tid and tid != "#"]
+    for tid in input_tids:
+        if not re.match(pattern, tid):
+            raise ValueError("Input Parcel IDs must be in the format " +
+                              "YY-YYY-YYYY, where Y is a single digit number." +
+                              " For example, 06-019-0009.")
+
+    # Make sure the parcel IDs are valid parcels, all in one query
+    found_tids = parcel_lookup.FindKeys(parcel_layer, parcel_tid_field, input_tids)
+    missing_tids = [t for t in input_tids if t not in found_tids]
+    if missing_tids:
+        raise ValueError("Cannot find parcel ID(s) " + ", ".join(missing_tids) +
+                          " in parcel list.")
 
     # Check for any characters in the project name that would cause havok with the file system
     file_pattern = r'[<>:"/\|?*]+'
     if re.search(file_pattern, project_name):
         raise ValueError("Please enter a different project name that does not contain the following characters: <>:\"/\\|?*")
 
-    # Wrap parcel id's in single quotes for where clauses
-    parcel_list = ["\'%s\'" %(p) for p in TID]
-
-    # Set definition query
-    if len(parcel_list) > 1:
-        tid_string = ", ".join(parcel_list)
-    elif len(parcel_list) == 1:
-        tid_string = parcel_list[0]
-    elif len(parcel_list) < 1:
+    if not input_tids:
         raise ValueError("No parcels specified.")
-    dq = parcel_tid_field + " IN (" + tid_string + ")"
-
-    # Add all desired parcels to selection
-    arcpy.SelectLayerByAttribute_management(parcel_layer, "ADD_TO_SELECTION", dq)
-
-    # Dissolve parcels (if needed) into temporary feature class
-    arcpy.Dissolve_management(parcel_layer, temp_fc)
-
-    # Add fields to temporary feature class
-    for field, ftype in fields.iteritems():
-        if ftype is "TEXT":
-            arcpy.AddField_management(temp_fc, field, ftype, field_length=400)
-        else:
-            arcpy.AddField_management(temp_fc, field, ftype)
-
-    # Update fields with info from parameters to temporary feature class
-    with arcpy.da.UpdateCursor(temp_fc, field_list) as update_cursor:
-        for row in update_cursor:
-            row[0] = project_type
-            row[1] = project_name
-            row[2] = project_address
-            row[3] = request_summary
-            row[4] = meeting_date
-            row[5] = sr_link
-            row[6] = status
-            row[7] = ", ".join(TID)
-            row[8] = "Yes"
-            row[9] = lua
-            update_cursor.updateRow(row)
-
-    # Append merged parcel to Project FC
-    arcpy.Append_management(temp_fc, projects_layer, "NO_TEST")
-
-    arcpy.AddMessage("Creating mailing list...")
-    messages.append("Creating mailing list...")
-
-    # ============= Create public notice mailing lists =============
-    # Select nearby features (assumes parcel_layer selection is still valid)
-    selection = arcpy.SelectLayerByLocation_management(parcel_layer, overlap_type = "WITHIN_A_DISTANCE",
-                                                select_features = parcel_layer,
-                                                search_distance = buffer_distance,
-                                                selection_type = "NEW_SELECTION")
-
-    # Get nearby parcel IDs
-    nearby_parcels = []
-    with arcpy.da.SearchCursor(parcel_layer, parcel_tid_field) as parcel_cursor:
-        nearby_parcels = ["\'%s\'" %(r[0]) for r in parcel_cursor]
-
-    # Table definition query
-    if len(nearby_parcels) > 1:
-        table_tid_string = ", ".join(nearby_parcels)
-    elif len(nearby_parcels) == 1:
-        table_tid_string = nearby_parcels[0]
-    else:
-        table_tid_string = ""
-    table_where = "%s IN (%s)" %(table_tid_field, table_tid_string)
-
-    # Make table view with subsetted entries
-    arcpy.MakeTableView_management(solo_table, table_view, table_where)
-
-    # ========= Write out to csv ===========
-    arcpy.AddMessage("Creating CSV...")
-    messages.append("Creating CSV...")
-
-    # Create CSV of records from new feature class
-    csv_file = os.path.join(arcpy.env.scratchFolder, "Addresses.csv")
-    with open(csv_file, 'w') as csvfile:
-        csvfile.write("sep=|\n")
-        writer = csv.writer(csvfile, delimiter='|', lineterminator='\n')
-        with arcpy.da.SearchCursor(table_view, field_names=address_fields_list) as cursor:
-            writer.writerow(address_fields_list)
-            for row in cursor:
-                writer.writerow(row)
-
-    # Sends path of the csv file back to the service handler
-    arcpy.SetParameter(11, csv_file)
-
-    arcpy.AddMessage("Setting up mxd for mapping...")
-    messages.append("Setting up mxd for mapping...")
-    # ============= Create Overview and Aerial maps for staff Report =============
-    # Clear selection to avoid selection symbology in exported maps
-    arcpy.SelectLayerByAttribute_management(parcel_layer, "CLEAR_SELECTION")
 
-    # Get the map document, data frame, and layers
-    arcpy.AddMessage("MXD Path: " + mxd_file)
-    mxd = arcpy.mapping.MapDocument(mxd_file)
-    df = arcpy.mapping.ListDataFrames(mxd)[0]
-    layers = arcpy.mapping.ListLayers(mxd)
-    for l in layers:
-        if l.name == "Aerial Parcels":
-            a_layer = l
-        elif l.name == "Vicinity Parcels":
-            v_layer = l
-        elif l.name == "Imagery":
-            i_layer = l
-
-    # Uses definition query created earlier
-    a_layer.definitionQuery = dq
-    v_layer.definitionQuery = dq
-
-    arcpy.AddMessage("Creating vicinity map...")
-    messages.append("Creating vicinity map...")
-    # Vicinity Map: turn on vicinity parcels, turn off imagery, zoom to layer, add 10k to extent, export to jpg @ 600dpi
-    v_layer.visible = True
-    a_layer.visible = True
-    i_layer.visible = False
-    df.extent = v_layer.getExtent() # Set extent to match layers
-    df.scale = df.scale + 10000 # Add 10k to scale to give us the vicinity view
-    out_path_v = os.path.join(arcpy.env.scratchFolder, project_name + " Vicinity.jpg")
-    arcpy.mapping.ExportToJPEG(mxd, out_path_v, resolution=600)
-    arcpy.SetParameter(12, out_path_v)
-
-    arcpy.AddMessage("Creating aerial map...")
-    messages.append("Creating aerial map...")
-    # Aerial Map: turn off vicinity parcels, turn on imagery, zoom to layer, export
-    v_layer.visible = False
-    a_layer.visible = True
-    i_layer.visible = True
-    df.extent = v_layer.getExtent() # Set extent to match layers
-    df.scale += 200 # Add 200 to scale to give a little bit of space at the edges
-
-    # # Use Logan's image service for imagery...
-    # server_url = "http://gis.loganutah.org/arcgis/services/Ortho/Ortho2016_Cache/ImageServer"
-    # layer_name = "in_memory\\imagery_layer"
-    #
-    # # Calculate new extent for imagery
-    # # New extent is delta_x map units wider, where delta_x = map distance * new scale - original width
-    # # To center new extent, add/subtract by delta_x by 2 (and similar for delta_y and height)
-    # x_md = df.elementWidth / mxd.pageSize.width # Map distance in feet is df width / mxd width (both in inches)
-    # y_md = df.elementHeight / mxd.pageSize.height
-    # delta_x = x_md * df.scale - a_layer.getExtent().width
-    # delta_y = y_md * df.scale - a_layer.getExtent().height
-    #
-    # xmin = a_layer.getExtent().XMin - (delta_x / 2.0)
-    # xmax = a_layer.getExtent().XMax + (delta_x / 2.0)
-    # ymin = a_layer.getExtent().YMin - (delta_y / 2.0)
-    # ymax = a_layer.getExtent().YMax + (delta_y / 2.0)
-    # ex = arcpy.Extent(xmin, ymin, xmax, ymax)
-    #
-    # arcpy.MakeImageServerLayer_management(server_url, layer_name, ex)
-    # image_layer = arcpy.mapping.Layer(layer_name)
-    # arcpy.mapping.InsertLayer(df, i_layer, image_layer)
-    # image_layer.visible = True
-
-    out_path_a = os.path.join(arcpy.env.scratchFolder, project_name + " Aerial.jpg")
-    arcpy.mapping.ExportToJPEG(mxd, out_path_a, resolution=600)
-    arcpy.SetParameter(13, out_path_a)
-
-    del mxd
+    # Unknown export profiles fail here rather than after the project is added
+    map_export_worker.GetProfile(export_profile)
+
+    # Project polygon is the union of the parcels, read with one cursor and
+    # written to the projects layer with one InsertCursor in a managed edit
+    # session that retries if another editor saves first (see lu_projects.py)
+    project_geometry = lu_projects.ParcelGeometry(parcel_layer, parcel_tid_field, input_tids)
+    lu_projects.InsertProjects(projects_layer, [
+        lu_projects.ProjectRow(project_geometry, project_type, project_name,
+                               project_address, request_summary, meeting_date,
+                               sr_link, status, input_tids, lua)])
+
+    # Refresh the public map's copy of the active projects. The project is
+    # already saved, so a failure here is only a warning.
+    if public_file:
+        try:
+            publish_projects.Publish(projects_layer, public_file)
+        except Exception as e:
+            arcpy.AddWarning("Could not publish projects: {}".format(e))
+            messages.append(" --- Project added, but the public project map could not be updated: {} --- ".format(e))
+
+    # Extent of the new project, for the maps
+    project_extent = project_geometry.extent
+
+    consolidate = consolidate_raw.lower() != "false"
+
+    if queue_folder:
+        # ============= Queue the mailing list and maps =============
+        # The polygon is in; the CSV and maps are made by a background worker
+        # (see notice_jobs.py) and picked up later with the job ID
+        spec = notice_jobs.MakeSpec(project_name, input_tids, parcel_layer,
+                                    parcel_tid_field, buffer_distance,
+                                    solo_table, table_tid_field, consolidate,
+                                    mxd_file, project_extent,
+                                    imagery_cache_folder, imagery_url,
+                                    export_profile)
+        job_id = notice_jobs.Submit(queue_folder, spec)
+        arcpy.SetParameterAsText(22, job_id)
+        messages.append("Project added. Mailing list and maps queued as job " + job_id)
+
+    else:
+        # ============= Create public notice mailing lists =============
+        arcpy.AddMessage("Creating mailing list...")
+        messages.append("Creating mailing list...")
+        csv_file = notice_products.CreateMailingList(
+            parcel_layer, parcel_tid_field, input_tids, buffer_distance,
+            solo_table, table_tid_field, arcpy.env.scratchFolder,
+            consolidate=consolidate)
+
+        # Sends path of the csv file back to the service handler
+        arcpy.SetParameter(11, csv_file)
+
+        # ============= Create Overview and Aerial maps for staff Report =============
+        # Both maps are exported at the same time, each by its own worker
+        # process with its own copy of the mxd (see notice_products.py)
+        arcpy.AddMessage("MXD Path: " + mxd_file)
+        arcpy.AddMessage("Creating vicinity and aerial maps...")
+        messages.append("Creating vicinity and aerial maps...")
+        out_path_v, out_path_a = notice_products.CreateMaps(
+            mxd_file, input_tids, parcel_tid_field, project_name,
+            project_extent, arcpy.env.scratchFolder, imagery_cache_folder,
+            imagery_url, export_profile)
+        arcpy.SetParameter(12, out_path_v)
+        arcpy.SetParameter(13, out_path_a)
 
 except ValueError as ve:
     # Get the traceback object
@@ -331,14 +234,14 @@ except Exception as ex:
     messages.append(ex.args[0])
 
     # Sometimes the database state changes while adding the polygon (someone
-    # saves edits, etc). The GP service doesn't handle that all that well
-    # (without going through the hassle of an edit session). This manifests as
-    # the script failing once, and then future attempts seem to succeed but
-    # don't add polygons. The solution is to restart the service and add them
-    # again.
-    if "version has been redefined" in ex.args[0]:
+    # saves edits, etc). The polygon is added in an edit session that
+    # reconnects and tries again when that happens (see edit_session.py), so
+    # this only shows up if other editors kept saving through every retry.
+    # Nothing was added, and the connection has been reset, so the tool can
+    # just be run again.
+    if edit_session.IsVersionRedefined(ex):
         messages.append("\n")
-        messages.append(" --- Error adding project polygon. Please ask GIS to restart the Geoprocessing Service before trying again. --- ")
+        messages.append(" --- Error adding project polygon: the projects layer was being edited by someone else. Please try again. --- ")
         messages.append("\n")
 
     # Sometimes the call to add the imagery from Logan City times out. The
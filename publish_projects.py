@@ -0,0 +1,230 @@
+#*****************************************************************************
+#
+#  Project:  Public Land Use Project Layer
+#  Purpose:  Publishes the active land use projects as a static GeoJSON file
+#            for the public webmap
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# The public land use project map used to query the live projects feature
+# class, so every anonymous page view was a query against the SDE. Instead,
+# the active projects are written to a GeoJSON file on a web server folder
+# and the public map reads that:
+#
+#   * Only active projects, and only the public fields
+#   * In WGS84, generalized, with coordinates rounded to PRECISION digits
+#   * Written to a uniquely named temporary file and then renamed over the
+#     old one, so the web server never sends a half-written file and two
+#     publishes at once don't write to the same file. (Python 2 can't rename
+#     over a file, so there the old file is removed first and the file is
+#     briefly missing; a request in that moment gets a 404 and the map
+#     retries on its next refresh.)
+#
+# public_notice.py and batch_projects.py publish right after adding projects
+# when they're given an output file. Status changes made in ArcMap are picked
+# up by running this script as a scheduled task:
+#
+#   python publish_projects.py <projects feature class> <output .geojson>
+#
+# which rewrites the file only if the projects have changed since it was last
+# published (see data_version.py). Status edits only change the version token
+# if editor tracking is on, so without it the file is also rewritten once it
+# is data_version.UNTRACKED_MAX_AGE seconds old; schedule the task at least
+# that often.
+
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+import arcpy
+
+import data_version
+import display_output
+import projection_cache
+
+# Fields shown on the public map
+PUBLIC_FIELDS = ["projecttype", "projectname", "projectaddress",
+                 "projectsummary", "nextmeeting", "staffreport", "status",
+                 "parcelids", "landuseauthority"]
+
+ACTIVE_WHERE = "active = 'Yes'"
+
+# Generalization tolerance, in the projects layer's units (feet)
+PUBLISH_TOLERANCE = 2.0
+
+# Decimal places kept in the WGS84 coordinates (6 is about 4 inches)
+PRECISION = 6
+
+# Tries at swapping in the new file on Python 2, where the old file can be
+# locked by the web server while it's being sent
+REPLACE_TRIES = 5
+
+
+def _Round(coordinates, digits):
+    '''
+    Rounds a GeoJSON coordinate array, at any depth of nesting.
+    '''
+    if coordinates and isinstance(coordinates[0], (list, tuple)):
+        return [_Round(c, digits) for c in coordinates]
+    return [round(c, digits) for c in coordinates]
+
+
+def _Value(value):
+    '''
+    Returns a JSON-safe version of a field value.
+    '''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def BuildGeoJSON(projects_layer, tolerance=PUBLISH_TOLERANCE,
+                 digits=PRECISION):
+    '''
+    Returns a GeoJSON FeatureCollection (as a dictionary) of the active
+    projects, read from the layer's data source so any selection or
+    definition query on the layer is ignored.
+    '''
+    source = arcpy.Describe(projects_layer).catalogPath
+    features = []
+    with arcpy.da.SearchCursor(source, ["SHAPE@"] + PUBLIC_FIELDS,
+                               ACTIVE_WHERE) as sc:
+        for row in sc:
+            if row[0] is None:
+                continue
+            geometry = display_output.Generalize([row[0]], tolerance)[0]
+            wgs84 = projection_cache.ProjectGeometry(geometry,
+                                                     projection_cache.WGS84)
+            geojson = dict(wgs84.__geo_interface__)
+            geojson["coordinates"] = _Round(geojson["coordinates"], digits)
+            properties = dict((f, _Value(v)) for f, v in zip(PUBLIC_FIELDS, row[1:]))
+            features.append({"type": "Feature",
+                             "geometry": geojson,
+                             "properties": properties})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _VersionPath(out_file):
+    return out_file + ".version"
+
+
+def _WriteReplace(out_file, write):
+    '''
+    Calls write(file object) on a new temporary file in out_file's folder,
+    then renames it over out_file.
+    '''
+    folder = os.path.dirname(os.path.abspath(out_file))
+    handle, temp_file = tempfile.mkstemp(suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(handle, 'w') as f:
+            write(f)
+        # mkstemp() makes the file readable only by us; the web server needs
+        # to read it too
+        os.chmod(temp_file, 0o644)
+        if hasattr(os, "replace"):
+            os.replace(temp_file, out_file)
+            return
+        for attempt in range(REPLACE_TRIES):
+            try:
+                if os.path.exists(out_file):
+                    os.remove(out_file)
+                os.rename(temp_file, out_file)
+                return
+            except OSError:
+                # Another publish got there between the remove and the
+                # rename, or the old file is open; try again
+                if attempt == REPLACE_TRIES - 1:
+                    raise
+                time.sleep(0.2)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def Publish(projects_layer, out_file, tolerance=PUBLISH_TOLERANCE,
+            digits=PRECISION):
+    '''
+    Writes the active projects to out_file, replacing it in one step.
+
+    Returns: Number of projects published
+    '''
+    version = data_version.GetDataVersion(projects_layer)
+    collection = BuildGeoJSON(projects_layer, tolerance, digits)
+
+    folder = os.path.dirname(os.path.abspath(out_file))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    _WriteReplace(out_file,
+                  lambda f: json.dump(collection, f, separators=(",", ":")))
+    _WriteReplace(_VersionPath(out_file), lambda f: f.write(version))
+
+    return len(collection["features"])
+
+
+def PublishIfChanged(projects_layer, out_file, tolerance=PUBLISH_TOLERANCE,
+                     digits=PRECISION):
+    '''
+    Publishes the projects only if they've changed since out_file was last
+    written (or, without editor tracking, if out_file is too old to trust
+    the version; see data_version.Expired()).
+
+    Returns: Number of projects published, or None if nothing changed
+    '''
+    version_path = _VersionPath(out_file)
+    if os.path.exists(out_file) and os.path.exists(version_path):
+        with open(version_path, 'r') as f:
+            if (f.read() == data_version.GetDataVersion(projects_layer) and
+                    not data_version.Expired(projects_layer,
+                                             os.path.getmtime(out_file))):
+                return None
+    return Publish(projects_layer, out_file, tolerance, digits)
+
+
+if __name__ == '__main__':
+    projects_layer = arcpy.GetParameterAsText(0) # Feature class or layer of the projects
+    out_file = arcpy.GetParameterAsText(1) # File, .geojson in a folder served by the web server
+    force = arcpy.GetParameterAsText(2) # Optional; Boolean, default False- publish even if nothing changed
+
+    try:
+        if force.lower() == "true":
+            count = Publish(projects_layer, out_file)
+        else:
+            count = PublishIfChanged(projects_layer, out_file)
+
+        if count is None:
+            arcpy.AddMessage("Projects haven't changed; {} not updated.".format(out_file))
+        else:
+            arcpy.AddMessage("Published {} active projects to {}.".format(count, out_file))
+
+    except Exception:
+        e = sys.exc_info()
+        tbinfo = traceback.format_tb(e[2])[0]
+        arcpy.AddError("%s\n%s" %(tbinfo, e[1]))
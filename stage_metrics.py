@@ -0,0 +1,215 @@
+#*****************************************************************************
+#
+#  Project:  Stage Metrics
+#  Purpose:  Time the stages of a script tool and keep a rolling local log of
+#            the timings with percentile summaries
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# Usage:
+#   timer = stage_metrics.StageTimer("precinct_finder")
+#   with timer.Stage("geocode"):
+#       arcpy.GeocodeAddresses_geocoding(...)
+#   ...
+#   messages.append(timer.Breakdown())
+#   timer.Log()
+#
+# Each call to Log() appends one line of JSON (timestamp and seconds per
+# stage) to <log folder>/<tool name>.jsonl and rewrites
+# <log folder>/<tool name>_summary.txt with the p50/p95/p99 of each stage over
+# the logged runs. Only the most recent max_entries runs are kept.
+#
+# The log folder defaults to an "arcpy_scripts_metrics" folder in the system
+# temp directory, which is local to the machine running the tool (unlike the
+# scratch folder, which is different for every GP service job).
+#
+# Logging is best-effort: a problem writing the log is reported as a warning
+# and never fails the tool itself.
+
+import arcpy
+import datetime
+import json
+import math
+import os
+import tempfile
+import time
+
+DEFAULT_LOG_FOLDER = os.path.join(tempfile.gettempdir(), "arcpy_scripts_metrics")
+
+# Number of runs to keep in the rolling log
+DEFAULT_MAX_ENTRIES = 2000
+
+PERCENTILES = [50, 95, 99]
+
+
+class _StageContext(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # Record failed stages too; they show where the time went before the
+        # error. Never swallow the exception.
+        self.timer.Record(self.name, time.time() - self.start)
+        return False
+
+
+class StageTimer(object):
+    '''
+    Collects the wall-clock time of each named stage of a tool run.
+    '''
+
+    def __init__(self, tool_name, log_folder=DEFAULT_LOG_FOLDER,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        '''
+        tool_name: Name used for the log files
+        log_folder: Folder to hold the rolling log and summary
+        max_entries: Number of runs to keep in the log
+        '''
+        self.tool_name = tool_name
+        self.log_folder = log_folder
+        self.max_entries = max_entries
+        self.start = time.time()
+
+        # [(stage name, seconds)] in the order they ran
+        self.stages = []
+
+    def Stage(self, name):
+        '''
+        Returns a context manager that times the enclosed block as stage name.
+        '''
+        return _StageContext(self, name)
+
+    def Record(self, name, seconds):
+        '''
+        Adds the time for a stage. A stage run more than once is summed.
+        '''
+        for i, (stage, total) in enumerate(self.stages):
+            if stage == name:
+                self.stages[i] = (stage, total + seconds)
+                return
+        self.stages.append((name, seconds))
+
+    def Total(self):
+        return time.time() - self.start
+
+    def Breakdown(self):
+        '''
+        Returns a one-line summary of this run's stage times in milliseconds,
+        for example "Timing (ms): setup 120, geocode 850, total 980"
+        '''
+        parts = ["{} {:.0f}".format(name, seconds * 1000)
+                 for name, seconds in self.stages]
+        parts.append("total {:.0f}".format(self.Total() * 1000))
+        return "Timing (ms): " + ", ".join(parts)
+
+    def Log(self):
+        '''
+        Appends this run to the rolling log, trims the log to max_entries, and
+        rewrites the percentile summary.
+
+        Returns: Summary text, or '' if the log couldn't be written
+        '''
+        try:
+            if not os.path.exists(self.log_folder):
+                os.makedirs(self.log_folder)
+
+            log_path = os.path.join(self.log_folder, self.tool_name + ".jsonl")
+            summary_path = os.path.join(self.log_folder,
+                                        self.tool_name + "_summary.txt")
+
+            entry = dict(self.stages)
+            entry["total"] = self.Total()
+            line = json.dumps({"time": datetime.datetime.now().isoformat(),
+                               "stages": entry})
+            with open(log_path, 'a') as log_file:
+                log_file.write(line + "\n")
+
+            with open(log_path, 'r') as log_file:
+                lines = log_file.readlines()
+
+            # Only rewrite the file once it has grown well past the limit so
+            # we aren't rewriting it on every run
+            if len(lines) > self.max_entries * 1.1:
+                lines = lines[-self.max_entries:]
+                with open(log_path, 'w') as log_file:
+                    log_file.writelines(lines)
+
+            runs = []
+            for l in lines:
+                try:
+                    runs.append(json.loads(l)["stages"])
+                except ValueError:
+                    continue  # Partially-written line from a concurrent run
+
+            summary = Summarize(runs)
+            with open(summary_path, 'w') as summary_file:
+                summary_file.write("{} runs of {}, updated {}\n".format(
+                    len(runs), self.tool_name,
+                    datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                summary_file.write(summary + "\n")
+
+            return summary
+
+        except Exception as e:
+            arcpy.AddWarning("Could not write timing log: {}".format(e))
+            return ''
+
+
+def Percentile(values, percent):
+    '''
+    Nearest-rank percentile of a list of numbers.
+    '''
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def Summarize(runs):
+    '''
+    Given a list of {stage: seconds} dictionaries, returns one line per stage
+    with its p50/p95/p99 in milliseconds.
+    '''
+    stage_names = []
+    for run in runs:
+        for name in run:
+            if name not in stage_names and name != "total":
+                stage_names.append(name)
+    stage_names.append("total")
+
+    lines = []
+    for name in stage_names:
+        values = [run[name] for run in runs if name in run]
+        stats = ", ".join("p{} {:.0f}".format(p, Percentile(values, p) * 1000)
+                          for p in PERCENTILES)
+        lines.append("{} (ms): {}".format(name, stats))
+    return "\n".join(lines)
@@ -0,0 +1,77 @@
+#*****************************************************************************
+#
+#  Project:  Worker Pool
+#  Purpose:  Multiprocessing pool setup that works from script tools
+#  Author:   Jacob Adams, jacob.adams@cachecounty.org
+#
+#*****************************************************************************
+# MIT License
+#
+# Copyright (c) 2018 Cache County
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#*****************************************************************************
+
+# On Windows, multiprocessing starts each worker by running sys.executable.
+# When a script tool runs in-process (ArcMap, ArcCatalog, or a GP service)
+# that is ArcMap.exe/ArcSOC.exe rather than python, so the pool has to be
+# pointed at the python that ships with ArcGIS.
+#
+# The worker processes import the calling script again, so any script that
+# uses a pool must keep its tool code under an
+#   if __name__ == '__main__':
+# block and keep the worker functions at the top level of the module (and
+# only pass them paths, not layers or other arcpy objects).
+
+import multiprocessing
+import os
+import sys
+
+
+def DefaultWorkers():
+    '''
+    Leave one core free for the parent process and everything else on the
+    machine.
+    '''
+    return max(1, multiprocessing.cpu_count() - 1)
+
+
+def PythonExecutable():
+    '''
+    Returns the path to a python executable for starting worker processes,
+    which is sys.executable unless that's an ArcGIS program.
+    '''
+    if sys.platform.startswith("win"):
+        exe = os.path.basename(sys.executable).lower()
+        if exe not in ("python.exe", "pythonw.exe"):
+            return os.path.join(sys.exec_prefix, "pythonw.exe")
+    return sys.executable
+
+
+def GetPool(workers=None):
+    '''
+    Returns a multiprocessing.Pool with the given number of workers (default:
+    one less than the number of cores), using a python executable that works
+    when called from inside an ArcGIS process.
+    '''
+    executable = PythonExecutable()
+    if executable != sys.executable:
+        multiprocessing.set_executable(executable)
+
+    return multiprocessing.Pool(workers or DefaultWorkers())